@@ -1,5 +1,10 @@
 import os
+import re
+import json
+import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 import logging
 import sys
@@ -19,73 +24,224 @@ logging.basicConfig(
 )
 # ------------------------------------------------------------------
 
-def find_and_clean_files(directory_path, dry_run, criteria):
+# Errores de borrado que se escriben también en el log; el resto solo va al manifiesto
+MAX_LOGGED_ERRORS = 20
+
+def compile_matcher(criteria):
+    """
+    Compila los criterios {texto: {"case_sensitive": bool}} en una función nombre -> bool que dice si el
+    archivo se MANTIENE (su nombre contiene alguno de los textos). Una sola expresión regular por tipo
+    de comparación en lugar de una comprobación por criterio y archivo.
+    """
+    exact = [re.escape(text) for text, options in criteria.items() if options.get("case_sensitive", True)]
+    folded = [re.escape(text) for text, options in criteria.items() if not options.get("case_sensitive", True)]
+    patterns = []
+    if exact:
+        patterns.append(re.compile("|".join(exact)).search)
+    if folded:
+        patterns.append(re.compile("|".join(folded), re.IGNORECASE).search)
+    return lambda name: any(search(name) for search in patterns)
+
+def describe_criteria(criteria):
+    return " O ".join(f"'{text}'" + ("" if options.get("case_sensitive", True) else " (sin distinguir mayúsculas)")
+                      for text, options in criteria.items())
+
+class DeletionManifest:
+    """
+    Manifiesto JSON con la lista de archivos borrados (o que se borrarían en simulación).
+    Se escribe por lotes según avanza el borrado, así que la lista no se guarda entera en memoria.
+    """
+
+    def __init__(self, path, directory, criteria, dry_run):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.errors = []
+        self._first = True
+        self._lock = threading.Lock()
+        self._file = open(self.path, "w", encoding="utf-8")
+        header = {"directory": str(directory), "criteria": criteria, "dry_run": dry_run,
+                  "started_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self._file.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "files": [\n')
+
+    def add(self, paths):
+        with self._lock:
+            for path in paths:
+                self._file.write(("" if self._first else ",\n") + json.dumps(path, ensure_ascii=False))
+                self._first = False
+
+    def close(self, summary):
+        self._file.write(f'\n], "errors": {json.dumps(self.errors, ensure_ascii=False)}, '
+                         f'"summary": {json.dumps(summary, ensure_ascii=False)}}}\n')
+        self._file.close()
+
+def scan_directory(directory, keep, exclude=frozenset()):
+    """
+    Lee un directorio con os.scandir (sin seguir enlaces a directorios). Devuelve
+    (subdirectorios, archivos a borrar, archivos mantenidos, error o None). Las rutas absolutas
+    de exclude (la carpeta de logs y el manifiesto) no se recorren ni se borran.
+    """
+    subdirs, to_delete, kept = [], [], 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if exclude and os.path.abspath(entry.path) in exclude:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        if keep(entry.name):
+                            kept += 1
+                        else:
+                            to_delete.append(entry.path)
+                except OSError:
+                    continue # Entrada que desaparece o no se puede leer durante el recorrido
+    except OSError as e:
+        return subdirs, to_delete, kept, f"{directory}: {e}"
+    return subdirs, to_delete, kept, None
+
+def delete_batch(paths):
+    """Borra un lote de archivos. Devuelve (borrados, [errores])."""
+    deleted, errors = [], []
+    for path in paths:
+        try:
+            os.unlink(path)
+            deleted.append(path)
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+    return deleted, errors
+
+def find_and_clean_files(directory_path, dry_run, criteria, workers=8, batch_size=1000, manifest_path=None,
+                         progress_interval=1.0):
     """
     Busca archivos en el directorio y subdirectorios.
-    Si dry_run es True, solo muestra los archivos a borrar.
-    Si dry_run es False, borra los archivos que no cumplen los criterios.
+    Si dry_run es True, solo registra en el manifiesto los archivos a borrar.
+    Si dry_run es False, borra (por lotes) los archivos que no cumplen los criterios.
+    El recorrido de directorios y el borrado se reparten entre `workers` hilos: os.scandir y unlink
+    liberan el GIL, y en discos de red o con millones de archivos el tiempo es sobre todo de espera.
     """
     dir_path = Path(directory_path)
 
     if not dir_path.exists() or not dir_path.is_dir():
         logging.critical(f"❌ La ruta proporcionada no existe o no es un directorio válido: {directory_path}")
-        return
+        return None
+
+    keep = compile_matcher(criteria)
+    manifest_path = manifest_path or os.path.join(log_dir, f"manifest_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    manifest = DeletionManifest(manifest_path, dir_path, criteria, dry_run)
 
-    logging.info(f"Escaneando directorio: '{directory_path}' para archivos...")
-    logging.info(f"Criterios para MANTENER el archivo: El nombre debe contener 'rubirico', 'Rubi' O '085205'.")
+    logging.info(f"Escaneando directorio: '{directory_path}' para archivos ({workers} hilos)...")
+    logging.info(f"Criterios para MANTENER el archivo: El nombre debe contener {describe_criteria(criteria)}.")
     logging.info(f"Modo: {'SIMULACIÓN (ningún archivo será borrado)' if dry_run else 'BORRADO REAL (¡PRECAUCIÓN!)'}")
 
-    files_to_delete_count = 0
-    files_kept_count = 0
-
-    for file_path in dir_path.rglob('*'): # Recorre recursivamente todos los archivos y directorios
-        if file_path.is_file(): # Solo procesar archivos
-            file_name = file_path.name
-            
-            # Verificar si el nombre del archivo contiene alguno de los criterios
-            # Usamos .lower() para 'rubirico' y 'Rubi' para que sea insensible a mayúsculas/minúsculas
-            # '085205' se busca literalmente
-            keep_file = False
-            if "rubirico" in file_name.lower():
-                keep_file = True
-            elif "Rubi" in file_name: # Aquí 'Rubi' es sensible a mayúsculas/minúsculas como lo pediste
-                keep_file = True
-            elif "085205" in file_name:
-                keep_file = True
-            
-            if not keep_file:
-                files_to_delete_count += 1
+    # Las salidas de este script no se borran aunque estén dentro de la carpeta que se limpia
+    exclude = frozenset(os.path.abspath(path) for path in (log_dir, manifest_path))
+    counts = {"directories": 0, "matched": 0, "kept": 0, "deleted": 0, "errors": 0}
+    started = last_progress = time.monotonic()
+    pending_batch = []
+
+    def record_error(message):
+        counts["errors"] += 1
+        manifest.errors.append(message)
+        if counts["errors"] <= MAX_LOGGED_ERRORS:
+            logging.error(f"[ERROR] {message}")
+        elif counts["errors"] == MAX_LOGGED_ERRORS + 1:
+            logging.error(f"[ERROR] Hay más errores; el resto solo se guarda en el manifiesto {manifest.path}.")
+
+    def show_progress(final=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        line = (f"\r📂 {counts['directories']} carpetas, {counts['matched'] + counts['kept']} archivos "
+                f"({(counts['matched'] + counts['kept']) / elapsed:.0f}/s), "
+                f"{counts['matched']} {'a borrar' if dry_run else 'coinciden'}, {counts['deleted']} borrados")
+        print(line, end="\n" if final else "", flush=True)
+
+    completed = False
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {pool.submit(scan_directory, str(dir_path), keep, exclude): ("scan", str(dir_path))}
+
+            def flush_batch():
+                batch = pending_batch[:]
+                pending_batch.clear()
                 if dry_run:
-                    logging.info(f"[SIMULACIÓN BORRADO] -> '{file_path}' (No cumple criterios)")
+                    manifest.add(batch)
                 else:
+                    running[pool.submit(delete_batch, batch)] = ("delete", batch)
+
+            while running:
+                done, _ = wait(running, timeout=progress_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, target = running.pop(future)
                     try:
-                        file_path.unlink() # Borrar el archivo
-                        logging.info(f"[BORRADO REAL] -> '{file_path}'")
+                        result = future.result()
                     except Exception as e:
-                        logging.error(f"[ERROR BORRADO] No se pudo borrar '{file_path}': {e}", exc_info=True)
-            else:
-                files_kept_count += 1
-                logging.debug(f"[MANTENIDO] -> '{file_path}' (Cumple criterios)") # Usa DEBUG para no saturar el log INFO
+                        # Un fallo inesperado en un directorio o lote no detiene el resto del recorrido
+                        record_error(f"{target}: {e}" if kind == "scan" else f"Lote de {len(target)} archivos: {e}")
+                        continue
+                    if kind == "scan":
+                        subdirs, to_delete, kept, error = result
+                        counts["directories"] += 1
+                        counts["kept"] += kept
+                        counts["matched"] += len(to_delete)
+                        if error:
+                            record_error(error)
+                        for subdir in subdirs:
+                            running[pool.submit(scan_directory, subdir, keep, exclude)] = ("scan", subdir)
+                        pending_batch.extend(to_delete)
+                        if len(pending_batch) >= batch_size:
+                            flush_batch()
+                    else:
+                        deleted, errors = result
+                        counts["deleted"] += len(deleted)
+                        manifest.add(deleted)
+                        for message in errors:
+                            record_error(message)
+                # El último lote incompleto se envía cuando ya no quedan directorios por leer
+                if pending_batch and not any(kind == "scan" for kind, _ in running.values()):
+                    flush_batch()
+                if time.monotonic() - last_progress >= progress_interval:
+                    show_progress()
+                    last_progress = time.monotonic()
+        completed = True
+    finally:
+        # El manifiesto queda como JSON válido aunque la ejecución se interrumpa (p. ej. con Ctrl+C)
+        show_progress(final=True)
+        elapsed = time.monotonic() - started
+        summary = {**counts, "completed": completed, "seconds": round(elapsed, 2),
+                   "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        manifest.close(summary)
 
     logging.info(f"--- Resumen del Proceso ---")
-    logging.info(f"Archivos encontrados que NO cumplen los criterios y serían borrados: {files_to_delete_count}")
-    logging.info(f"Archivos encontrados que SÍ cumplen los criterios y serían mantenidos: {files_kept_count}")
+    logging.info(f"Carpetas recorridas: {counts['directories']} en {elapsed:.1f}s "
+                 f"({(counts['matched'] + counts['kept']) / max(elapsed, 1e-9):.0f} archivos/s).")
+    logging.info(f"Archivos encontrados que NO cumplen los criterios y serían borrados: {counts['matched']}")
+    logging.info(f"Archivos encontrados que SÍ cumplen los criterios y serían mantenidos: {counts['kept']}")
+    if not dry_run:
+        logging.info(f"Archivos borrados: {counts['deleted']}; errores: {counts['errors']}.")
+    logging.info(f"Lista completa de archivos en el manifiesto: {manifest.path}")
     logging.info(f"Proceso finalizado. Revisa el log para detalles.")
-    
+
     if dry_run:
         print("\n🏁 Proceso de SIMULACIÓN finalizado. NINGÚN archivo fue borrado.")
-        print("Revisa el log en 'logs_file_cleanup/file_cleanup.log' para ver qué archivos *serían* borrados.")
+        print(f"Revisa el manifiesto '{manifest.path}' para ver qué archivos *serían* borrados.")
         print("Si la lista es correcta, vuelve a ejecutar el script añadiendo '--confirm-delete' al comando.")
     else:
-        print("\n🏁 Proceso de BORRADO REAL finalizado. Revisa el log en 'logs_file_cleanup/file_cleanup.log' para más detalles.")
+        print(f"\n🏁 Proceso de BORRADO REAL finalizado. Los archivos borrados están en el manifiesto '{manifest.path}'.")
         print("¡Los archivos listados como BORRADOS han sido eliminados de forma PERMANENTE!")
+    return summary
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Borra archivos que NO contienen criterios específicos en su nombre.")
     parser.add_argument("directory", help="Ruta de la carpeta donde buscar archivos.")
-    parser.add_argument("--confirm-delete", action="store_true", 
+    parser.add_argument("--confirm-delete", action="store_true",
                         help="¡CONFIRMA EL BORRADO REAL! Por defecto, el script solo simula el borrado.")
+    parser.add_argument("--criteria", help="Archivo JSON con los criterios, con el mismo formato que search_criteria: "
+                                           "{\"texto\": {\"case_sensitive\": true}}. Por defecto, los criterios de abajo.")
+    parser.add_argument("--workers", type=int, default=8, help="Hilos para recorrer carpetas y borrar (por defecto 8).")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Archivos por lote de borrado (por defecto 1000).")
+    parser.add_argument("--manifest", help="Ruta del manifiesto JSON (por defecto logs_file_cleanup/manifest_<fecha>.json).")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="Segundos entre actualizaciones del progreso (por defecto 1).")
     args = parser.parse_args()
 
     # Definimos los criterios de búsqueda. El script busca "rubirico", "Rubi" o "085205".
@@ -96,5 +252,16 @@ if __name__ == "__main__":
         "Rubi": {"case_sensitive": True},    # Buscamos "Rubi" (exacto)
         "085205": {"case_sensitive": True}   # Buscamos "085205" (exacto)
     }
+    if args.criteria:
+        with open(args.criteria, encoding="utf-8") as f:
+            search_criteria = json.load(f)
+    if not search_criteria:
+        # Sin criterios no se mantendría ningún archivo
+        logging.critical("❌ No hay criterios: se borrarían todos los archivos. Revisa --criteria.")
+        sys.exit(1)
+    if args.workers < 1 or args.batch_size < 1:
+        logging.critical("❌ --workers y --batch-size deben ser al menos 1.")
+        sys.exit(1)
 
-    find_and_clean_files(args.directory, not args.confirm_delete, search_criteria)
\ No newline at end of file
+    find_and_clean_files(args.directory, not args.confirm_delete, search_criteria, args.workers, args.batch_size,
+                         args.manifest, args.progress_interval)
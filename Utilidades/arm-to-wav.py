@@ -1,23 +1,43 @@
+"""
+Conversión de grabaciones AMR a WAV (16-bit PCM) con Sox.
+
+Convierte en paralelo, conserva la estructura de subcarpetas de la entrada y no vuelve a convertir
+los archivos cuyo WAV ya existe y es más reciente que el original. Con --process no escribe WAV
+intermedios: los AMR pasan directamente por VocalClarityPro, que los decodifica en memoria.
+
+Uso:
+    python Utilidades/arm-to-wav.py /home/xx/GrabacionesDeVozAMR
+    python Utilidades/arm-to-wav.py /home/xx/GrabacionesDeVozAMR --output wavs --jobs 8
+    python Utilidades/arm-to-wav.py /home/xx/GrabacionesDeVozAMR --process --denoise --normalize
+"""
+import argparse
 import os
 import subprocess
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import logging
 import sys
 
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+import VocalClarityPro as vcp # Importación ligera: torch y torchaudio se cargan al usarse (solo con --process)
+
 # --- Configuración del Logging ---
 # Los logs se guardarán en una carpeta específica para la conversión de AMR a WAV
-log_dir = "logs_amr_to_wav_conversion"
-os.makedirs(log_dir, exist_ok=True)
-log_file_path = os.path.join(log_dir, "amr_to_wav_conversion.log")
-
-logging.basicConfig(
-    level=logging.INFO, # Nivel mínimo de mensajes a registrar
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_path, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+def setup_logging(log_dir="logs_amr_to_wav_conversion"):
+    os.makedirs(log_dir, exist_ok=True)
+    log_file_path = os.path.join(log_dir, "amr_to_wav_conversion.log")
+    logging.basicConfig(
+        level=logging.INFO, # Nivel mínimo de mensajes a registrar
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file_path, encoding='utf-8'),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    return log_file_path
 # ------------------------------------------------------------------
 
 def check_sox_installed():
@@ -31,87 +51,162 @@ def check_sox_installed():
         logging.critical("Por favor, instala Sox. En Arch Linux: sudo pacman -S sox")
         return False
 
-def convert_amr_to_wav(input_path, output_dir):
+def find_amr_files(input_folder, extensions=(".amr",)):
+    """Busca recursivamente los archivos con esas extensiones (sin distinguir mayúsculas). Devuelve una lista ordenada."""
+    found = []
+    for root, _, names in os.walk(input_folder):
+        found.extend(Path(root) / name for name in names if Path(name).suffix.lower() in extensions)
+    return sorted(found)
+
+def is_up_to_date(source, target):
+    """True si target existe y es al menos tan reciente como source."""
+    try:
+        return target.stat().st_mtime_ns >= source.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def wav_seconds(path):
+    try:
+        with wave.open(str(path), "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (OSError, wave.Error, ZeroDivisionError):
+        return 0.0
+
+def convert_amr_to_wav(input_path, output_path, timeout=3600):
     """
     Convierte un archivo AMR a formato WAV (16-bit PCM).
     Sox es excelente para esto ya que AMR es un formato de voz.
+    Se escribe en un archivo temporal que se renombra al terminar: un WAV a medias (conversión
+    interrumpida o fallida) nunca pasa por convertido en la siguiente ejecución.
+    Devuelve los segundos de audio convertidos, o None si falló.
     """
-    input_path = Path(input_path)
-    # Crear la ruta de salida con el mismo nombre y extensión .wav
-    output_path = Path(output_dir) / (input_path.stem + ".wav")
-
-    if output_path.exists():
-        logging.warning(f"El archivo WAV de salida ya existe, sobrescribiendo: {output_path}")
-        output_path.unlink() # Eliminar el archivo existente
-
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Sox deduce el formato de la extensión, así que el temporal también acaba en .wav
+    tmp_path = output_path.with_name(f".{output_path.stem}.{os.getpid()}.tmp.wav")
     try:
         logging.info(f"Convirtiendo {input_path} (AMR) a {output_path} (WAV)...")
         # Usamos -b 16 para asegurar que el WAV de salida sea de 16 bits PCM.
-        # Sox manejará la descompresión de AMR a WAV de forma automática.
         result = subprocess.run(
-            ["sox", str(input_path), "-b", "16", str(output_path)],
+            ["sox", str(input_path), "-b", "16", str(tmp_path)],
             check=True,
             capture_output=True,
             text=True,
-            timeout=3600 # Tiempo límite de 1 hora para archivos muy grandes
+            timeout=timeout
         )
+        os.replace(tmp_path, output_path)
         logging.info(f"[✅] Archivo convertido con éxito: {output_path}")
-        if result.stdout:
-            logging.debug(f"Sox Stdout: {result.stdout.strip()}")
         if result.stderr:
             logging.debug(f"Sox Stderr: {result.stderr.strip()}")
-        return True
+        return wav_seconds(output_path)
     except subprocess.TimeoutExpired:
-        logging.error(f"[⚠️] La conversión de {input_path} a WAV excedió el tiempo límite ({3600/3600} hora).")
-        if output_path.exists():
-            output_path.unlink()
-        return False
+        logging.error(f"[⚠️] La conversión de {input_path} a WAV excedió el tiempo límite ({timeout}s).")
     except subprocess.CalledProcessError as e:
         logging.error(f"[❌] Error al convertir {input_path} a WAV: {e.returncode}")
-        logging.error(f"  Stdout (Sox): {e.stdout.strip()}")
         logging.error(f"  Stderr (Sox): {e.stderr.strip()}")
-        if output_path.exists():
-            output_path.unlink()
-        return False
     except FileNotFoundError:
         logging.error("El comando 'sox' no fue encontrado. Esto debería ser detectado al inicio.")
-        return False
     except Exception as e:
         logging.error(f"[❌] Error inesperado al procesar {input_path}: {e}", exc_info=True)
-        return False
+    if tmp_path.exists():
+        tmp_path.unlink()
+    return None
 
-if __name__ == "__main__":
-    if not check_sox_installed():
-        sys.exit(1)
+def convert_all(pending, jobs, timeout):
+    """
+    Convierte [(amr, wav)] con un pool de `jobs` procesos de Sox (los hilos solo esperan al subproceso).
+    Devuelve (convertidos, fallidos, segundos de audio convertidos).
+    """
+    converted = failed = 0
+    audio_seconds = 0.0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(convert_amr_to_wav, source, target, timeout) for source, target in pending]
+        for future in as_completed(futures):
+            seconds = future.result()
+            if seconds is None:
+                failed += 1
+            else:
+                converted += 1
+                audio_seconds += seconds
+    return converted, failed, audio_seconds
+
+def process_with_vocalclarity(pending, args):
+    """
+    Pasa los AMR directamente a VocalClarityPro: se decodifican con ffmpeg/sox en memoria, sin WAV
+    intermedio, y se procesan con el modelo cargado una sola vez. Cada subcarpeta se procesa hacia
+    su carpeta de salida correspondiente. Devuelve (procesados, fallidos).
+    """
+    logging.info("Cargando el modelo Demucs 'htdemucs' para procesar los AMR sin conversión intermedia...")
+    engine = vcp.VocalClarityEngine(snapshot_path=args.model_snapshot, accel=args.accel, denoise=args.denoise,
+                                    normalize=args.normalize, native_postprocess=args.native_postprocess)
+    by_folder = {}
+    for source, target in pending:
+        by_folder.setdefault(target.parent, []).append(source)
+    ok = 0
+    for output_dir, files in by_folder.items():
+        ok += engine.process_files(files, engine.file_options(output_dir), pipeline=True, prefetch=args.jobs, writer_threads=2)
+    return ok, len(pending) - ok
 
-    # Pedimos al usuario la ruta de la carpeta que contiene los archivos AMR
-    input_folder_str = input("Introduce la ruta de la CARPETA que contiene los archivos AMR a convertir a WAV: ")
-    input_folder = Path(input_folder_str)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convierte grabaciones AMR a WAV (16-bit PCM) con Sox, en paralelo.")
+    parser.add_argument("input", help="Carpeta con los archivos AMR (se recorre con sus subcarpetas).")
+    parser.add_argument("--output", default="converted_amr_to_wav_files", help="Carpeta de salida; se replica la estructura de subcarpetas de la entrada (por defecto converted_amr_to_wav_files).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Conversiones de Sox simultáneas (por defecto, el número de CPUs).")
+    parser.add_argument("--timeout", type=float, default=3600, help="Tiempo límite por archivo en segundos (por defecto 3600).")
+    parser.add_argument("--force", action="store_true", help="Convertir de nuevo aunque el WAV ya exista y sea más reciente que el AMR.")
+    parser.add_argument("--process", action="store_true", help="No escribe WAV: procesa los AMR directamente con VocalClarityPro (decodificación en memoria).")
+    parser.add_argument("--process-output", default="processed_audio_clarity", help="Con --process, carpeta de salida de VocalClarityPro (por defecto processed_audio_clarity).")
+    parser.add_argument("--denoise", action="store_true", help="Con --process, aplicar reducción de ruido a las voces.")
+    parser.add_argument("--normalize", action="store_true", help="Con --process, normalizar el volumen de las voces.")
+    parser.add_argument("--native-postprocess", action="store_true", help="Con --process, post-procesar a la frecuencia original (8 kHz en AMR-NB), más rápido.")
+    parser.add_argument("--accel", default="inference", choices=vcp.ACCEL_MODES, help="Con --process, modo --accel de VocalClarityPro (por defecto inference).")
+    parser.add_argument("--model-snapshot", help="Con --process, instantánea del modelo como en VocalClarityPro --model-snapshot.")
+    args = parser.parse_args()
 
-    if not input_folder.exists() or not input_folder.is_dir():
-        logging.critical(f"❌ La ruta proporcionada no existe o no es un directorio válido: {input_folder_str}")
+    log_file_path = setup_logging()
+    if args.jobs < 1:
+        logging.critical(f"❌ --jobs debe ser al menos 1 (se recibió {args.jobs}).")
+        sys.exit(1)
+    if not args.process and not check_sox_installed(): # Con --process VocalClarityPro usa ffmpeg o sox
         sys.exit(1)
 
-    output_base_dir = "converted_amr_to_wav_files"
-    os.makedirs(output_base_dir, exist_ok=True)
-    logging.info(f"Los archivos WAV convertidos se guardarán en: {output_base_dir}")
-
-    files_to_convert = []
-    # Solo buscamos archivos .amr, ya que es el enfoque del script
-    amr_ext = ".amr" 
+    input_folder = Path(args.input)
+    if not input_folder.is_dir():
+        logging.critical(f"❌ La ruta proporcionada no existe o no es un directorio válido: {args.input}")
+        sys.exit(1)
 
     logging.info(f"Escaneando directorio: {input_folder} y sus subdirectorios para archivos AMR...")
-    # rglob busca recursivamente en subdirectorios
-    files_to_convert.extend(input_folder.rglob(f"*{amr_ext}"))
-    
+    files_to_convert = find_amr_files(input_folder)
     if not files_to_convert:
-        logging.warning(f"No se encontraron archivos {amr_ext} en el directorio: {input_folder} o sus subdirectorios para convertir a WAV.")
+        logging.warning(f"No se encontraron archivos .amr en el directorio: {input_folder} o sus subdirectorios para convertir a WAV.")
         sys.exit(0) # Salir limpiamente si no hay archivos
-    
-    logging.info(f"Se encontraron {len(files_to_convert)} archivos AMR para convertir a WAV.")
 
-    for amr_file in files_to_convert:
-        convert_amr_to_wav(amr_file, output_base_dir)
+    # Cada AMR tiene su salida en la misma ruta relativa: dos archivos con el mismo nombre en
+    # subcarpetas distintas ya no se sobrescriben entre sí
+    if args.process:
+        targets = [Path(args.process_output) / source.relative_to(input_folder).parent / (source.stem + "_vocalclarity.wav")
+                   for source in files_to_convert]
+    else:
+        output_base_dir = Path(args.output)
+        targets = [(output_base_dir / source.relative_to(input_folder)).with_suffix(".wav") for source in files_to_convert]
+    pending = [(source, target) for source, target in zip(files_to_convert, targets) if args.force or not is_up_to_date(source, target)]
+    skipped = len(files_to_convert) - len(pending)
+    logging.info(f"Se encontraron {len(files_to_convert)} archivos AMR: {len(pending)} por convertir, {skipped} ya actualizados.")
+
+    started = time.perf_counter()
+    audio_seconds = 0.0
+    if not pending:
+        converted = failed = 0
+    elif args.process:
+        converted, failed = process_with_vocalclarity(pending, args)
+    else:
+        logging.info(f"Los archivos WAV convertidos se guardarán en: {output_base_dir} ({args.jobs} conversiones simultáneas)")
+        converted, failed, audio_seconds = convert_all(pending, args.jobs, args.timeout)
+    elapsed = time.perf_counter() - started
 
+    rate = f"{converted / elapsed:.1f} archivos/s" if elapsed > 0 else "-"
+    if audio_seconds and elapsed > 0:
+        rate += f", {audio_seconds / elapsed:.0f}x tiempo real ({audio_seconds / 3600:.2f} h de audio)"
+    logging.info(f"[📊] {converted} {'procesados' if args.process else 'convertidos'}, {skipped} omitidos (ya actualizados), {failed} con error en {elapsed:.1f}s ({rate}).")
     logging.info("🏁 Proceso de conversión de AMR a WAV finalizado.")
-    print(f"\n🏁 Proceso de conversión de AMR a WAV finalizado. Revisa '{log_dir}/amr_to_wav_conversion.log' para más detalles.")
\ No newline at end of file
+    print(f"\n🏁 Proceso de conversión de AMR a WAV finalizado. Revisa '{log_file_path}' para más detalles.")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,377 @@
+"""
+Banco de pruebas reproducible y sin red para VocalClarityPro.
+
+Genera audio sintético (varias duraciones, canales, frecuencias de muestreo y formatos, incluidos
+los que se decodifican por tubería con ffmpeg/sox), ejecuta el pipeline de extremo a extremo y por
+etapas, y guarda en JSON el tiempo, el factor de tiempo real, los archivos por hora y el pico de
+memoria (RSS) de cada caso. Cada caso corre en un subproceso propio para que el pico de RSS sea suyo.
+
+Por defecto se usa un modelo sustituto con las mismas formas de tensor que htdemucs, así que no hace
+falta red ni descargar pesos. Con --model htdemucs se usa el modelo real, y con --model modulo:funcion
+cualquier fábrica que devuelva un modelo compatible con apply_model.
+
+Uso:
+    python Utilidades/benchmark.py --suite quick --output resultados.json
+    python Utilidades/benchmark.py --save-baseline Utilidades/baseline.json
+    python Utilidades/benchmark.py --baseline Utilidades/baseline.json --tolerance 0.15
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import product
+from pathlib import Path
+
+import torch
+import torchaudio
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Formatos que torchaudio escribe directamente; el resto se codifica con ffmpeg o sox a partir de un WAV.
+NATIVE_FORMATS = {"wav", "flac"}
+ENCODER_ARGS = {
+    "m4a": ["-c:a", "aac", "-b:a", "192k"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    "ogg": ["-c:a", "libvorbis", "-q:a", "5"],
+    "amr": ["-c:a", "libopencore_amrnb", "-ar", "8000", "-ac", "1", "-b:a", "12.2k"],
+}
+
+SUITES = {
+    # Suficiente para comparar cambios en pocos minutos.
+    "quick": [
+        {"format": "wav", "sample_rate": 44100, "channels": 2, "duration": 10},
+        {"format": "wav", "sample_rate": 44100, "channels": 2, "duration": 60},
+        {"format": "wav", "sample_rate": 22050, "channels": 1, "duration": 10},
+        {"format": "flac", "sample_rate": 48000, "channels": 2, "duration": 10},
+        {"format": "m4a", "sample_rate": 44100, "channels": 2, "duration": 10},
+    ],
+    "full": [
+        {"format": fmt, "sample_rate": sr, "channels": ch, "duration": dur}
+        for fmt, sr, ch, dur in product(["wav", "flac", "m4a", "mp3"], [22050, 44100, 48000], [1, 2], [10, 60, 300])
+    ],
+}
+
+# Métricas que se comparan con la línea base (todas son "menos es mejor").
+COMPARED_METRICS = ["end_to_end_s", "peak_rss_mb"]
+
+
+def case_id(case):
+    return f"{case['format']}-{case['sample_rate']}hz-{case['channels']}ch-{case['duration']}s"
+
+
+# --- Modelo sustituto ---
+class StandInSeparator(torch.nn.Module):
+    """
+    Sustituto determinista de htdemucs: mismas fuentes, frecuencia, canales y segmento, y la misma
+    forma de salida (batch, fuentes, canales, muestras). Reparte la mezcla en bandas con filtros FIR
+    fijos, de modo que el coste crece con la duración como en el modelo real (aunque mucho menor).
+    """
+    def __init__(self, sources=("drums", "bass", "other", "vocals"), samplerate=44100, audio_channels=2,
+                 segment=7.8, taps=255):
+        super().__init__()
+        self.sources = list(sources)
+        self.samplerate = samplerate
+        self.audio_channels = audio_channels
+        self.segment = segment
+        # Bandas de paso (Hz) por fuente; la de voces cubre la banda vocal principal.
+        bands = {"drums": (4000, samplerate / 2), "bass": (20, 250), "other": (250, 4000), "vocals": (300, 3400)}
+        t = torch.arange(taps) - (taps - 1) / 2
+        window = torch.hann_window(taps, periodic=False)
+        kernels = []
+        for name in self.sources:
+            low, high = bands.get(name, (20, samplerate / 2))
+            kernel = (2 * high / samplerate) * torch.sinc(2 * high / samplerate * t) \
+                - (2 * low / samplerate) * torch.sinc(2 * low / samplerate * t)
+            kernels.append(kernel * window)
+        weight = torch.stack(kernels).unsqueeze(1).repeat(audio_channels, 1, 1)
+        self.register_buffer("weight", weight)  # (canales*fuentes, 1, taps)
+
+    def forward(self, mix):
+        batch, channels, length = mix.shape
+        # Cada canal de entrada se filtra con el banco de fuentes (convolución agrupada por canal).
+        out = torch.nn.functional.conv1d(mix.repeat_interleave(len(self.sources), dim=1), self.weight,
+                                         padding=self.weight.shape[-1] // 2, groups=channels * len(self.sources))
+        return out.view(batch, channels, len(self.sources), length).transpose(1, 2).contiguous()
+
+
+def load_model(spec):
+    """
+    'standin' (por defecto), 'htdemucs' (descarga o usa la caché de Demucs) o 'modulo:funcion'.
+    """
+    if spec == "standin":
+        return StandInSeparator().eval()
+    if ":" in spec:
+        module_name, factory_name = spec.split(":", 1)
+        return getattr(importlib.import_module(module_name), factory_name)().eval()
+    from demucs.pretrained import get_model
+    return get_model(name=spec).eval()
+
+
+# --- Audio sintético ---
+def synthesize(duration, sample_rate, channels, seed=0):
+    """
+    Mezcla determinista parecida a una grabación de voz: armónicos con vibrato (voz), un bajo,
+    golpes percusivos y ruido de fondo. Devuelve un tensor (canales, muestras) en [-1, 1].
+    """
+    generator = torch.Generator().manual_seed(seed)
+    n = int(duration * sample_rate)
+    t = torch.arange(n, dtype=torch.float64) / sample_rate
+    f0 = 180 + 20 * torch.sin(2 * math.pi * 5 * t)  # Vibrato de 5 Hz
+    phase = 2 * math.pi * torch.cumsum(f0, dim=0) / sample_rate
+    envelope = 0.5 + 0.5 * torch.sin(2 * math.pi * 0.7 * t).clamp(min=0)  # Frases con pausas
+    voice = sum(torch.sin(k * phase) / k for k in range(1, 8)) * envelope
+    bass = 0.5 * torch.sin(2 * math.pi * 55 * t)
+    beat = (t * 2) % 1.0
+    drums = torch.exp(-beat * 30) * torch.randn(n, generator=generator, dtype=torch.float64)
+    noise = 0.05 * torch.randn(channels, n, generator=generator, dtype=torch.float64)
+    mix = (0.4 * voice + 0.3 * bass + 0.3 * drums).unsqueeze(0).repeat(channels, 1) + noise
+    if channels > 1:
+        mix[1:] *= 0.9  # Ligera diferencia entre canales
+    return (0.9 * mix / mix.abs().max()).float()
+
+
+def write_input(case, workdir):
+    """
+    Escribe el audio del caso en su formato. Devuelve la ruta o None si no hay codificador disponible.
+    """
+    audio = synthesize(case["duration"], case["sample_rate"], case["channels"])
+    wav_path = Path(workdir) / f"{case_id(case)}.wav"
+    torchaudio.save(str(wav_path), audio, case["sample_rate"], encoding="PCM_S", bits_per_sample=16)
+    if case["format"] == "wav":
+        return wav_path
+    output_path = wav_path.with_suffix(f".{case['format']}")
+    if case["format"] in NATIVE_FORMATS:
+        torchaudio.save(str(output_path), audio, case["sample_rate"])
+    elif shutil.which("ffmpeg") and case["format"] in ENCODER_ARGS:
+        command = ["ffmpeg", "-nostdin", "-v", "error", "-y", "-i", str(wav_path), *ENCODER_ARGS[case["format"]], str(output_path)]
+        if subprocess.run(command, capture_output=True).returncode != 0:
+            return None
+    elif shutil.which("sox"):
+        if subprocess.run(["sox", str(wav_path), str(output_path)], capture_output=True).returncode != 0:
+            return None
+    else:
+        return None
+    wav_path.unlink()
+    return output_path
+
+
+# --- Ejecución de un caso (en su propio subproceso) ---
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss está en KB en Linux y en bytes en macOS.
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(case, options):
+    """
+    Ejecuta un caso: tiempos por etapa y de extremo a extremo (mediana de --repeat repeticiones tras
+    --warmup de calentamiento) y pico de RSS. Se llama en un subproceso con el directorio de trabajo
+    apuntando a una carpeta temporal, que es donde VocalClarityPro deja su log.
+    """
+    torch.manual_seed(0)
+    torch.set_num_threads(options["threads"])
+    sys.path.insert(0, str(REPO_DIR))
+    import VocalClarityPro as vcp
+
+    # Solo el log a archivo: la consola del subproceso se reserva para el resultado JSON.
+    vcp.setup_logging(console=False)
+
+    workdir = Path.cwd()
+    input_path = write_input(case, workdir)
+    if input_path is None:
+        return {"case": case_id(case), **case, "skipped": f"no hay codificador para .{case['format']}"}
+
+    model = vcp.prepare_model(load_model(options["model"]), options["accel"])
+    sources = getattr(model, "sources", vcp.DEFAULT_SOURCES)
+    model_sr = int(getattr(model, "samplerate", 44100))
+    output_dir = workdir / "out"
+    output_dir.mkdir(exist_ok=True)
+    denoise, normalize, save_stems = options["denoise"], options["normalize"], options["save_stems"]
+
+    def one_run():
+        stages = {}
+        stages["decode"], (waveform, sr) = _timed(vcp.load_audio, str(input_path))
+        stages["prepare"], prepared = _timed(vcp.prepare_waveform, waveform, input_path)
+        stages["resample"], prepared = _timed(vcp.resample, prepared, sr, model_sr)
+        with torch.no_grad():
+            stages["separate"], stems = _timed(vcp.separate, model, prepared, "cpu", input_path)
+        plan = vcp.plan_outputs(sources, input_path, output_dir, save_stems)
+        tracks = torch.stack([vcp.extract_output(stems, indices) for _, indices, _ in plan])
+        if denoise:
+            stages["denoise"], tracks = _timed(vcp.denoise_batch, tracks, model_sr, options["denoise_engine"])
+        if normalize:
+            stages["normalize"], _ = _timed(lambda: [vcp.normalize_volume(track) for track in tracks])
+        stages["write"], _ = _timed(vcp.write_stems, stems, model_sr, input_path, output_dir, False, False,
+                                    save_stems, sources, output_sr=sr)
+        with torch.no_grad():
+            end_to_end, ok = _timed(vcp.process_file, model, input_path, output_dir, denoise, normalize,
+                                    save_stems, "cpu", denoise_engine=options["denoise_engine"])
+        if not ok:
+            raise RuntimeError(f"process_file falló para {input_path}; revisa logs/audio_processing.log")
+        return stages, end_to_end
+
+    for _ in range(options["warmup"]):
+        one_run()
+    runs = [one_run() for _ in range(options["repeat"])]
+
+    end_to_end = statistics.median(e2e for _, e2e in runs)
+    stages = {name: statistics.median(stages[name] for stages, _ in runs) for name in runs[0][0]}
+    return {
+        "case": case_id(case),
+        **case,
+        "decoder": vcp._external_decoder() if vcp._decoder_by_extension.get(input_path.suffix.lower()) == "pipe" else "torchaudio",
+        "stages_s": {name: round(value, 4) for name, value in stages.items()},
+        "end_to_end_s": round(end_to_end, 4),
+        "end_to_end_runs_s": [round(e2e, 4) for _, e2e in runs],
+        "real_time_factor": round(end_to_end / case["duration"], 4),
+        "files_per_hour": round(3600 / end_to_end, 1),
+        "peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_rss_children_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+
+def run_case_in_subprocess(case, options):
+    workdir = tempfile.mkdtemp(prefix="vcp_bench_")
+    try:
+        command = [sys.executable, str(Path(__file__).resolve()), "--run-case", json.dumps({"case": case, "options": options})]
+        completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+        if completed.returncode != 0:
+            return {"case": case_id(case), **case, "error": (completed.stderr.strip().splitlines() or ["sin salida"])[-1]}
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- Informe y comparación ---
+def environment_info(options):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torchaudio": torchaudio.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        **options,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compara cada caso con la línea base. Devuelve la lista de regresiones (cociente > 1 + tolerance).
+    """
+    previous = {case["case"]: case for case in baseline.get("cases", []) if "end_to_end_s" in case}
+    regressions = []
+    print(f"\n{'caso':34} {'métrica':14} {'base':>10} {'actual':>10} {'cociente':>9}")
+    for case in results:
+        if case["case"] not in previous or "end_to_end_s" not in case:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous[case["case"]][metric], case[metric]
+            ratio = new / old if old else float("inf")
+            flag = " ⚠️" if ratio > 1 + tolerance else ""
+            print(f"{case['case']:34} {metric:14} {old:10.3f} {new:10.3f} {ratio:9.2f}{flag}")
+            if flag:
+                regressions.append({"case": case["case"], "metric": metric, "baseline": old, "current": new,
+                                    "ratio": round(ratio, 3)})
+    if baseline.get("environment", {}).get("platform") != platform.platform():
+        print("Aviso: la línea base se midió en otra plataforma; los cocientes son orientativos.")
+    return regressions
+
+
+def print_summary(results):
+    print(f"\n{'caso':34} {'decodificador':13} {'extremo a extremo':>17} {'RTF':>7} {'arch/h':>8} {'RSS MB':>8}")
+    for case in results:
+        if "end_to_end_s" not in case:
+            print(f"{case['case']:34} {case.get('skipped') or case.get('error')}")
+            continue
+        print(f"{case['case']:34} {case['decoder']:13} {case['end_to_end_s']:16.3f}s {case['real_time_factor']:7.3f} "
+              f"{case['files_per_hour']:8.0f} {case['peak_rss_mb']:8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de pruebas reproducible de VocalClarityPro (sin red).")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick", help="Conjunto de casos a ejecutar (por defecto quick).")
+    parser.add_argument("--only", action="append", default=[], help="Ejecuta solo los casos cuyo identificador contenga este texto (repetible).")
+    parser.add_argument("--model", default="standin", help="'standin' (sin red, por defecto), 'htdemucs' o 'modulo:funcion'.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones medidas por caso; se informa la mediana (por defecto 3).")
+    parser.add_argument("--warmup", type=int, default=1, help="Repeticiones de calentamiento no medidas (por defecto 1).")
+    parser.add_argument("--threads", type=int, default=1, help="Hilos de torch por caso, fijos para que los resultados sean comparables (por defecto 1).")
+    parser.add_argument("--no-denoise", action="store_true", help="Excluye la reducción de ruido.")
+    parser.add_argument("--no-normalize", action="store_true", help="Excluye la normalización.")
+    parser.add_argument("--save-stems", action="store_true", help="Escribe también todos los stems.")
+    parser.add_argument("--denoise-engine", choices=["torch", "noisereduce"], default="torch", help="Motor de reducción de ruido (por defecto torch).")
+    parser.add_argument("--accel", choices=["none", "inference", "int8", "bf16", "compile"], default="inference", help="Modo de aceleración de la inferencia, como --accel de VocalClarityPro (por defecto inference).")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados.")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar.")
+    parser.add_argument("--save-baseline", help="Guarda los resultados como nueva línea base en este archivo.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento relativo tolerado antes de marcar una regresión (por defecto 0.10).")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Termina con código 1 si hay regresiones frente a --baseline.")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        payload = json.loads(args.run_case)
+        print(json.dumps(run_case(payload["case"], payload["options"])))
+        return 0
+
+    options = {
+        "model": args.model,
+        "repeat": max(1, args.repeat),
+        "warmup": max(0, args.warmup),
+        "threads": max(1, args.threads),
+        "denoise": not args.no_denoise,
+        "normalize": not args.no_normalize,
+        "save_stems": args.save_stems,
+        "denoise_engine": args.denoise_engine,
+        "accel": args.accel,
+    }
+    cases = [case for case in SUITES[args.suite] if not args.only or any(text in case_id(case) for text in args.only)]
+    if not cases:
+        print("Ningún caso coincide con --only.")
+        return 1
+
+    results = []
+    for index, case in enumerate(cases, 1):
+        print(f"[{index}/{len(cases)}] {case_id(case)}...", flush=True)
+        results.append(run_case_in_subprocess(case, options))
+
+    report = {"environment": environment_info(options), "suite": args.suite, "cases": results}
+    print_summary(results)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        print(f"\n{len(regressions)} regresión(es) por encima del {args.tolerance:.0%}.")
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {path}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Cliente del modo servidor de VocalClarityPro (python VocalClarityPro.py --serve).
+
+Envía uno o varios archivos como trabajos y, con --wait, espera a que terminen mostrando su estado.
+Solo usa la biblioteca estándar, así que sirve para probar el servidor sin servicios externos.
+
+Uso:
+    python Utilidades/vcp_client.py submit grabacion.wav otra.mp3 --denoise --normalize --wait
+    python Utilidades/vcp_client.py --socket /tmp/vcp.sock status <id>
+    python Utilidades/vcp_client.py list
+    python Utilidades/vcp_client.py cancel <id>
+    python Utilidades/vcp_client.py health
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection sobre un socket Unix (el servidor habla el mismo HTTP que en TCP)."""
+
+    def __init__(self, socket_path, timeout=30):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    def __init__(self, host="127.0.0.1", port=8765, socket_path=None):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+
+    def request(self, method, path, payload=None):
+        connection = UnixHTTPConnection(self.socket_path) if self.socket_path else http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+
+    def submit(self, path, **options):
+        return self.request("POST", "/jobs", {"path": os.path.abspath(path), **options})
+
+    def status(self, job_id):
+        return self.request("GET", f"/jobs/{job_id}")
+
+    def wait(self, job_ids, interval=0.5):
+        """Espera a que todos los trabajos terminen. Devuelve sus estados finales."""
+        pending, finished = list(job_ids), {}
+        while pending:
+            for job_id in list(pending):
+                status, job = self.status(job_id)
+                if status != 200 or job["status"] in ("done", "failed", "cancelled"):
+                    finished[job_id] = job
+                    pending.remove(job_id)
+            if pending:
+                time.sleep(interval)
+        return [finished[job_id] for job_id in job_ids]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cliente del servidor de VocalClarityPro.")
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección del servidor (por defecto 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="Puerto del servidor (por defecto 8765).")
+    parser.add_argument("--socket", help="Socket Unix del servidor, en lugar de --host/--port.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Enviar archivos como trabajos.")
+    submit.add_argument("paths", nargs="+", help="Archivos de audio a procesar.")
+    submit.add_argument("--denoise", action="store_true", default=None, help="Aplicar reducción de ruido.")
+    submit.add_argument("--normalize", action="store_true", default=None, help="Normalizar el volumen.")
+    submit.add_argument("--save-stems", action="store_true", default=None, help="Guardar todos los stems.")
+    submit.add_argument("--two-stems", choices=["vocals"], help="Guardar solo voces y acompañamiento.")
+    submit.add_argument("--priority", type=int, default=10, help="Prioridad del trabajo; menor valor se procesa antes (por defecto 10).")
+    submit.add_argument("--wait", action="store_true", help="Esperar a que terminen los trabajos.")
+
+    status = commands.add_parser("status", help="Estado de un trabajo.")
+    status.add_argument("job_id")
+    cancel = commands.add_parser("cancel", help="Cancelar un trabajo en cola.")
+    cancel.add_argument("job_id")
+    commands.add_parser("list", help="Listar trabajos recientes.")
+    commands.add_parser("health", help="Estado del servidor.")
+    args = parser.parse_args()
+
+    client = Client(args.host, args.port, args.socket)
+    try:
+        if args.command == "submit":
+            # Las opciones no indicadas se omiten y el servidor usa las suyas por defecto
+            options = {key: value for key, value in {"denoise": args.denoise, "normalize": args.normalize,
+                                                     "save_stems": args.save_stems, "two_stems": args.two_stems}.items()
+                       if value is not None}
+            job_ids, failed = [], False
+            for path in args.paths:
+                code, job = client.submit(path, priority=args.priority, **options)
+                print(json.dumps(job, ensure_ascii=False))
+                if code == 202:
+                    job_ids.append(job["id"])
+                else:
+                    failed = True
+            if args.wait and job_ids:
+                for job in client.wait(job_ids):
+                    print(json.dumps(job, ensure_ascii=False))
+                    failed |= job.get("status") != "done"
+            return 1 if failed else 0
+
+        if args.command == "status":
+            code, payload = client.status(args.job_id)
+        elif args.command == "cancel":
+            code, payload = client.request("DELETE", f"/jobs/{args.job_id}")
+        elif args.command == "list":
+            code, payload = client.request("GET", "/jobs")
+        else:
+            code, payload = client.request("GET", "/health")
+        print(json.dumps(payload, ensure_ascii=False, indent=2))
+        return 0 if code == 200 else 1
+    except (ConnectionError, FileNotFoundError, socket.timeout) as e:
+        print(f"❌ No se pudo conectar con el servidor: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
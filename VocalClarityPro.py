@@ -1,110 +1,550 @@
+import time
+_PROCESS_STARTED = time.perf_counter() # Referencia para medir el tiempo de arranque
 import os
 import argparse
-import torchaudio
-import torch
+import contextlib
+import copy
+import functools
+import hashlib
+import itertools
+import importlib.util
+import json
+import math
+import shutil
+import signal
+import sqlite3
+import struct
+import tempfile
+import uuid
 import subprocess
-import noisereduce as nr
+from collections import OrderedDict
 from pathlib import Path
-from demucs.pretrained import get_model
-from demucs.apply import apply_model
 import logging
 import sys
 import platform
 import warnings
-from tqdm import tqdm
+import wave
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures.process import ProcessPoolExecutor, BrokenProcessPool
+
+# --- Importaciones diferidas ---
+# torch y torchaudio tardan segundos en importarse: se cargan la primera vez que se usan, de modo que
+# --help y la validación de argumentos responden al instante. demucs, noisereduce y tqdm se importan
+# dentro de las funciones que los usan.
+def _lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+torch = _lazy_import("torch")
+torchaudio = _lazy_import("torchaudio")
+
+# Logger del módulo. Importar VocalClarityPro no configura el logging: los mensajes llegan a los handlers
+# que configure la aplicación (la CLI llama a setup_logging). Con logging.info directamente, el primer
+# mensaje llamaría a logging.basicConfig() por su cuenta en un programa sin handlers.
+logger = logging.getLogger("VocalClarityPro")
+logger.addHandler(logging.NullHandler())
 
 # --- Configuración del Logging ---
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-log_file_path = os.path.join(log_dir, "audio_processing.log")
-
-logging.basicConfig(
-    level=logging.INFO, # Nivel mínimo de mensajes a registrar
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_path, encoding='utf-8'), # Asegura codificación UTF-8
-        logging.StreamHandler(sys.stdout) # También log a la consola
-    ]
-)
-
-# Función para verificar la instalación de sox
+def setup_logging(log_dir="logs", console=True):
+    """
+    Configura el log a archivo (logs/audio_processing.log) y, opcionalmente, a la consola.
+    Se llama después de analizar los argumentos, así que --help no crea la carpeta de logs.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file_path = os.path.join(log_dir, "audio_processing.log")
+    handlers = [logging.FileHandler(log_file_path, encoding='utf-8')] # Asegura codificación UTF-8
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout)) # También log a la consola
+    logging.basicConfig(
+        level=logging.INFO, # Nivel mínimo de mensajes a registrar
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers,
+    )
+    return log_file_path
+
+# Función para verificar la instalación de sox.
+# Solo se llama si hace falta sox como decodificador externo, y una sola vez por proceso.
+@functools.lru_cache(maxsize=None)
 def check_sox_installed():
     try:
         subprocess.run(["sox", "--version"], check=True, capture_output=True, text=True)
-        logging.info("Sox está instalado y accesible en el PATH del sistema.")
+        logger.info("Sox está instalado y accesible en el PATH del sistema.")
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
-        logging.error("Sox no está instalado o no está en el PATH del sistema.")
-        logging.error("Por favor, instala Sox. En Arch Linux: sudo pacman -S sox")
+        logger.error("Sox no está instalado o no está en el PATH del sistema.")
+        logger.error("Por favor, instala Sox. En Arch Linux: sudo pacman -S sox")
         return False
 
-# Conversión automática con sox
-def convert_audio(input_path):
-    output_path = Path(str(input_path) + "_converted.wav")
-    if output_path.exists():
-        logging.warning(f"Archivo de conversión temporal ya existe, sobrescribiendo: {output_path}")
-        output_path.unlink() # Eliminar el archivo existente para evitar conflictos
+# --- Decodificación ---
+# torchaudio se usa cuando puede leer el formato. Si no, el audio se decodifica con ffmpeg (o sox)
+# y llega por una tubería como WAV float32 directamente a un tensor, sin archivos temporales.
+# El decodificador que funciona para cada extensión se recuerda para no repetir el intento fallido.
+_decoder_by_extension = {}
 
-    try:
-        logging.info(f"Intentando convertir audio con sox: {input_path} a {output_path}")
-        result = subprocess.run(
-            ["sox", str(input_path), "-b", "16", "-e", "signed-integer", str(output_path)],
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=600 # Añadir un timeout de 10 minutos para conversiones largas
-        )
-        logging.info(f"[⚙] Archivo convertido con sox: {output_path}")
-        if result.stdout:
-            logging.debug(f"Sox Stdout: {result.stdout.strip()}")
-        if result.stderr:
-            logging.debug(f"Sox Stderr: {result.stderr.strip()}")
-        return output_path
-    except subprocess.TimeoutExpired:
-        logging.error(f"[⚠️] La conversión con sox para {input_path} excedió el tiempo límite ({600/60} minutos).")
-        if output_path.exists():
-            output_path.unlink() # Limpiar archivo parcial
-        return None
-    except subprocess.CalledProcessError as e:
-        logging.error(f"[⚠️] Error al convertir el archivo con sox: {input_path}")
-        logging.error(f"  Código de salida: {e.returncode}")
-        logging.error(f"  Stdout (Sox): {e.stdout.strip()}")
-        logging.error(f"  Stderr (Sox): {e.stderr.strip()}")
-        if output_path.exists():
-            output_path.unlink() # Limpiar archivo parcial
-        return None
-    except FileNotFoundError:
-        logging.error("El comando 'sox' no fue encontrado. Asegúrate de que sox esté instalado y en tu PATH.")
-        return None
-    except Exception as e:
-        logging.error(f"[⚠️] Error inesperado durante la conversión con sox para {input_path}: {e}", exc_info=True)
-        if output_path.exists():
-            output_path.unlink() # Limpiar archivo parcial
-        return None
+def _external_decoder():
+    if shutil.which("ffmpeg"):
+        return "ffmpeg"
+    if shutil.which("sox") and check_sox_installed():
+        return "sox"
+    return None
+
+def _decoder_command(decoder, file_path, mono_sr=None):
+    # Con mono_sr el propio decodificador mezcla a mono y remuestrea (p. ej. para las huellas de --dedup)
+    if decoder == "ffmpeg":
+        downmix = ["-ac", "1", "-ar", str(mono_sr)] if mono_sr else []
+        return ["ffmpeg", "-nostdin", "-v", "error", "-i", str(file_path), "-vn", *downmix, "-f", "wav", "-acodec", "pcm_f32le", "-"]
+    downmix = ["channels", "1", "rate", str(mono_sr)] if mono_sr else []
+    return ["sox", str(file_path), "-t", "wav", "-e", "floating-point", "-b", "32", "-", *downmix]
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("Cabecera WAV incompleta en la salida del decodificador.")
+    return data
+
+def _read_wav_header(stream):
+    """
+    Lee la cabecera de un WAV float32 recibido por tubería y la deja posicionada al inicio de las muestras.
+    Devuelve (canales, sr). El tamaño declarado del bloque 'data' se ignora: al escribir en una
+    tubería el decodificador no lo conoce de antemano.
+    """
+    riff, _, wave_id = struct.unpack("<4sI4s", _read_exact(stream, 12))
+    if riff != b"RIFF" or wave_id != b"WAVE":
+        raise ValueError("La salida del decodificador no es un WAV válido.")
+    channels, sr = None, None
+    while True:
+        chunk_id, chunk_size = struct.unpack("<4sI", _read_exact(stream, 8))
+        if chunk_id == b"data":
+            if channels is None:
+                raise ValueError("WAV sin bloque 'fmt ' antes de los datos.")
+            return channels, sr
+        chunk = _read_exact(stream, chunk_size + (chunk_size & 1))
+        if chunk_id == b"fmt ":
+            format_tag, channels, sr, _, _, bits = struct.unpack("<HHIIHH", chunk[:16])
+            if format_tag == 0xFFFE: # WAVE_FORMAT_EXTENSIBLE: el formato real está en el subformato
+                format_tag = struct.unpack("<H", chunk[24:26])[0]
+            if format_tag != 3 or bits != 32:
+                raise ValueError(f"Formato de muestras inesperado del decodificador (tag={format_tag}, bits={bits}).")
+
+def iter_pipe_blocks(file_path, block_frames, decoder, mono_sr=None):
+    """
+    Decodifica con un proceso externo y genera tuplas (bloque, sr) con bloque de forma (canales, muestras).
+    """
+    with tempfile.TemporaryFile() as stderr_file:
+        proc = subprocess.Popen(_decoder_command(decoder, file_path, mono_sr), stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            channels, sr = _read_wav_header(proc.stdout)
+            frame_bytes = channels * 4
+            while True:
+                data = proc.stdout.read(block_frames * frame_bytes)
+                usable = len(data) - len(data) % frame_bytes
+                if usable:
+                    yield torch.frombuffer(bytearray(data[:usable]), dtype=torch.float32).view(-1, channels).t(), sr
+                if len(data) < block_frames * frame_bytes:
+                    break
+            if proc.wait() != 0:
+                stderr_file.seek(0)
+                raise RuntimeError(f"{decoder} terminó con código {proc.returncode}: {stderr_file.read().decode(errors='replace').strip()}")
+        except (EOFError, ValueError) as e:
+            # Normalmente el decodificador falló antes de escribir nada: su stderr explica el motivo
+            proc.wait()
+            stderr_file.seek(0)
+            detail = stderr_file.read().decode(errors='replace').strip()
+            if proc.returncode != 0 and detail:
+                raise RuntimeError(f"{decoder} terminó con código {proc.returncode}: {detail}") from e
+            raise
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+def _decode_with_pipe(file_path, decoder, mono_sr=None):
+    blocks = []
+    sr = None
+    for block, sr in iter_pipe_blocks(file_path, 1 << 18, decoder, mono_sr):
+        blocks.append(block)
+    if not blocks:
+        raise RuntimeError(f"{decoder} no devolvió audio para {file_path}.")
+    return torch.cat(blocks, dim=-1), sr
+
+def _remember_fallback(extension, error):
+    if _decoder_by_extension.get(extension) != "pipe":
+        logger.warning(f"torchaudio no puede leer archivos '{extension}' ({error}). Se usará un decodificador externo para esta extensión.")
+        _decoder_by_extension[extension] = "pipe"
+
+def decode_audio(file_path):
+    """
+    Decodifica un archivo completo. Devuelve (waveform, sr); lanza una excepción si ningún decodificador puede leerlo.
+    """
+    extension = Path(file_path).suffix.lower()
+    if _decoder_by_extension.get(extension) != "pipe":
+        try:
+            waveform, sr = torchaudio.load(str(file_path))
+            _decoder_by_extension[extension] = "torchaudio"
+            logger.info(f"Archivo cargado con éxito por torchaudio: {file_path}")
+            return waveform, sr
+        except Exception as e:
+            logger.debug(f"torchaudio no pudo cargar {file_path}: {e}", exc_info=True)
+            if _decoder_by_extension.get(extension) == "torchaudio":
+                # La extensión suele funcionar: el problema es de este archivo, no se cambia la elección
+                logger.warning(f"No se pudo cargar {file_path} con torchaudio ({e}). Probando un decodificador externo...")
+            else:
+                _remember_fallback(extension, e)
+
+    decoder = _external_decoder()
+    if decoder is None:
+        raise RuntimeError("No hay ningún decodificador externo disponible. Instala ffmpeg o sox.")
+    waveform, sr = _decode_with_pipe(file_path, decoder)
+    logger.info(f"Archivo decodificado con {decoder} (sin archivos temporales): {file_path}")
+    return waveform, sr
+
+# Formatos en los que torchaudio.load(frame_offset=...) salta directamente a la muestra pedida. En los
+# comprimidos (mp3, m4a, ogg...) cada bloque volvería a decodificar desde el principio del archivo.
+SEEKABLE_EXTENSIONS = {".wav", ".flac", ".aif", ".aiff"}
+
+def iter_audio_blocks(file_path, block_frames):
+    """
+    Decodifica un archivo por bloques de como máximo block_frames muestras.
+    Genera tuplas (bloque, sr) con bloque de forma (canales, muestras). Los formatos que no admiten
+    saltos baratos se leen de una sola pasada con el decodificador externo, si lo hay.
+    """
+    extension = Path(file_path).suffix.lower()
+    if extension not in SEEKABLE_EXTENSIONS:
+        decoder = _external_decoder()
+        if decoder is not None:
+            yield from iter_pipe_blocks(file_path, block_frames, decoder)
+            return
+    if _decoder_by_extension.get(extension) != "pipe":
+        try:
+            sr = torchaudio.info(str(file_path)).sample_rate
+            _decoder_by_extension[extension] = "torchaudio"
+        except Exception as e:
+            _remember_fallback(extension, e)
+        else:
+            frame_offset = 0
+            while True:
+                block, _ = torchaudio.load(str(file_path), frame_offset=frame_offset, num_frames=block_frames)
+                if block.shape[-1] == 0:
+                    return
+                yield block, sr
+                frame_offset += block.shape[-1]
+                if block.shape[-1] < block_frames:
+                    return
+
+    decoder = _external_decoder()
+    if decoder is None:
+        raise RuntimeError("No hay ningún decodificador externo disponible. Instala ffmpeg o sox.")
+    yield from iter_pipe_blocks(file_path, block_frames, decoder)
+
+# --- Remuestreo ---
+@functools.lru_cache(maxsize=32)
+def get_resampler(orig_freq, new_freq):
+    # Construir el kernel (sinc enventanado) cuesta más que aplicarlo a un archivo corto: se reutiliza por pareja de frecuencias
+    return torchaudio.transforms.Resample(orig_freq, new_freq)
+
+def resample(waveform, orig_freq, new_freq):
+    """Remuestrea sobre la última dimensión; no hace nada si las frecuencias coinciden."""
+    if orig_freq == new_freq:
+        return waveform
+    return get_resampler(orig_freq, new_freq).to(waveform.device)(waveform)
+
+def fit_length(waveform, frames):
+    """Recorta o rellena con ceros la última dimensión hasta frames muestras."""
+    if waveform.shape[-1] >= frames:
+        return waveform[..., :frames]
+    return torch.nn.functional.pad(waveform, (0, frames - waveform.shape[-1]))
+
+class StreamingResampler:
+    """
+    Remuestreo por bloques con el mismo resultado que remuestrear el archivo entero: cada bloque se
+    procesa con contexto a ambos lados y se retienen las últimas muestras hasta que llega el siguiente.
+    La longitud total de salida es la misma que la de resample() sobre el archivo completo.
+    """
+
+    def __init__(self, orig_freq, new_freq, context=256):
+        self.orig_freq, self.new_freq = orig_freq, new_freq
+        divisor = math.gcd(orig_freq, new_freq)
+        # El contexto y lo emitido en cada paso son múltiplos del periodo del polifásico, para no desfasar el kernel
+        self.step, self.out_step = orig_freq // divisor, new_freq // divisor
+        self.context = self.step * -(-context // self.step)
+        self.history = None # Últimas self.context muestras ya emitidas
+        self.pending = None # Muestras recibidas y aún no emitidas
+
+    def feed(self, block):
+        if self.orig_freq == self.new_freq:
+            return block
+        self.pending = block if self.pending is None else torch.cat([self.pending, block], dim=-1)
+        ready = (self.pending.shape[-1] - self.context) // self.step * self.step
+        if ready <= 0:
+            return block[..., :0]
+        left = self.history.shape[-1] if self.history is not None else 0
+        source = self.pending if self.history is None else torch.cat([self.history, self.pending], dim=-1)
+        out = resample(source, self.orig_freq, self.new_freq)
+        start = left // self.step * self.out_step
+        emitted = out[..., start:start + ready // self.step * self.out_step]
+        self.history = source[..., left + ready - min(self.context, left + ready):left + ready]
+        self.pending = self.pending[..., ready:]
+        return emitted
+
+    def flush(self):
+        if self.orig_freq == self.new_freq or self.pending is None or self.pending.shape[-1] == 0:
+            return None
+        left = self.history.shape[-1] if self.history is not None else 0
+        source = self.pending if self.history is None else torch.cat([self.history, self.pending], dim=-1)
+        out = resample(source, self.orig_freq, self.new_freq)
+        self.pending = None
+        return out[..., left // self.step * self.out_step:]
 
 # Aplicar reducción de ruido
 def reduce_noise(y, sr):
+    import noisereduce as nr
     try:
-        logging.info("Aplicando reducción de ruido.")
+        logger.info("Aplicando reducción de ruido.")
         # Convierte y a numpy, manteniendo los canales si es estéreo
         y_np = y.cpu().numpy()
 
         if y_np.ndim == 2 and y_np.shape[0] == 2: # Si es estéreo
             y_nr = nr.reduce_noise(y=y_np, sr=sr)
-            logging.info("Reducción de ruido aplicada a audio estéreo.")
+            logger.info("Reducción de ruido aplicada a audio estéreo.")
         elif y_np.ndim == 2 and y_np.shape[0] == 1: # Si es mono (1, muestras)
             y_nr = nr.reduce_noise(y=y_np.squeeze(0), sr=sr).reshape(1, -1) # Reduce y asegura (1, muestras)
-            logging.info("Reducción de ruido aplicada a audio mono (1 canal).")
+            logger.info("Reducción de ruido aplicada a audio mono (1 canal).")
         else: # Fallback si el formato no es el esperado
-            logging.warning(f"Formato de voces inesperado para denoising ({y_np.shape}). Saltando reducción de ruido.")
+            logger.warning(f"Formato de voces inesperado para denoising ({y_np.shape}). Saltando reducción de ruido.")
             y_nr = y_np # No aplicar denoise
         
         # Convertir de nuevo a tensor de PyTorch
         return torch.from_numpy(y_nr).to(y.device)
     except Exception as e:
-        logging.error(f"[❌] Error en reducción de ruido: {e}", exc_info=True)
+        logger.error(f"[❌] Error en reducción de ruido: {e}", exc_info=True)
         return y # Devuelve el audio original si hay un error
 
+# --- Reducción de ruido nativa en torch ---
+class TorchSpectralGate:
+    """
+    Puerta espectral vectorizada sobre STFT de torch, equivalente a noisereduce con sus valores por defecto.
+
+    Procesa en una sola llamada un tensor (..., canales, muestras): todos los stems y canales se
+    aplanan en un batch, sin pasar por NumPy. Sin perfil de ruido usa la variante no estacionaria
+    de noisereduce (umbral relativo a una versión suavizada en el tiempo del propio espectro). Con
+    un perfil de `estimate_noise_profile` usa la variante estacionaria, y ese perfil puede
+    reutilizarse entre archivos grabados en las mismas condiciones.
+    """
+
+    def __init__(self, n_fft=1024, time_constant_s=2.0, freq_mask_smooth_hz=500, time_mask_smooth_ms=50,
+                 thresh_n_mult_nonstationary=2.0, sigmoid_slope_nonstationary=10.0, n_std_thresh_stationary=1.5,
+                 prop_decrease=1.0, chunk_size=600000, padding=30000):
+        self.n_fft = n_fft
+        self.hop_length = n_fft // 4
+        self.time_constant_s = time_constant_s
+        self.freq_mask_smooth_hz = freq_mask_smooth_hz
+        self.time_mask_smooth_ms = time_mask_smooth_ms
+        self.thresh_n_mult_nonstationary = thresh_n_mult_nonstationary
+        self.sigmoid_slope_nonstationary = sigmoid_slope_nonstationary
+        self.n_std_thresh_stationary = n_std_thresh_stationary
+        self.prop_decrease = prop_decrease
+        # Igual que noisereduce, las señales largas se procesan por tramos para acotar la memoria de la STFT
+        self.chunk_size = chunk_size
+        self.padding = padding
+        self._windows = {}
+        self._smoothing_filters = {}
+
+    def _window(self, device):
+        if device not in self._windows:
+            self._windows[device] = torch.hann_window(self.n_fft, device=device)
+        return self._windows[device]
+
+    def _mask_smoothing(self, sr):
+        """
+        Semianchos (en bins y en tramas) del filtro triangular que suaviza la máscara, como en noisereduce.
+        """
+        if sr not in self._smoothing_filters:
+            n_grad_freq = max(1, int(self.freq_mask_smooth_hz / (sr / (self.n_fft / 2))))
+            n_grad_time = max(1, int(self.time_mask_smooth_ms / ((self.hop_length / sr) * 1000)))
+            self._smoothing_filters[sr] = (n_grad_freq, n_grad_time)
+        return self._smoothing_filters[sr]
+
+    @staticmethod
+    def _triangular_smooth(x, n, dim):
+        # Un filtro triangular de 2n+1 puntos es la convolución de dos medias móviles de n+1 puntos.
+        # Cada media móvil se calcula con una suma acumulada (coste lineal, independiente de n).
+        # Los bordes se rellenan con ceros, como la convolución en modo 'same' de noisereduce.
+        if n < 1:
+            return x
+        zeros_shape = list(x.shape)
+        zeros_shape[dim] = n
+        zeros = x.new_zeros(zeros_shape)
+        x = torch.cat([zeros, x, zeros], dim=dim)
+        for _ in range(2):
+            zeros_shape[dim] = 1
+            cs = torch.cat([x.new_zeros(zeros_shape), torch.cumsum(x, dim=dim)], dim=dim)
+            length = x.shape[dim] - n
+            x = (cs.narrow(dim, n + 1, length) - cs.narrow(dim, 0, length)) / (n + 1)
+        return x
+
+    @staticmethod
+    def _one_pole(x, b, block=256):
+        """
+        y[n] = b * x[n] + (1 - b) * y[n-1] a lo largo del tiempo, arrancando en régimen permanente
+        con el primer valor (como filtfilt). Dentro de cada bloque la recurrencia se resuelve con una
+        suma acumulada; solo el arrastre entre bloques es secuencial.
+        """
+        a = 1.0 - b
+        powers = a ** torch.arange(1, block + 1, dtype=torch.float64, device=x.device)
+        y = torch.empty_like(x)
+        carry = x[..., :1].double()
+        for start in range(0, x.shape[-1], block):
+            xb = x[..., start:start + block].double()
+            p = powers[:xb.shape[-1]]
+            yb = p * (carry + b * torch.cumsum(xb / p, dim=-1))
+            y[..., start:start + block] = yb
+            carry = yb[..., -1:]
+        return y
+
+    def _smooth_time(self, magnitude, sr):
+        # Suavizado temporal de noisereduce: filtro IIR de un polo aplicado hacia delante y hacia atrás
+        t_frames = self.time_constant_s * sr / float(self.hop_length)
+        b = (math.sqrt(1 + 4 * t_frames ** 2) - 1) / (2 * t_frames ** 2)
+        smooth = self._one_pole(magnitude, b)
+        return self._one_pole(smooth.flip(-1), b).flip(-1)
+
+    def _stft(self, x):
+        return torch.stft(x, self.n_fft, hop_length=self.hop_length, window=self._window(x.device),
+                          pad_mode="constant", return_complex=True)
+
+    @staticmethod
+    def _amp_to_db(magnitude, top_db=80.0):
+        db = 20 * torch.log10(magnitude + 1e-10)
+        return torch.maximum(db, db.amax(dim=-1, keepdim=True) - top_db)
+
+    def estimate_noise_profile(self, noise):
+        """
+        Calcula el umbral por frecuencia (en dB) a partir de un fragmento que solo contiene ruido.
+        noise: tensor (..., muestras); todos los canales se promedian en un único perfil.
+        """
+        noise_db = self._amp_to_db(self._stft(noise.reshape(-1, noise.shape[-1]).float()).abs())
+        noise_db = noise_db.transpose(0, 1).reshape(noise_db.shape[1], -1) # (frecuencias, canales * tramas)
+        return noise_db.mean(dim=1) + noise_db.std(dim=1, unbiased=False) * self.n_std_thresh_stationary
+
+    def _mask(self, spec, sr, noise_profile):
+        magnitude = spec.abs()
+        if noise_profile is not None:
+            mask = (self._amp_to_db(magnitude) > noise_profile[:, None]).float()
+        else:
+            smooth = self._smooth_time(magnitude, sr)
+            ratio = (magnitude - smooth) / smooth.clamp_min(1e-10)
+            mask = torch.sigmoid((ratio - self.thresh_n_mult_nonstationary) * self.sigmoid_slope_nonstationary)
+
+        # Suavizar la máscara: el filtro triangular es separable en tiempo y frecuencia
+        n_grad_freq, n_grad_time = self._mask_smoothing(sr)
+        mask = self._triangular_smooth(mask, n_grad_time, dim=-1)
+        mask = self._triangular_smooth(mask, n_grad_freq, dim=-2)
+        return mask * self.prop_decrease + (1.0 - self.prop_decrease)
+
+    def filter_chunk(self, audio, sr, start, end, noise_profile=None):
+        """
+        Como filter_chunk de noisereduce: filtra [start - padding, end + padding) de audio (..., muestras),
+        con ceros fuera de la señal, y devuelve [start, min(end, muestras)).
+        """
+        flat = audio.reshape(-1, audio.shape[-1]).float()
+        length = flat.shape[-1]
+        lo, hi = start - self.padding, end + self.padding
+        segment = torch.nn.functional.pad(flat[:, max(lo, 0):min(hi, length)], (max(0, -lo), max(0, hi - length)))
+        spec = self._stft(segment)
+        spec = spec * self._mask(spec, sr, noise_profile)
+        denoised = torch.istft(spec, self.n_fft, hop_length=self.hop_length, window=self._window(flat.device), length=hi - lo)
+        out = denoised[:, self.padding:self.padding + min(end, length) - start]
+        return out.reshape(*audio.shape[:-1], -1).to(audio.dtype)
+
+    def __call__(self, audio, sr, noise_profile=None):
+        """
+        audio: tensor (..., muestras). Devuelve un tensor de la misma forma con el ruido atenuado.
+        Igual que noisereduce, las señales de más de chunk_size muestras se filtran por tramos completos de
+        chunk_size (el último también, rellenado con ceros) y las más cortas en un solo tramo.
+        """
+        length = audio.shape[-1]
+        if length <= self.chunk_size:
+            return self.filter_chunk(audio, sr, 0, length, noise_profile)
+        return torch.cat([self.filter_chunk(audio, sr, start, start + self.chunk_size, noise_profile)
+                          for start in range(0, length, self.chunk_size)], dim=-1)
+
+# Instancia compartida: conserva las ventanas y filtros de suavizado ya calculados entre archivos
+SPECTRAL_GATE = TorchSpectralGate()
+
+def denoise_batch(audio, sr, engine="torch", noise_profile=None):
+    """
+    Reduce el ruido de un tensor (pistas, canales, muestras) con el motor indicado.
+    'torch' procesa todas las pistas en una llamada; 'noisereduce' usa reduce_noise pista a pista.
+    """
+    if engine == "noisereduce":
+        return torch.stack([reduce_noise(track, sr) for track in audio])
+    try:
+        return SPECTRAL_GATE(audio, sr, noise_profile=noise_profile)
+    except Exception as e:
+        logger.error(f"[❌] Error en reducción de ruido: {e}", exc_info=True)
+        return audio # Devuelve el audio original si hay un error
+
+class StreamingDenoiser:
+    """
+    Reducción de ruido por bloques con el mismo resultado que denoise_batch sobre el archivo entero.
+    La puerta espectral (como noisereduce) filtra las señales largas por tramos de chunk_size muestras
+    con padding de contexto a cada lado; aquí se siguen los mismos tramos y cada uno se emite en cuanto
+    llega el contexto que lo sigue. Con noisereduce el resultado es aproximado: cada tramo se le pasa
+    con su contexto real y lo vuelve a rellenar a su manera.
+    """
+
+    def __init__(self, sr, engine="torch"):
+        self.sr, self.engine = sr, engine
+        self.chunk_size, self.padding = SPECTRAL_GATE.chunk_size, SPECTRAL_GATE.padding
+        self.buffer = None # Señal desde self.offset hasta lo último recibido
+        self.offset = 0
+        self.next_start = 0 # Inicio del próximo tramo, en muestras desde el principio
+
+    def _emit(self, end):
+        # Filtra [next_start, end) con el contexto disponible en buffer y descarta lo que ya no hace falta
+        start, end = self.next_start - self.offset, end - self.offset
+        if self.engine == "noisereduce":
+            lo = max(0, start - self.padding)
+            out = denoise_batch(self.buffer[..., lo:end + self.padding], self.sr, self.engine)[..., start - lo:end - lo]
+        else:
+            out = SPECTRAL_GATE.filter_chunk(self.buffer, self.sr, start, end)
+        self.next_start += self.chunk_size
+        keep_from = max(0, self.next_start - self.padding)
+        self.buffer = self.buffer[..., keep_from - self.offset:]
+        self.offset = keep_from
+        return out
+
+    def feed(self, block):
+        self.buffer = block if self.buffer is None else torch.cat([self.buffer, block], dim=-1)
+        emitted = []
+        # Un tramo completo con su contexto derecho: la señal ya es más larga que chunk_size
+        while self.offset + self.buffer.shape[-1] >= self.next_start + self.chunk_size + self.padding:
+            emitted.append(self._emit(self.next_start + self.chunk_size))
+        return torch.cat(emitted, dim=-1) if emitted else block[..., :0]
+
+    def flush(self):
+        if self.buffer is None:
+            return None
+        total = self.offset + self.buffer.shape[-1]
+        if self.next_start == 0 and total <= self.chunk_size:
+            # Señal corta: un solo tramo de su misma longitud
+            return self._emit(total) if total else None
+        emitted = []
+        while self.next_start < total:
+            emitted.append(self._emit(self.next_start + self.chunk_size))
+        return torch.cat(emitted, dim=-1) if emitted else None
+
 # Función para normalizar el volumen
 def normalize_volume(audio_tensor, target_peak_db=-1.0):
     """
@@ -113,7 +553,7 @@ def normalize_volume(audio_tensor, target_peak_db=-1.0):
     target_peak_db: Nivel de pico deseado en dBFS (ej. -1.0 para -1 dBFS).
     """
     try:
-        logging.info(f"Aplicando normalización de volumen a pico de {target_peak_db} dB.")
+        logger.info(f"Aplicando normalización de volumen a pico de {target_peak_db} dB.")
         
         # Convertir target_peak_db a un factor lineal
         target_amplitude = 10**(target_peak_db / 20)
@@ -124,7 +564,7 @@ def normalize_volume(audio_tensor, target_peak_db=-1.0):
         current_peak = audio_tensor.abs().max()
 
         if current_peak == 0:
-            logging.warning("El audio es silencioso, no se puede normalizar.")
+            logger.warning("El audio es silencioso, no se puede normalizar.")
             return audio_tensor
 
         # Calcular el factor de escalado necesario
@@ -132,224 +572,3130 @@ def normalize_volume(audio_tensor, target_peak_db=-1.0):
         
         # Aplicar el escalado
         normalized_audio = audio_tensor * scale_factor
-        logging.info(f"Volumen normalizado. Factor de escalado aplicado: {scale_factor:.4f}.")
+        logger.info(f"Volumen normalizado. Factor de escalado aplicado: {scale_factor:.4f}.")
         return normalized_audio
     except Exception as e:
-        logging.error(f"[❌] Error en la normalización de volumen: {e}", exc_info=True)
+        logger.error(f"[❌] Error en la normalización de volumen: {e}", exc_info=True)
         return audio_tensor # Devuelve el audio original si hay un error
 
-# Procesar archivo individual
-def process_file(model, file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, device):
-    original_file_path = file_path # Guardar la ruta original para el log final
-    temp_converted_path = None # Para limpiar archivos temporales de sox
+# Orden de los stems si el modelo no expone `sources` (htdemucs usa este mismo orden)
+DEFAULT_SOURCES = ['drums', 'bass', 'other', 'vocals']
 
-    try:
-        logging.info(f"[DEMUCS] Procesando: {original_file_path}")
-        waveform, sr = None, None
-        
+# Extensiones de audio que se procesan
+AUDIO_EXTS = [".wav", ".mp3", ".flac", ".aac", ".m4a", ".ogg"]
+
+# --- Rutas de salida ---
+def prepare_output_dirs(original_file_path, base_output_dir, save_stems):
+    if save_stems:
+        # Si se guardan stems, creamos una subcarpeta para el archivo original
+        current_output_dir = base_output_dir / original_file_path.stem
+        current_output_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Directorio de salida para stems de '{original_file_path.name}': {current_output_dir}")
+    else:
+        # Si no se guardan stems, solo necesitamos el directorio base para la voz principal
+        base_output_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Directorio de salida para voces procesadas: {base_output_dir}")
+
+def stem_output_path(original_file_path, stem_name, base_output_dir, save_stems):
+    """
+    Devuelve la ruta donde se guarda un stem, o None si el stem no se guarda.
+    """
+    if stem_name == 'vocals':
+        # La pista vocal procesada siempre tiene el sufijo _vocalclarity.wav y va al directorio base
+        return base_output_dir / (original_file_path.stem + "_vocalclarity.wav")
+    if stem_name == 'accompaniment':
+        # Modo --two-stems: el acompañamiento va junto a la pista vocal
+        return base_output_dir / (original_file_path.stem + "_accompaniment.wav")
+    if save_stems:
+        # Los otros stems procesados van a la subcarpeta específica del archivo
+        return base_output_dir / original_file_path.stem / f"{original_file_path.stem}_{stem_name}.wav"
+    return None
+
+def plan_tracks(sources, two_stems=None):
+    """
+    Pistas que se pueden obtener de los stems: una por stem o, con two_stems, ese stem y el acompañamiento.
+    Devuelve una lista de (nombre, índices de los stems que la forman).
+    """
+    if two_stems:
+        target = sources.index(two_stems)
+        return [(two_stems, [target]), ("accompaniment", [i for i in range(len(sources)) if i != target])]
+    return [(stem_name, [i]) for i, stem_name in enumerate(sources)]
+
+def plan_outputs(sources, original_file_path, base_output_dir, save_stems, two_stems=None):
+    """
+    Decide qué pistas se guardan antes de post-procesar nada.
+    Devuelve una lista de (nombre, índices de los stems que la forman, ruta de salida);
+    los stems que no se van a guardar no aparecen y por tanto no se procesan.
+    """
+    plan = []
+    for stem_name, indices in plan_tracks(sources, two_stems):
+        output_path = stem_output_path(original_file_path, stem_name, base_output_dir, save_stems)
+        if output_path is None:
+            logger.info(f"Omitiendo stem '{stem_name}' ya que --save-stems no está activado y no es la pista vocal principal.")
+            continue
+        plan.append((stem_name, indices, output_path))
+    return plan
+
+def extract_output(stems, indices):
+    # Un solo stem se devuelve como vista; el acompañamiento se suma directamente sin copiar cada instrumento
+    if len(indices) == 1:
+        return stems[indices[0]]
+    return stems[indices].sum(dim=0)
+
+# --- Caché de resultados (--cache-dir) ---
+class ResultCache:
+    """
+    Caché en disco direccionada por contenido.
+
+    - stems/<clave>: stems crudos de Demucs. La clave depende del contenido del archivo y del modelo,
+      así que cambiar solo --denoise/--normalize reutiliza la separación.
+    - outputs/<clave>: WAV finales ya post-procesados. La clave añade las opciones de post-procesado y de salida.
+
+    Cada entrada es un directorio; su mtime se actualiza en cada acierto y se usa para el desalojo LRU
+    cuando el tamaño total supera max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, model_name="htdemucs"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.model_name = model_name
+        self.stats = {"hits_outputs": 0, "hits_stems": 0, "misses": 0, "evicted": 0}
+        self._approx_bytes = None
+        for sub in ("stems", "outputs", "tmp"):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+
+    def __getstate__(self):
+        # Cada worker empieza con contadores propios; el proceso principal los suma al terminar cada archivo
+        state = self.__dict__.copy()
+        state["stats"] = dict.fromkeys(self.stats, 0)
+        return state
+
+    # --- Claves ---
+    @staticmethod
+    def _file_hash(file_path, block_size=1 << 20):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                digest.update(block)
+        return digest.hexdigest()
+
+    def separation_key(self, file_path):
+        return hashlib.sha256(f"{self._file_hash(file_path)}:{self.model_name}".encode()).hexdigest()
+
+    def output_key(self, separation_key, apply_denoise, apply_normalize, save_stems, two_stems=None, denoise_engine="torch",
+                   output_sr="source", native_postprocess=False):
+        settings = f"denoise={apply_denoise}:normalize={apply_normalize}:save_stems={save_stems}:two_stems={two_stems}"
+        if apply_denoise:
+            settings += f":denoise_engine={denoise_engine}"
+        settings += f":output_sr={output_sr}:native_postprocess={native_postprocess}"
+        return hashlib.sha256(f"{separation_key}:{settings}".encode()).hexdigest()
+
+    # --- Entradas ---
+    def _entry(self, kind, key):
+        return self.root / kind / key
+
+    def _touch(self, entry):
         try:
-            # Intentar cargar directamente con torchaudio
-            waveform, sr = torchaudio.load(str(file_path))
-            logging.info(f"Archivo cargado con éxito por torchaudio: {file_path}")
-        except Exception as e:
-            logging.warning(f"No se pudo cargar {file_path} directamente con torchaudio. Error: {e}. Intentando conversión con Sox...", exc_info=True)
-            # Intentar conversión con sox
-            temp_converted_path = convert_audio(file_path)
-            if not temp_converted_path:
-                logging.error(f"Omitiendo {original_file_path} debido a un fallo en la conversión.")
-                return # Salir si la conversión no fue exitosa
-            file_path = temp_converted_path # Usar el archivo convertido para el resto del procesamiento
-            try:
-                waveform, sr = torchaudio.load(str(file_path))
-                logging.info(f"Archivo convertido cargado con éxito: {file_path}")
-            except Exception as e:
-                logging.error(f"[❌] No se pudo cargar el archivo (incluso después de la conversión con Sox): {file_path}\n{e}", exc_info=True)
-                return # Salir si no se puede cargar ni el archivo convertido
+            os.utime(entry)
+        except OSError:
+            pass
 
-        if waveform is None or sr is None:
-            logging.error(f"[❌] No se pudo cargar la forma de onda o la tasa de muestreo para {original_file_path}.")
+    def _commit(self, tmp_entry, entry):
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Otro proceso guardó la misma entrada a la vez
+            shutil.rmtree(tmp_entry, ignore_errors=True)
             return
+        size = sum(p.stat().st_size for p in entry.iterdir())
+        if self._approx_bytes is not None:
+            self._approx_bytes += size
+        if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+            self.enforce_size_limit()
 
-        # Demucs espera (batch, channels, samples). Asegurar 3 dimensiones y 2 canales.
-        if waveform.ndim == 1:
-            waveform = waveform.unsqueeze(0)
-            logging.info("Forma de onda mono 1D convertida a (1, muestras).")
-        elif waveform.ndim > 2:
-            logging.error(f"[❌] Tensor con más de 2 dimensiones: {original_file_path}. Se esperaban 1 o 2, se obtuvieron {waveform.ndim}")
-            return
-        
-        if waveform.shape[0] == 1: # Si es mono (1 canal)
-            waveform = waveform.repeat(2, 1) # Duplicar el canal para hacerlo estéreo (2, muestras)
-            logging.info("Forma de onda mono convertida a estéreo (2 canales) duplicando el canal.")
-        elif waveform.shape[0] > 2: # Si tiene más de 2 canales, convertir a estéreo promediando o tomando los primeros
-            logging.warning(f"Archivo con {waveform.shape[0]} canales. Remuestreando a estéreo (2 canales).")
-            if waveform.shape[0] >= 2:
-                waveform = waveform[:2, :] # Tomar los dos primeros canales
-            else: 
-                waveform = waveform.mean(dim=0, keepdim=True).repeat(2, 1) # Promediar a mono y luego duplicar
-            logging.info(f"Forma de onda remuestreada a 2 canales.")
-
-        if waveform.ndim == 2:
-            waveform = waveform.unsqueeze(0)
-            logging.info("Forma de onda ajustada a 3 dimensiones (batch, channels, samples).")
-
-        waveform = waveform.to(device)
-        logging.info(f"Forma de onda movida a dispositivo: {device}.")
+    @staticmethod
+    def _link_or_copy(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
 
-        # Aplicar el modelo Demucs
+    def get_stems(self, key, sr=None):
+        """
+        Devuelve (stems, sr, sr_de_origen, muestras_de_origen) o None. Con sr, las entradas a otra frecuencia (las guardadas
+        antes de remuestrear a la del modelo) cuentan como fallo.
+        """
+        entry = self._entry("stems", key)
         try:
-            logging.info(f"Aplicando el modelo Demucs a {original_file_path}...") 
-            stems = apply_model(model, waveform, device=device) 
-            logging.info(f"Modelo Demucs aplicado con éxito a {original_file_path}.")
+            data = torch.load(entry / "stems.pt", map_location="cpu", weights_only=True) # Solo tensores y números
+        except Exception:
+            return None
+        if sr is not None and data["sr"] != sr:
+            return None
+        self._touch(entry)
+        self.stats["hits_stems"] += 1
+        logger.info(f"[💾] Stems recuperados de la caché ({key[:12]}). Se omite la separación con Demucs.")
+        return data["stems"], data["sr"], data.get("source_sr", data["sr"]), data.get("source_frames")
+
+    def put_stems(self, key, stems, sr, source_sr=None, source_frames=None):
+        self.stats["misses"] += 1
+        entry = self._entry("stems", key)
+        if entry.exists():
+            return
+        tmp_entry = Path(tempfile.mkdtemp(dir=self.root / "tmp"))
+        try:
+            torch.save({"stems": stems.cpu(), "sr": sr, "source_sr": source_sr or sr,
+                        "source_frames": source_frames}, tmp_entry / "stems.pt")
+            self._commit(tmp_entry, entry)
         except Exception as e:
-            logging.error(f"[❌] Error al aplicar el modelo Demucs a {original_file_path}: {e}", exc_info=True)
+            logger.warning(f"No se pudieron guardar los stems en la caché: {e}")
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def restore_outputs(self, key, original_file_path, base_output_dir, save_stems):
+        """
+        Copia (o enlaza) las salidas cacheadas a su ubicación final. Devuelve True si hubo acierto.
+        """
+        entry = self._entry("outputs", key)
+        cached_files = sorted(entry.glob("*.wav")) if entry.is_dir() else []
+        if not cached_files:
+            return False
+        prepare_output_dirs(original_file_path, base_output_dir, save_stems)
+        for cached_file in cached_files:
+            output_path = stem_output_path(original_file_path, cached_file.stem, base_output_dir, save_stems)
+            if output_path is None:
+                continue
+            if output_path.exists():
+                output_path.unlink()
+            self._link_or_copy(cached_file, output_path)
+            logger.info(f"[✅] Archivo recuperado de la caché: {output_path}")
+        self._touch(entry)
+        self.stats["hits_outputs"] += 1
+        return True
+
+    def put_outputs(self, key, written):
+        entry = self._entry("outputs", key)
+        if entry.exists() or not written:
             return
+        tmp_entry = Path(tempfile.mkdtemp(dir=self.root / "tmp"))
+        try:
+            for stem_name, output_path in written.items():
+                self._link_or_copy(output_path, tmp_entry / f"{stem_name}.wav")
+            self._commit(tmp_entry, entry)
+        except Exception as e:
+            logger.warning(f"No se pudieron guardar las salidas en la caché: {e}")
+            shutil.rmtree(tmp_entry, ignore_errors=True)
 
-        if stems.shape[0] < 1:
-             logging.error(f"[❌] El modelo Demucs no devolvió ningún stem para {original_file_path}.")
-             return
-        
-        stem_names = ['vocals', 'drums', 'bass', 'other'] 
-        
-        # --- Lógica de directorios de salida ---
-        current_output_dir = base_output_dir
-        if save_stems:
-            # Si se guardan stems, creamos una subcarpeta para el archivo original
-            current_output_dir = base_output_dir / original_file_path.stem
-            current_output_dir.mkdir(parents=True, exist_ok=True)
-            logging.info(f"Directorio de salida para stems de '{original_file_path.name}': {current_output_dir}")
+    # --- Tamaño y estadísticas ---
+    def enforce_size_limit(self):
+        entries = []
+        for kind in ("stems", "outputs"):
+            for entry in (self.root / kind).iterdir():
+                try:
+                    size = sum(p.stat().st_size for p in entry.iterdir())
+                    entries.append((entry.stat().st_mtime, size, entry))
+                except OSError:
+                    continue # Eliminada por otro proceso
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.stats["evicted"] += 1
+        self._approx_bytes = total
+
+    def merge_stats(self, stats):
+        for name, value in stats.items():
+            self.stats[name] += value
+
+    def log_stats(self):
+        s = self.stats
+        lookups = s["hits_outputs"] + s["hits_stems"] + s["misses"]
+        hit_rate = (s["hits_outputs"] + s["hits_stems"]) / lookups * 100 if lookups else 0.0
+        logger.info(f"[💾] Caché: {s['hits_outputs']} aciertos de salidas, {s['hits_stems']} aciertos de stems, "
+                     f"{s['misses']} fallos ({hit_rate:.1f}% de aciertos), {s['evicted']} entradas desalojadas.")
+
+# --- Métricas por etapa (--metrics-dir) ---
+try:
+    import resource # No existe en Windows; allí no se registra la memoria
+except ImportError:
+    resource = None
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # ru_maxrss está en KB en Linux y en bytes en macOS
+
+def _percentile(sorted_values, q):
+    # Interpolación lineal entre rangos, igual que numpy.percentile
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+def _stage(record, name):
+    # Sin --metrics-dir no hay registro y las etapas no miden nada
+    return record.stage(name) if record is not None else contextlib.nullcontext()
+
+class FileMetrics:
+    """
+    Registro de un archivo: duración y pico de memoria de cada etapa y datos del audio de entrada.
+    Las etapas que se repiten (las ventanas de --stream, la normalización de cada stem) acumulan su duración.
+    peak_rss_bytes es el pico del proceso al terminar la etapa; con --pipeline las etapas de varios
+    archivos se solapan, así que ahí es orientativo.
+    """
+
+    def __init__(self, file_path):
+        self.record = {"file": str(file_path), "format": Path(file_path).suffix.lower().lstrip("."), "decoder": None,
+                       "audio_seconds": None, "sample_rate": None, "channels": None, "cache": None,
+                       "ok": None, "total_seconds": None, "stages": {}}
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.record["stages"].setdefault(name, {"seconds": 0.0, "peak_rss_bytes": None})
+            entry["seconds"] += time.perf_counter() - start
+            entry["peak_rss_bytes"] = _peak_rss_bytes()
+
+    def add_stage(self, name, seconds):
+        # Para el tiempo de una etapa compartida con otros archivos (los lotes de --batch-clips)
+        entry = self.record["stages"].setdefault(name, {"seconds": 0.0, "peak_rss_bytes": None})
+        entry["seconds"] += seconds
+        entry["peak_rss_bytes"] = _peak_rss_bytes()
+
+    def note_audio(self, channels, frames, sr):
+        self.record.update(audio_seconds=round(frames / sr, 3), sample_rate=sr, channels=channels)
+
+    def note_decoder(self):
+        # La decodificación por tubería (ffmpeg/sox) se contabiliza como etapa propia
+        if _decoder_by_extension.get(Path(self.record["file"]).suffix.lower()) == "pipe":
+            self.record["decoder"] = _external_decoder()
+            if "decode" in self.record["stages"]:
+                self.record["stages"]["decode_pipe"] = self.record["stages"].pop("decode")
         else:
-            # Si no se guardan stems, solo necesitamos el directorio base para la voz principal
-            base_output_dir.mkdir(parents=True, exist_ok=True)
-            logging.info(f"Directorio de salida para voces procesadas: {base_output_dir}")
-
-        # Procesar y guardar stems
-        for i, stem_tensor in enumerate(stems[0]): # Iterar sobre los stems del primer (y único) batch
-            stem_name = stem_names[i] if i < len(stem_names) else f"stem_{i}"
-            
-            logging.info(f"Procesando stem: {stem_name}")
-
-            processed_stem_audio = stem_tensor # Empezamos con el stem original
-
-            # Aplicar reducción de ruido si está activada
-            if apply_denoise:
-                logging.info(f"Aplicando reducción de ruido al stem: {stem_name}.")
-                processed_stem_audio = reduce_noise(processed_stem_audio, sr)
-
-            # Aplicar normalización si está activada
-            if apply_normalize:
-                logging.info(f"Aplicando normalización de volumen al stem: {stem_name}.")
-                processed_stem_audio = normalize_volume(processed_stem_audio)
-            
-            # Determinar la ruta de guardado
-            if stem_name == 'vocals':
-                # La pista vocal procesada siempre tiene el sufijo _vocalclarity.wav
-                output_file_name = original_file_path.stem + "_vocalclarity.wav"
-                output_path = base_output_dir / output_file_name # Siempre va al directorio base
-            elif save_stems:
-                # Los otros stems procesados van a la subcarpeta específica del archivo
-                output_file_name = f"{original_file_path.stem}_{stem_name}.wav"
-                output_path = current_output_dir / output_file_name
-            else:
-                # Si no se guardan stems y no es la vocal, simplemente no se guarda
-                logging.info(f"Omitiendo guardar stem '{stem_name}' ya que --save-stems no está activado y no es la pista vocal principal.")
-                continue # Saltar al siguiente stem
+            self.record["decoder"] = "torchaudio"
 
-            # Guardar el archivo de audio procesado (o el stem si --save-stems está activo)
-            torchaudio.save(str(output_path), processed_stem_audio.cpu(), sr, encoding="PCM_S", bits_per_sample=16)
-            logging.info(f"[✅] Archivo guardado: {output_path}")
+    def close(self, ok):
+        self.record["ok"] = bool(ok)
+        self.record["total_seconds"] = round(time.perf_counter() - self._started, 4)
+        self.record["finished_at"] = round(time.time(), 3)
+        for entry in self.record["stages"].values():
+            entry["seconds"] = round(entry["seconds"], 4)
+        return self.record
 
-    except Exception as e:
-        logging.critical(f"[❌] Error CRÍTICO inesperado al procesar {original_file_path}: {e}", exc_info=True)
-    finally:
-        # Limpiar el archivo temporal de sox si fue creado
-        if temp_converted_path and temp_converted_path.exists():
-            try:
-                temp_converted_path.unlink()
-                logging.info(f"Archivo temporal eliminado: {temp_converted_path}")
-            except Exception as e:
-                logging.warning(f"No se pudo eliminar el archivo temporal {temp_converted_path}: {e}")
+class RunMetrics:
+    """
+    Métricas de una ejecución. Cada archivo terminado añade una línea a <dir>/stages.jsonl; al final
+    se escribe <dir>/vocalclarity.prom (formato de texto de Prometheus, para el textfile collector)
+    y se muestra una tabla resumen por etapa.
 
-# Bloque principal de ejecución
-if __name__ == "__main__":
-    # --- Verificaciones de Compatibilidad ---
-    python_major, python_minor = sys.version_info.major, sys.version_info.minor
-    if not (python_major == 3 and python_minor in [10, 11]):
-        warnings.warn(f"Estás usando Python {python_major}.{python_minor}. "
-                      f"Se recomienda Python 3.10 o 3.11 para una mejor compatibilidad con Demucs y PyTorch.")
-        logging.warning(f"Estás usando Python {python_major}.{python_minor}. "
-                        f"Se recomienda Python 3.10 o 3.11 para una mejor compatibilidad con Demucs y PyTorch.")
+    En los workers (--workers) los registros se acumulan y vuelven al proceso principal, que es
+    el único que escribe en disco.
+    """
 
-    # Verificar si sox está instalado al inicio
-    if not check_sox_installed():
-        sys.exit(1)
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.jsonl_path = self.output_dir / "stages.jsonl"
+        self.prometheus_path = self.output_dir / "vocalclarity.prom"
+        self.records = []
+        self._pending = []
+        self._owner_pid = os.getpid()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.startup = None
 
-    # --- Configuración del dispositivo (Siempre CPU para tu caso) ---
-    device = "cpu"
-    logging.info("Demucs se ejecutará en CPU (configuración para equipos de bajos recursos). Esto puede ser más lento.")
-    
-    parser = argparse.ArgumentParser(description="Herramienta de procesamiento de audio con separación de voces y reducción de ruido.")
-    parser.add_argument("--path", required=True, help="Ruta del archivo o carpeta de entrada. Se procesarán todos los archivos de audio detectados.")
-    parser.add_argument("--denoise", action="store_true", help="Aplicar reducción de ruido a las voces separadas.")
-    parser.add_argument("--normalize", action="store_true", help="Normalizar el volumen de las voces separadas a un pico de -1 dBFS.")
-    parser.add_argument("--save-stems", action="store_true", help="Guardar todos los stems (voces, batería, bajo, otros) separados por Demucs en una subcarpeta.")
-    args = parser.parse_args()
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["records"] = []
+        state["_pending"] = []
+        del state["_lock"]
+        return state
 
-    files = []
-    audio_exts = [".wav", ".mp3", ".flac", ".aac", ".m4a", ".ogg"]
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
-    path = Path(args.path)
-    if not path.exists():
-        logging.error(f"❌ La ruta proporcionada no existe: {args.path}")
-        sys.exit(1)
+    def note_startup(self, startup_seconds, model_load_seconds):
+        self.startup = {"startup_seconds": round(startup_seconds, 4), "model_load_seconds": round(model_load_seconds, 4)}
 
-    if path.is_file():
-        if path.suffix.lower() in audio_exts:
-            files.append(path)
-            logging.info(f"Archivo único detectado: {path}")
+    def start(self, file_path):
+        return FileMetrics(file_path)
+
+    def finish(self, record, ok):
+        result = record.close(ok)
+        if os.getpid() == self._owner_pid:
+            self._store(result)
         else:
-            logging.error(f"❌ El archivo proporcionado '{path}' no es un formato de audio compatible. Extensiones soportadas: {', '.join(audio_exts)}")
-            sys.exit(1)
-    elif path.is_dir():
-        logging.info(f"Directorio detectado: {path}. Escaneando archivos de audio...")
-        for ext in audio_exts:
-            files.extend(path.rglob(f"*{ext}"))
-        if not files:
-            logging.warning(f"No se encontraron archivos de audio compatibles en el directorio: {path} o sus subdirectorios.")
-            sys.exit(0)
-        logging.info(f"Se encontraron {len(files)} archivos de audio en el directorio.")
-    else:
-        logging.error(f"❌ La ruta proporcionada no es un archivo ni un directorio válido: {args.path}")
-        sys.exit(1)
+            self._pending.append(result)
+
+    def drain(self):
+        pending, self._pending = self._pending, []
+        return pending
+
+    def merge(self, records):
+        for result in records:
+            self._store(result)
+
+    def _store(self, result):
+        with self._lock:
+            self.records.append(result)
+            with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
 
-    logging.info(f"[🔍] Archivos detectados para procesar: {len(files)}")
+    def _stage_durations(self):
+        durations = {}
+        for result in self.records:
+            for name, entry in result["stages"].items():
+                durations.setdefault(name, []).append(entry["seconds"])
+        return {name: sorted(values) for name, values in durations.items()}
+
+    def write_prometheus(self):
+        durations = self._stage_durations()
+        ok = sum(1 for r in self.records if r["ok"])
+        audio_seconds = sum(r["audio_seconds"] or 0.0 for r in self.records)
+        peaks = [e["peak_rss_bytes"] for r in self.records for e in r["stages"].values() if e["peak_rss_bytes"]]
+        lines = [
+            "# HELP vocalclarity_files_total Archivos procesados en la última ejecución, por resultado.",
+            "# TYPE vocalclarity_files_total gauge",
+            f'vocalclarity_files_total{{status="ok"}} {ok}',
+            f'vocalclarity_files_total{{status="failed"}} {len(self.records) - ok}',
+            "# HELP vocalclarity_audio_seconds_total Segundos de audio de entrada procesados.",
+            "# TYPE vocalclarity_audio_seconds_total gauge",
+            f"vocalclarity_audio_seconds_total {audio_seconds:.3f}",
+            "# HELP vocalclarity_stage_seconds Duración por archivo de cada etapa.",
+            "# TYPE vocalclarity_stage_seconds summary",
+        ]
+        for name, values in sorted(durations.items()):
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f'vocalclarity_stage_seconds{{stage="{name}",quantile="{q}"}} {_percentile(values, q):.6f}')
+            lines.append(f'vocalclarity_stage_seconds_sum{{stage="{name}"}} {sum(values):.6f}')
+            lines.append(f'vocalclarity_stage_seconds_count{{stage="{name}"}} {len(values)}')
+        if peaks:
+            lines += ["# HELP vocalclarity_peak_rss_bytes Pico de memoria residente observado.",
+                      "# TYPE vocalclarity_peak_rss_bytes gauge",
+                      f"vocalclarity_peak_rss_bytes {max(peaks)}"]
+        if self.startup is not None:
+            lines += ["# HELP vocalclarity_startup_seconds Tiempo desde el inicio del proceso hasta estar listo para procesar.",
+                      "# TYPE vocalclarity_startup_seconds gauge",
+                      f"vocalclarity_startup_seconds {self.startup['startup_seconds']:.4f}",
+                      "# HELP vocalclarity_model_load_seconds Parte del arranque dedicada a cargar el modelo.",
+                      "# TYPE vocalclarity_model_load_seconds gauge",
+                      f"vocalclarity_model_load_seconds {self.startup['model_load_seconds']:.4f}"]
+        lines += ["# HELP vocalclarity_run_seconds Duración total de la última ejecución.",
+                  "# TYPE vocalclarity_run_seconds gauge",
+                  f"vocalclarity_run_seconds {time.perf_counter() - self._started:.3f}",
+                  "# HELP vocalclarity_last_run_timestamp_seconds Momento en que terminó la última ejecución.",
+                  "# TYPE vocalclarity_last_run_timestamp_seconds gauge",
+                  f"vocalclarity_last_run_timestamp_seconds {time.time():.0f}"]
+        # Escritura atómica: el collector nunca lee un archivo a medias
+        tmp_path = self.prometheus_path.with_suffix(".prom.tmp")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp_path, self.prometheus_path)
+
+    def log_summary(self):
+        durations = self._stage_durations()
+        audio_seconds = sum(r["audio_seconds"] or 0.0 for r in self.records)
+        wall = time.perf_counter() - self._started
+        rtf = f", factor de tiempo real {wall / audio_seconds:.3f}" if audio_seconds else ""
+        logger.info(f"[📊] Métricas: {len(self.records)} archivo(s), {audio_seconds:.1f}s de audio en {wall:.1f}s{rtf}.")
+        if self.startup is not None:
+            logger.info(f"Arranque: {self.startup['startup_seconds']:.2f}s (modelo: {self.startup['model_load_seconds']:.2f}s).")
+        logger.info(f"{'etapa':<12} {'n':>5} {'total s':>9} {'media s':>8} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'máx s':>8}")
+        for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            logger.info(f"{name:<12} {len(values):>5} {sum(values):>9.2f} {sum(values) / len(values):>8.3f} "
+                         f"{_percentile(values, 0.5):>8.3f} {_percentile(values, 0.9):>8.3f} "
+                         f"{_percentile(values, 0.99):>8.3f} {values[-1]:>8.3f}")
+        logger.info(f"Registros por archivo en {self.jsonl_path}; métricas Prometheus en {self.prometheus_path}.")
+
+# --- Etapas del procesamiento de un archivo ---
+def load_audio(file_path):
+    """
+    Carga un archivo de audio con el decodificador adecuado para su extensión.
+    Devuelve (waveform, sr) o None si no se pudo cargar.
+    """
     try:
-        logging.info(f"Cargando el modelo Demucs 'htdemucs' en el dispositivo: {device}...")
-        model = get_model(name="htdemucs")
-        model.to(device)
-        logging.info("Modelo Demucs cargado con éxito.")
+        return decode_audio(file_path)
     except Exception as e:
-        logging.critical(f"Fallo CRÍTICO al cargar el modelo Demucs: {e}", exc_info=True)
-        logging.critical("Esto puede ser debido a una instalación corrupta, problemas de red durante la descarga del modelo, o incompatibilidad de versiones (especialmente Python 3.12+).")
-        logging.critical("Intenta 'rm -rf ~/.cache/demucs' y/o verifica la versión de Python/PyTorch en tu entorno virtual.")
-        sys.exit(1)
+        logger.error(f"[❌] No se pudo cargar el archivo: {file_path}\n{e}", exc_info=True)
+        return None
 
-    base_out_dir = "processed_audio_clarity"
-    os.makedirs(base_out_dir, exist_ok=True)
-    logging.info(f"Directorio de salida base establecido en: {base_out_dir}")
+def prepare_waveform(waveform, original_file_path):
+    """
+    Demucs espera (batch, channels, samples). Asegura 3 dimensiones y 2 canales.
+    Devuelve el tensor preparado o None si la forma no es válida.
+    """
+    if waveform.ndim == 1:
+        waveform = waveform.unsqueeze(0)
+        logger.info("Forma de onda mono 1D convertida a (1, muestras).")
+    elif waveform.ndim > 2:
+        logger.error(f"[❌] Tensor con más de 2 dimensiones: {original_file_path}. Se esperaban 1 o 2, se obtuvieron {waveform.ndim}")
+        return None
+    
+    if waveform.shape[0] == 1: # Si es mono (1 canal)
+        waveform = waveform.repeat(2, 1) # Duplicar el canal para hacerlo estéreo (2, muestras)
+        logger.info("Forma de onda mono convertida a estéreo (2 canales) duplicando el canal.")
+    elif waveform.shape[0] > 2: # Si tiene más de 2 canales, convertir a estéreo promediando o tomando los primeros
+        logger.warning(f"Archivo con {waveform.shape[0]} canales. Remuestreando a estéreo (2 canales).")
+        if waveform.shape[0] >= 2:
+            waveform = waveform[:2, :] # Tomar los dos primeros canales
+        else: 
+            waveform = waveform.mean(dim=0, keepdim=True).repeat(2, 1) # Promediar a mono y luego duplicar
+        logger.info(f"Forma de onda remuestreada a 2 canales.")
 
-    # Desactivar el logging a la consola mientras tqdm está activo
-    for handler in logging.root.handlers:
-        if isinstance(handler, logging.StreamHandler):
-            handler.setLevel(logging.CRITICAL)
+    if waveform.ndim == 2:
+        waveform = waveform.unsqueeze(0)
+        logger.info("Forma de onda ajustada a 3 dimensiones (batch, channels, samples).")
+    return waveform
+
+def separate(model, waveform, device, original_file_path):
+    """
+    Aplica Demucs a un tensor (1, 2, muestras). Devuelve los stems (stems, canales, muestras) o None.
+    """
+    waveform = waveform.to(device)
+    logger.info(f"Forma de onda movida a dispositivo: {device}.")
+
+    try:
+        logger.info(f"Aplicando el modelo Demucs a {original_file_path}...") 
+        stems, regions = separate_active(model, waveform, device)
+        logger.info(f"Modelo Demucs aplicado con éxito a {original_file_path}.")
+        if regions is not None:
+            skipped = _skipped_samples(regions, waveform.shape[-1]) / model.samplerate
+            logger.info(f"[🤫] {original_file_path}: {skipped:.1f}s de {waveform.shape[-1] / model.samplerate:.1f}s "
+                         f"inactivos no pasaron por Demucs ({len(regions)} tramo(s) activo(s)).")
+    except Exception as e:
+        logger.error(f"[❌] Error al aplicar el modelo Demucs a {original_file_path}: {e}", exc_info=True)
+        return None
+
+    if stems.shape[0] < 1:
+         logger.error(f"[❌] El modelo Demucs no devolvió ningún stem para {original_file_path}.")
+         return None
+    return stems[0] # Stems del primer (y único) batch
+
+def postprocess_tracks(stems, sr, plan, apply_denoise, apply_normalize, denoise_engine="torch", record=None, output_sr=None,
+                       postprocess_sr=None, output_frames=None):
+    """
+    Forma y post-procesa en memoria las pistas de plan [(nombre, índices, ...)]. Devuelve un dict {nombre: tensor}.
+    stems están a sr; la reducción de ruido y la normalización se hacen a postprocess_sr y las pistas se
+    devuelven a output_sr (por defecto, ambas sr) con output_frames muestras si se indica (ida y vuelta
+    por otra frecuencia puede dejar una muestra de más o de menos). Sin post-procesado ni remuestreo,
+    las pistas de un solo stem son vistas de stems, sin copias.
+    """
+    tracks = [extract_output(stems, entry[1]) for entry in plan] # Empezamos con los stems originales
+    if postprocess_sr and postprocess_sr != sr and tracks:
+        with _stage(record, "resample"):
+            tracks = list(resample(torch.stack(tracks), sr, postprocess_sr))
+        sr = postprocess_sr
+
+    # Aplicar reducción de ruido si está activada: todas las pistas seleccionadas en una sola llamada
+    if apply_denoise and tracks:
+        logger.info(f"Aplicando reducción de ruido ({denoise_engine}) a: {', '.join(entry[0] for entry in plan)}.")
+        with _stage(record, "denoise"):
+            tracks = list(denoise_batch(torch.stack(tracks), sr, denoise_engine))
+
+    processed = {}
+    for entry, processed_stem_audio in zip(plan, tracks):
+        stem_name = entry[0]
+        logger.info(f"Procesando stem: {stem_name}")
+
+        # Aplicar normalización si está activada
+        if apply_normalize:
+            logger.info(f"Aplicando normalización de volumen al stem: {stem_name}.")
+            with _stage(record, "normalize"):
+                processed_stem_audio = normalize_volume(processed_stem_audio)
+        if output_sr and output_sr != sr:
+            with _stage(record, "resample"):
+                processed_stem_audio = resample(processed_stem_audio, sr, output_sr)
+        if output_frames:
+            processed_stem_audio = fit_length(processed_stem_audio, output_frames)
+        processed[stem_name] = processed_stem_audio
+    return processed
+
+def save_tracks(tracks, sr, plan, record=None):
+    """Guarda las pistas {nombre: tensor} en las rutas de plan [(nombre, índices, ruta)]. Devuelve {nombre: ruta_guardada}."""
+    written = {}
+    for stem_name, _, output_path in plan:
+        # Guardar el archivo de audio procesado (o el stem si --save-stems está activo).
+        # Se elimina antes cualquier versión previa: puede ser un enlace duro a una entrada de la caché.
+        if output_path.exists():
+            output_path.unlink()
+        with _stage(record, "write"):
+            torchaudio.save(str(output_path), tracks[stem_name].cpu(), sr, encoding="PCM_S", bits_per_sample=16)
+        logger.info(f"[✅] Archivo guardado: {output_path}")
+        written[stem_name] = output_path
+    return written
+
+def write_stems(stems, sr, original_file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, sources, two_stems=None,
+                denoise_engine="torch", record=None, output_sr=None, postprocess_sr=None, output_frames=None):
+    """
+    Post-procesa y guarda solo las pistas que se van a escribir (ver postprocess_tracks). Devuelve un dict {nombre: ruta_guardada}.
+    """
+    # --- Lógica de directorios de salida ---
+    prepare_output_dirs(original_file_path, base_output_dir, save_stems)
+
+    plan = plan_outputs(sources, original_file_path, base_output_dir, save_stems, two_stems)
+    tracks = postprocess_tracks(stems, sr, plan, apply_denoise, apply_normalize, denoise_engine, record, output_sr,
+                                postprocess_sr, output_frames)
+    return save_tracks(tracks, output_sr or sr, plan, record)
+
+# --- Etapas de un archivo ---
+# process_file las encadena una tras otra; el modo --pipeline las ejecuta en hilos distintos.
+# Cada etapa recibe y completa un dict de trabajo con 'file_path', 'waveform', 'stems', 'sr' (la del modelo),
+# 'source_sr' (la del archivo), 'keys' y 'record' (el FileMetrics del archivo, o None sin --metrics-dir).
+
+def decode_stage(file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, cache=None, two_stems=None,
+                 denoise_engine="torch", record=None, model_sr=None, output_sr="source", native_postprocess=False):
+    """
+    Consulta la caché, decodifica el archivo y lo remuestrea a model_sr (la frecuencia del modelo).
+    Devuelve True si las salidas se recuperaron de la caché, None si falló, o el dict de trabajo.
+    """
+    job = {"file_path": file_path, "waveform": None, "stems": None, "sr": None, "source_sr": None, "source_frames": None,
+           "keys": None, "record": record}
+    if cache is not None:
+        with _stage(record, "cache"):
+            separation_key = cache.separation_key(file_path)
+            output_key = cache.output_key(separation_key, apply_denoise, apply_normalize, save_stems, two_stems, denoise_engine,
+                                          output_sr, native_postprocess)
+            job["keys"] = (separation_key, output_key)
+            restored = cache.restore_outputs(output_key, file_path, base_output_dir, save_stems)
+            cached_stems = None if restored else cache.get_stems(separation_key, model_sr)
+        if restored:
+            if record is not None:
+                record.record["cache"] = "outputs"
+            return True
+        if cached_stems is not None:
+            job["stems"], job["sr"], job["source_sr"], job["source_frames"] = cached_stems
+            if record is not None:
+                record.record["cache"] = "stems"
+                record.note_audio(job["stems"].shape[-2], job["stems"].shape[-1], job["sr"])
+            return job
+
+    with _stage(record, "decode"):
+        loaded = load_audio(file_path)
+    if loaded is None:
+        return None
+    waveform, job["source_sr"] = loaded
+    if record is not None:
+        record.note_decoder()
+        record.note_audio(waveform.shape[0] if waveform.ndim > 1 else 1, waveform.shape[-1], job["source_sr"])
+
+    with _stage(record, "prepare"):
+        job["waveform"] = prepare_waveform(waveform, file_path)
+    if job["waveform"] is None:
+        return None
+    job["source_frames"] = job["waveform"].shape[-1]
+    job["sr"] = model_sr or job["source_sr"]
+    if job["sr"] != job["source_sr"]:
+        logger.info(f"Remuestreando de {job['source_sr']} Hz a {job['sr']} Hz (frecuencia del modelo).")
+        with _stage(record, "resample"):
+            job["waveform"] = resample(job["waveform"], job["source_sr"], job["sr"])
+    return job
+
+def separate_stage(model, job, device, cache=None):
+    """
+    Aplica Demucs si los stems no vienen ya de la caché. Devuelve False si falló.
+    """
+    if job["stems"] is not None:
+        return True
+    with _stage(job["record"], "separate"):
+        job["stems"] = separate(model, job.pop("waveform"), device, job["file_path"])
+    if job["stems"] is None:
+        return False
+    if cache is not None:
+        with _stage(job["record"], "cache"):
+            cache.put_stems(job["keys"][0], job["stems"], job["sr"], job["source_sr"], job["source_frames"])
+    return True
+
+def write_stage(job, sources, base_output_dir, apply_denoise, apply_normalize, save_stems, cache=None, two_stems=None,
+                denoise_engine="torch", output_sr="source", native_postprocess=False):
+    # --native-postprocess: reducción de ruido y normalización a la frecuencia menor de las dos
+    postprocess_sr = min(job["sr"], job["source_sr"]) if native_postprocess else job["sr"]
+    written = write_stems(job["stems"], job["sr"], job["file_path"], base_output_dir, apply_denoise, apply_normalize, save_stems,
+                          sources, two_stems, denoise_engine, job["record"],
+                          output_sr=job["source_sr"] if output_sr == "source" else job["sr"], postprocess_sr=postprocess_sr,
+                          output_frames=job["source_frames"] if output_sr == "source" else None)
+    if cache is not None:
+        with _stage(job["record"], "cache"):
+            cache.put_outputs(job["keys"][1], written)
+    return True
+
+# Procesar archivo individual
+def process_file(model, file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, device,
+                 stream=False, chunk_seconds=60.0, overlap_seconds=5.0, cache=None, two_stems=None, denoise_engine="torch",
+                 metrics=None, output_sr="source", native_postprocess=False):
+    record = metrics.start(file_path) if metrics is not None else None
+    ok = False
+    try:
+        if stream:
+            ok = process_file_streaming(model, file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, device,
+                                        chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds, two_stems=two_stems,
+                                        denoise_engine=denoise_engine, record=record, output_sr=output_sr,
+                                        native_postprocess=native_postprocess)
+            return ok
+
+        sources = list(getattr(model, "sources", DEFAULT_SOURCES))
+        logger.info(f"[DEMUCS] Procesando: {file_path}")
+
+        job = decode_stage(file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, cache, two_stems, denoise_engine,
+                           record, int(getattr(model, "samplerate", 44100)), output_sr, native_postprocess)
+        if job is None or job is True:
+            ok = job is True
+            return ok
+
+        # Aplicar el modelo Demucs
+        if not separate_stage(model, job, device, cache):
+            return False
+
+        ok = write_stage(job, sources, base_output_dir, apply_denoise, apply_normalize, save_stems, cache, two_stems, denoise_engine,
+                         output_sr, native_postprocess)
+        return ok
+    except Exception as e:
+        logger.critical(f"[❌] Error CRÍTICO inesperado al procesar {file_path}: {e}", exc_info=True)
+        return False
+    finally:
+        if metrics is not None:
+            metrics.finish(record, ok)
+
+# --- Pipeline por etapas (--pipeline) ---
+def process_files_pipelined(model, files, base_output_dir, apply_denoise, apply_normalize, save_stems, device,
+                            cache=None, two_stems=None, denoise_engine="torch", prefetch=2, writer_threads=2, metrics=None,
+                            on_result=None, output_sr="source", native_postprocess=False):
+    """
+    Procesa una lista de archivos solapando etapas: un hilo decodifica por adelantado, el hilo
+    principal ejecuta Demucs sin pausas y un pool de hilos post-procesa y escribe los WAV.
+    prefetch limita cuántos archivos decodificados esperan en memoria a Demucs, y como mucho
+    2 * writer_threads resultados separados esperan a ser escritos.
+    on_result(file_path, ok) se llama al terminar cada archivo, desde el hilo que lo terminó.
+    Devuelve el número de archivos procesados con éxito.
+    """
+    from tqdm import tqdm
+    sources = list(getattr(model, "sources", DEFAULT_SOURCES))
+    decoded = queue.Queue(maxsize=prefetch)
+    write_slots = threading.BoundedSemaphore(2 * writer_threads)
+    lock = threading.Lock()
+    results = {"ok": 0}
+    progress = tqdm(total=len(files), desc="🎵 Procesando audio", unit=" archivo")
+
+    def finish(file_path, ok, record=None):
+        with lock:
+            results["ok"] += bool(ok)
+        if metrics is not None:
+            metrics.finish(record, ok)
+        if on_result is not None:
+            on_result(file_path, ok)
+        progress.update(1)
+
+    def decode_worker():
+        try:
+            for f in files:
+                record = metrics.start(f) if metrics is not None else None
+                try:
+                    logger.info(f"[DEMUCS] Procesando: {f}")
+                    job = decode_stage(f, base_output_dir, apply_denoise, apply_normalize, save_stems, cache, two_stems, denoise_engine,
+                                       record, int(getattr(model, "samplerate", 44100)), output_sr, native_postprocess)
+                    if job is None or job is True:
+                        finish(f, job is True, record)
+                    else:
+                        decoded.put(job) # Se bloquea si ya hay `prefetch` archivos esperando
+                except Exception as e:
+                    logger.critical(f"[❌] Error CRÍTICO inesperado al decodificar {f}: {e}", exc_info=True)
+                    finish(f, False, record)
+        finally:
+            decoded.put(None)
+
+    def write_worker(job):
+        try:
+            finish(job["file_path"],
+                   write_stage(job, sources, base_output_dir, apply_denoise, apply_normalize, save_stems, cache, two_stems, denoise_engine,
+                               output_sr, native_postprocess),
+                   job["record"])
+        except Exception as e:
+            logger.critical(f"[❌] Error CRÍTICO inesperado al guardar {job['file_path']}: {e}", exc_info=True)
+            finish(job["file_path"], False, job["record"])
+        finally:
+            write_slots.release()
+
+    decoder = threading.Thread(target=decode_worker, name="vcp-decode", daemon=True)
+    decoder.start()
+    with ThreadPoolExecutor(max_workers=writer_threads, thread_name_prefix="vcp-write") as writers:
+        while True:
+            job = decoded.get()
+            if job is None:
+                break
+            try:
+                if not separate_stage(model, job, device, cache):
+                    finish(job["file_path"], False, job["record"])
+                    continue
+            except Exception as e:
+                logger.critical(f"[❌] Error CRÍTICO inesperado al separar {job['file_path']}: {e}", exc_info=True)
+                finish(job["file_path"], False, job["record"])
+                continue
+            write_slots.acquire() # Limita los resultados en memoria si la escritura va más lenta que Demucs
+            writers.submit(write_worker, job)
+    decoder.join()
+    progress.close()
+    return results["ok"]
+
+# --- Lotes de clips cortos (--batch-clips) ---
+# Muchos clips de pocos segundos: cada llamada a apply_model rellena el clip hasta la duración de segmento
+# del modelo (7.8 s en htdemucs), así que un clip de 2 s cuesta casi lo mismo que uno de 8 s. Los clips que
+# caben en un solo trozo de apply_model se apilan en la dimensión de batch (nunca concatenados: compartirían
+# la normalización y la atención del segmento) y se colocan de modo que el modelo reciba exactamente la
+# misma ventana rellenada que si se separaran solos.
+
+def _clip_window(model, length):
+    """
+    Longitud a la que apply_model rellena, centrado, un clip de `length` muestras antes de pasarlo al
+    modelo. None si lo separa en varios trozos (o si los modelos de una bolsa no coinciden).
+    """
+    from demucs.htdemucs import HTDemucs
+    options = getattr(model, "separation_options", {})
+    windows = set()
+    for sub in getattr(model, "models", [model]):
+        segment = options.get("segment") or sub.segment
+        if options.get("split", True) and length > int((1 - options.get("overlap", 0.25)) * int(sub.samplerate * segment)):
+            return None
+        if isinstance(sub, HTDemucs) and options.get("segment") is not None:
+            windows.add(int(options["segment"] * sub.samplerate))
+        elif hasattr(sub, "valid_length"):
+            windows.add(sub.valid_length(length))
+        else:
+            windows.add(length)
+    return windows.pop() if len(windows) == 1 else None
+
+def process_files_batched(model, files, base_output_dir, apply_denoise, apply_normalize, save_stems, device,
+                          cache=None, two_stems=None, denoise_engine="torch", metrics=None, on_result=None,
+                          output_sr="source", native_postprocess=False, batch_clips=8, batch_max_seconds=60.0):
+    """
+    Procesa los archivos en orden agrupando en cada separación hasta batch_clips clips consecutivos que
+    apply_model separa en un solo trozo y con la misma ventana de relleno, sin pasar de batch_max_seconds
+    en total. Los demás archivos (y todos con --skip-silence) se separan solos. Si la separación de un
+    lote falla, sus clips se reintentan uno a uno. Devuelve el número de archivos procesados con éxito.
+    """
+    from tqdm import tqdm
+    sources = list(getattr(model, "sources", DEFAULT_SOURCES))
+    model_sr = int(getattr(model, "samplerate", 44100))
+    max_frames = int(batch_max_seconds * model_sr)
+    skip_silence = bool(getattr(model, "silence_options", None))
+    if skip_silence:
+        logger.info("--batch-clips no se aplica con --skip-silence: cada clip se separa solo.")
+    progress = tqdm(total=len(files), desc="🎵 Procesando audio", unit=" archivo")
+    results = {"ok": 0}
+    batch = []
+
+    def window_of(length):
+        # Ventana de relleno del clip, o None si hay que separarlo solo
+        return None if skip_silence else _clip_window(model, length)
+
+    def finish(file_path, ok, record=None):
+        results["ok"] += bool(ok)
+        if metrics is not None:
+            metrics.finish(record, ok)
+        if on_result is not None:
+            on_result(file_path, ok)
+        progress.update(1)
+
+    def write(job):
+        try:
+            ok = write_stage(job, sources, base_output_dir, apply_denoise, apply_normalize, save_stems, cache, two_stems,
+                             denoise_engine, output_sr, native_postprocess)
+        except Exception as e:
+            logger.critical(f"[❌] Error CRÍTICO inesperado al guardar {job['file_path']}: {e}", exc_info=True)
+            ok = False
+        finish(job["file_path"], ok, job["record"])
+
+    def separate_alone(job):
+        try:
+            ok = separate_stage(model, job, device, cache)
+        except Exception as e:
+            logger.critical(f"[❌] Error CRÍTICO inesperado al separar {job['file_path']}: {e}", exc_info=True)
+            ok = False
+        if ok:
+            write(job)
+        else:
+            finish(job["file_path"], False, job["record"])
+
+    def flush():
+        jobs = batch[:]
+        batch.clear()
+        if len(jobs) == 1:
+            separate_alone(jobs[0])
+            return
+        lengths = [job["waveform"].shape[-1] for job in jobs]
+        width = max(lengths)
+        window = window_of(width)
+        # apply_model rellena el trozo de `width` muestras centrándolo en `window`; cada clip se desplaza
+        # para quedar en la ventana donde lo pondría separado solo (centrado en window_of(length) == window)
+        offsets = [(window - length) // 2 - (window - width) // 2 for length in lengths]
+        mix = torch.zeros(len(jobs), 2, width)
+        for i, (job, offset, length) in enumerate(zip(jobs, offsets, lengths)):
+            mix[i, :, offset:offset + length] = job.pop("waveform")[0]
+        label = f"un lote de {len(jobs)} clips ({sum(lengths) / model_sr:.1f}s)"
+        started = time.perf_counter()
+        try:
+            logger.info(f"Aplicando el modelo Demucs a {label}...")
+            stems = run_model(model, mix.to(device), device)
+        except Exception as e:
+            logger.error(f"[❌] Error al aplicar el modelo Demucs a {label}: {e}", exc_info=True)
+            stems = None
+        seconds = time.perf_counter() - started
+        if stems is None:
+            logger.warning(f"Falló la separación de {label}; se separan uno a uno.")
+            for i, (job, offset, length) in enumerate(zip(jobs, offsets, lengths)):
+                job["waveform"] = mix[i:i + 1, :, offset:offset + length]
+                separate_alone(job)
+            return
+        for i, (job, offset, length) in enumerate(zip(jobs, offsets, lengths)):
+            job["stems"] = stems[i, ..., offset:offset + length].clone()
+            if job["record"] is not None:
+                # El tiempo del lote se reparte en proporción a la duración de cada clip
+                job["record"].add_stage("separate", seconds * length / sum(lengths))
+            if cache is not None:
+                with _stage(job["record"], "cache"):
+                    cache.put_stems(job["keys"][0], job["stems"], job["sr"], job["source_sr"], job["source_frames"])
+            write(job)
+
+    for f in files:
+        record = metrics.start(f) if metrics is not None else None
+        try:
+            logger.info(f"[DEMUCS] Procesando: {f}")
+            job = decode_stage(f, base_output_dir, apply_denoise, apply_normalize, save_stems, cache, two_stems, denoise_engine,
+                               record, model_sr, output_sr, native_postprocess)
+        except Exception as e:
+            logger.critical(f"[❌] Error CRÍTICO inesperado al decodificar {f}: {e}", exc_info=True)
+            job = None
+        if job is None or job is True:
+            finish(f, job is True, record)
+            continue
+        if job["stems"] is not None: # Stems recuperados de la caché
+            write(job)
+            continue
+        length = job["waveform"].shape[-1]
+        window = window_of(length)
+        if window is None or length > max_frames:
+            if batch:
+                flush()
+            separate_alone(job)
+            continue
+        if batch:
+            width = max(length, *(j["waveform"].shape[-1] for j in batch))
+            if len(batch) >= batch_clips or window_of(batch[0]["waveform"].shape[-1]) != window \
+                    or (len(batch) + 1) * width > max_frames:
+                flush()
+        batch.append(job)
+    if batch:
+        flush()
+    progress.close()
+    return results["ok"]
+
+# --- Modo streaming (--stream) ---
+# Para grabaciones muy largas: el audio se decodifica por bloques y Demucs se aplica sobre
+# ventanas solapadas que se unen con un fundido cruzado (overlap-add). La memoria usada
+# depende del tamaño de ventana, no de la duración del archivo.
+
+# Tamaño de los bloques leídos del decodificador en modo streaming
+STREAM_BLOCK_FRAMES = 1 << 16
+
+def _to_stereo(block):
+    # Misma conversión que process_file: mono se duplica, más de 2 canales se recorta a los 2 primeros
+    if block.ndim == 1:
+        block = block.unsqueeze(0)
+    if block.shape[0] == 1:
+        return block.repeat(2, 1)
+    return block[:2, :]
+
+class StreamingWavWriter:
+    """
+    Escribe un stem por trozos en un WAV PCM de 16 bits.
+    Si se pide normalización, los trozos se guardan primero en un archivo temporal en float32
+    y la ganancia (que depende del pico global) se aplica en una segunda pasada al cerrar. El pico
+    se mide en peak_of si se pasa: el modo normal normaliza antes de remuestrear a la frecuencia de salida.
+    """
+
+    def __init__(self, output_path, sr, channels, normalize, target_peak_db=-1.0):
+        self.output_path = Path(output_path)
+        self.sr = sr
+        self.channels = channels
+        self.normalize = normalize
+        self.target_peak_db = target_peak_db
+        self.peak = 0.0
+        if normalize:
+            self.temp_path = self.output_path.with_name(f".{self.output_path.name}.part")
+            self._raw = open(self.temp_path, "wb")
+        else:
+            self.temp_path = None
+            self._wav = self._open_wav()
+
+    def _open_wav(self):
+        if self.output_path.exists():
+            self.output_path.unlink() # Puede ser un enlace duro a una entrada de la caché
+        wav = wave.open(str(self.output_path), "wb")
+        wav.setnchannels(self.channels)
+        wav.setsampwidth(2)
+        wav.setframerate(self.sr)
+        return wav
+
+    def _write_pcm16(self, wav, chunk):
+        pcm = (chunk.clamp(-1.0, 1.0) * 32767.0).round().to(torch.int16)
+        wav.writeframes(pcm.t().contiguous().numpy().tobytes()) # Intercalar canales
+
+    def write(self, chunk, peak_of=None):
+        chunk = chunk.detach().cpu().float()
+        peak_of = chunk if peak_of is None else peak_of
+        if self.normalize:
+            if peak_of.numel():
+                self.peak = max(self.peak, peak_of.abs().max().item())
+            self._raw.write(chunk.t().contiguous().numpy().tobytes())
+        else:
+            self._write_pcm16(self._wav, chunk)
+
+    def close(self, block_frames=1 << 20):
+        if not self.normalize:
+            self._wav.close()
+            return
+        self._raw.close()
+        if self.peak > 0:
+            scale_factor = 10**(self.target_peak_db / 20) / self.peak
+            logger.info(f"Volumen normalizado (pico global {self.peak:.4f}). Factor de escalado aplicado: {scale_factor:.4f}.")
+        else:
+            logger.warning("El audio es silencioso, no se puede normalizar.")
+            scale_factor = 1.0
+        wav = self._open_wav()
+        try:
+            with open(self.temp_path, "rb") as raw:
+                while True:
+                    data = raw.read(block_frames * self.channels * 4)
+                    if not data:
+                        break
+                    chunk = torch.frombuffer(bytearray(data), dtype=torch.float32).view(-1, self.channels).t()
+                    self._write_pcm16(wav, chunk * scale_factor)
+        finally:
+            wav.close()
+            self.temp_path.unlink()
+
+    def abort(self):
+        # Cerrar y eliminar salidas parciales tras un error
+        handle = self._raw if self.normalize else self._wav
+        try:
+            handle.close()
+        except Exception:
+            pass
+        for path in (self.temp_path, self.output_path):
+            if path is not None and path.exists():
+                path.unlink()
+
+def process_file_streaming(model, file_path, base_output_dir, apply_denoise, apply_normalize, save_stems, device,
+                           chunk_seconds=60.0, overlap_seconds=5.0, two_stems=None, denoise_engine="torch", record=None,
+                           output_sr="source", native_postprocess=False):
+    original_file_path = file_path
+    writers = {}
+    blocks = None
+
+    try:
+        logger.info(f"[DEMUCS] Procesando en modo streaming: {original_file_path}")
+        blocks = iter_audio_blocks(file_path, STREAM_BLOCK_FRAMES)
+        with _stage(record, "decode"):
+            first_block = next(blocks, None)
+        if first_block is None:
+            logger.error(f"[❌] No se pudo leer audio de {original_file_path}.")
+            return False
+        source_sr = first_block[1]
+        sr = int(getattr(model, "samplerate", source_sr)) # Las ventanas se separan a la frecuencia del modelo
+        postprocess_sr = min(sr, source_sr) if native_postprocess else sr
+        out_sr = source_sr if output_sr == "source" else sr
+        # Remuestreo por bloques: entrada → modelo, modelo → post-proceso y post-proceso → salida
+        incoming = StreamingResampler(source_sr, sr)
+        to_postprocess = StreamingResampler(sr, postprocess_sr)
+        to_output = StreamingResampler(postprocess_sr, out_sr)
+        denoiser = StreamingDenoiser(postprocess_sr, denoise_engine) if apply_denoise else None
+
+        window = int(chunk_seconds * sr)
+        overlap = int(overlap_seconds * sr)
+        if overlap <= 0 or 2 * overlap >= window:
+            logger.error(f"[❌] Solapamiento de {overlap_seconds}s no válido para ventanas de {chunk_seconds}s.")
+            return False
+        hop = window - overlap
+        fade_in = torch.linspace(0.0, 1.0, overlap, device=device)
+        fade_out = 1.0 - fade_in
+        sources = list(getattr(model, "sources", DEFAULT_SOURCES))
+
+        prepare_output_dirs(original_file_path, base_output_dir, save_stems)
+        for stem_name, indices, output_path in plan_outputs(sources, original_file_path, base_output_dir, save_stems, two_stems):
+            writers[tuple(indices)] = StreamingWavWriter(output_path, out_sr, 2, apply_normalize)
+
+        def convert(resampler, segments, final):
+            with _stage(record, "resample"):
+                converted = resampler.feed(segments)
+                tail = resampler.flush() if final else None
+            return converted if tail is None else torch.cat([converted, tail], dim=-1)
+
+        def emit(stems_segment, final=False):
+            segments = torch.stack([extract_output(stems_segment, list(indices)) for indices in writers])
+            segments = convert(to_postprocess, segments, final)
+            if denoiser is not None:
+                # Mismos tramos y contexto que sobre el archivo entero: sin saltos en los bordes de ventana
+                with _stage(record, "denoise"):
+                    denoised = denoiser.feed(segments)
+                    tail = denoiser.flush() if final else None
+                segments = denoised if tail is None else torch.cat([denoised, tail], dim=-1)
+            peaks = segments # El modo normal normaliza a la frecuencia de post-proceso
+            segments = convert(to_output, segments, final)
+            if final and out_sr == source_sr:
+                # Misma longitud que el original, como en el modo normal
+                segments = fit_length(segments, max(0, counts["source"] - counts["written"]))
+            counts["written"] += segments.shape[-1]
+            with _stage(record, "write"):
+                for writer, segment, peak_of in zip(writers.values(), segments, peaks):
+                    writer.write(segment, peak_of)
+
+        counts = {"source": first_block[0].shape[-1], "written": 0} # Muestras leídas y escritas, a la frecuencia de origen
+        with _stage(record, "resample"):
+            buffer = incoming.feed(_to_stereo(first_block[0]))
+        prev_tail = None # Cola (ya atenuada) de la ventana anterior, de longitud `overlap`
+        total_frames = 0
+        skipped_frames = 0
+        windows = 0
+        exhausted = False
+
+        while True:
+            # Leer hasta tener más de una ventana completa (o hasta el final del archivo)
+            while not exhausted and buffer.shape[-1] <= window:
+                with _stage(record, "decode"):
+                    block = next(blocks, None)
+                with _stage(record, "resample"):
+                    if block is None:
+                        exhausted = True
+                        tail = incoming.flush()
+                        if tail is not None:
+                            buffer = torch.cat([buffer, tail], dim=-1)
+                    else:
+                        counts["source"] += block[0].shape[-1]
+                        buffer = torch.cat([buffer, incoming.feed(_to_stereo(block[0]))], dim=-1)
+            if buffer.shape[-1] == 0:
+                break
+
+            is_last = buffer.shape[-1] <= window
+            chunk = buffer if is_last else buffer[:, :window]
+            with _stage(record, "separate"):
+                stems, regions = separate_active(model, chunk.unsqueeze(0).to(device), device)
+                stems = stems[0] # (stems, canales, muestras)
+            windows += 1
+            # El solapamiento se cuenta en la ventana siguiente
+            skipped_frames += _skipped_samples(regions, chunk.shape[-1] if is_last else hop)
+
+            if prev_tail is not None:
+                # Fuera de lugar: la salida de run_model puede ser un tensor de inference_mode
+                stems = torch.cat([stems[..., :overlap] * fade_in + prev_tail, stems[..., overlap:]], dim=-1)
+
+            if is_last:
+                emit(stems, final=True)
+                total_frames += stems.shape[-1]
+                break
+
+            emit(stems[..., :hop])
+            total_frames += hop
+            prev_tail = stems[..., hop:] * fade_out
+            buffer = buffer[:, hop:]
+
+        for writer in writers.values():
+            with _stage(record, "write"):
+                writer.close()
+            logger.info(f"[✅] Archivo guardado: {writer.output_path}")
+        writers.clear()
+        if record is not None:
+            record.note_decoder()
+            record.note_audio(first_block[0].shape[0] if first_block[0].ndim > 1 else 1, round(total_frames * source_sr / sr), source_sr)
+        logger.info(f"Streaming finalizado para {original_file_path}: {windows} ventana(s), {total_frames / sr:.1f}s de audio.")
+        if getattr(model, "silence_options", None):
+            logger.info(f"[🤫] {original_file_path}: {skipped_frames / sr:.1f}s de {total_frames / sr:.1f}s inactivos no pasaron por Demucs.")
+        return True
+    except Exception as e:
+        logger.critical(f"[❌] Error CRÍTICO inesperado al procesar {original_file_path} en modo streaming: {e}", exc_info=True)
+        return False
+    finally:
+        for writer in writers.values():
+            writer.abort()
+        if blocks is not None:
+            blocks.close() # Termina el proceso decodificador si aún sigue activo
+
+# --- Entrada incremental (--incremental / --watch) ---
+def scan_audio_files(root, exclude=()):
+    """
+    Recorre root una sola vez con os.scandir (en lugar de un rglob por extensión) y devuelve
+    [(ruta, tamaño, mtime_ns)] de los archivos de audio, ordenada por ruta. Los enlaces simbólicos
+    a directorios no se siguen y los directorios de exclude (p. ej. la carpeta de salida) se saltan.
+    """
+    extensions = set(AUDIO_EXTS)
+    excluded = {os.path.abspath(d) for d in exclude}
+    found = []
+    pending_dirs = [os.fspath(root)]
+    while pending_dirs:
+        directory = pending_dirs.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if os.path.abspath(entry.path) not in excluded:
+                                pending_dirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                            stat = entry.stat()
+                            found.append((Path(entry.path), stat.st_size, stat.st_mtime_ns))
+                    except OSError:
+                        continue # Eliminado o inaccesible mientras se recorría
+        except OSError as e:
+            logger.warning(f"No se pudo leer el directorio {directory}: {e}")
+    found.sort()
+    return found
+
+class Manifest:
+    """
+    Registro persistente (SQLite) de los archivos de entrada: ruta, tamaño, mtime, opciones de
+    procesado y estado (done/failed). Un archivo se vuelve a procesar si es nuevo, si cambió su
+    tamaño o mtime, si cambiaron las opciones, o si falló menos de max_attempts veces.
+    Cada resultado se guarda al terminar su archivo, así que una ejecución interrumpida se reanuda
+    donde se quedó.
+    """
+
+    def __init__(self, db_path, max_attempts=3):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Los resultados pueden llegar desde los hilos de --pipeline
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            settings TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            updated_at REAL NOT NULL)""")
+
+    def select_pending(self, entries, settings):
+        """
+        Filtra [(ruta, tamaño, mtime_ns)] y devuelve (pendientes, sin_cambios).
+        """
+        with self._lock:
+            known = {row[0]: row[1:] for row in self._conn.execute(
+                "SELECT path, size, mtime_ns, settings, status, attempts FROM files")}
+        pending, unchanged = [], 0
+        for entry in entries:
+            row = known.get(os.path.abspath(entry[0]))
+            if row is not None and row[:3] == (entry[1], entry[2], settings) and \
+                    (row[3] == "done" or row[4] >= self.max_attempts):
+                unchanged += 1
+            else:
+                pending.append(entry)
+        return pending, unchanged
+
+    def record(self, file_path, size, mtime_ns, settings, ok):
+        # Los intentos fallidos se cuentan solo mientras el archivo y las opciones no cambien
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO files (path, size, mtime_ns, settings, status, attempts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    attempts = CASE WHEN files.size = excluded.size AND files.mtime_ns = excluded.mtime_ns
+                                         AND files.settings = excluded.settings AND files.status = 'failed'
+                                    THEN files.attempts + excluded.attempts ELSE excluded.attempts END,
+                    size = excluded.size, mtime_ns = excluded.mtime_ns, settings = excluded.settings,
+                    status = excluded.status, updated_at = excluded.updated_at""",
+                (os.path.abspath(file_path), size, mtime_ns, settings, "done" if ok else "failed", 0 if ok else 1, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# --- Detección de duplicados (--dedup) ---
+# Huella espectral al estilo Haitsma-Kalker: el audio se decodifica a mono y 8 kHz (mucho más barato que
+# decodificar a la frecuencia original) y cada trama de 256 ms, con salto de 32 ms, se resume en 32 bits: el
+# signo de la diferencia de energía entre bandas vecinas (33 bandas logarítmicas entre 300 y 2000 Hz, dentro
+# de la banda de una llamada AMR) respecto a la trama anterior. El signo resiste la recodificación (MP3, M4A,
+# AMR) y los cambios de volumen; la comparación se hace por tasa de bits coincidentes tras alinear las huellas,
+# así que una copia recortada también coincide con su original.
+FINGERPRINT_SR = 8000
+FINGERPRINT_N_FFT = 2048
+FINGERPRINT_HOP = 256
+FINGERPRINT_BANDS = (300.0, 2000.0)
+FINGERPRINT_MIN_SECONDS = 3.0 # Con menos audio activo no se calcula huella: coincidiría con demasiados archivos
+FINGERPRINT_SILENCE_DB = -60.0 # Tramas por debajo de este nivel respecto a la más fuerte no cuentan
+FINGERPRINT_LANDMARK_STRIDE = 4 # Una de cada N tramas se guarda en el índice invertido de candidatos
+DEDUP_MIN_COVERAGE = 0.9 # Fracción del duplicado que debe estar contenida en el original
+DEDUP_DURATION_TOLERANCE = 0.5 # Segundos: copias con duraciones más próximas se ordenan por calidad, no por duración
+DEDUP_LOSSLESS_EXTS = {".wav", ".flac"}
+DEDUP_ALIGN_SECONDS = 10.0 # Audio del duplicado con el que se afina su desplazamiento respecto al original
+
+@functools.lru_cache(maxsize=1)
+def _fingerprint_filterbank():
+    # Matriz (bandas + 1, bins) que suma la potencia del STFT en cada banda
+    edges = torch.logspace(math.log10(FINGERPRINT_BANDS[0]), math.log10(FINGERPRINT_BANDS[1]), 34, dtype=torch.float64)
+    freqs = torch.arange(FINGERPRINT_N_FFT // 2 + 1, dtype=torch.float64) * FINGERPRINT_SR / FINGERPRINT_N_FFT
+    return ((freqs >= edges[:-1, None]) & (freqs < edges[1:, None])).float()
+
+@functools.lru_cache(maxsize=1)
+def _popcount_table():
+    return torch.tensor([bin(i).count("1") for i in range(256)], dtype=torch.int64)
+
+def _popcount(values):
+    """Bits a 1 de un tensor int32."""
+    return int(_popcount_table()[values.contiguous().view(torch.uint8).long()].sum())
+
+def decode_for_fingerprint(file_path):
+    """Decodifica a mono y FINGERPRINT_SR: con ffmpeg/sox el remuestreo lo hace el propio decodificador."""
+    decoder = _external_decoder()
+    if decoder is not None:
+        waveform, _ = _decode_with_pipe(file_path, decoder, mono_sr=FINGERPRINT_SR)
+        return waveform[0]
+    waveform, sr = decode_audio(file_path)
+    return resample(waveform.mean(dim=0), sr, FINGERPRINT_SR)
+
+def compute_fingerprint(mono):
+    """
+    Huella de una señal mono a FINGERPRINT_SR: tensor int32 con un valor de 32 bits por trama.
+    Las tramas silenciosas valen 0 y se ignoran al comparar. Devuelve None si hay muy poco audio activo.
+    """
+    if mono.shape[-1] < FINGERPRINT_N_FFT:
+        return None
+    spec = torch.stft(mono.float(), FINGERPRINT_N_FFT, FINGERPRINT_HOP, window=torch.hann_window(FINGERPRINT_N_FFT),
+                      center=False, return_complex=True).abs().pow(2)
+    energy = (_fingerprint_filterbank() @ spec).t() # (tramas, 33)
+    delta = energy[:, :-1] - energy[:, 1:]
+    bits = (delta[1:] - delta[:-1]) > 0 # (tramas - 1, 32)
+    weights = torch.tensor([1 << i for i in range(32)], dtype=torch.int64)
+    values = (bits.long() * weights).sum(dim=1)
+    values = torch.where(values >= 1 << 31, values - (1 << 32), values).to(torch.int32)
+    loudness = energy[1:].sum(dim=1)
+    active = loudness > loudness.max() * 10 ** (FINGERPRINT_SILENCE_DB / 10)
+    values = torch.where(active, values, torch.zeros_like(values))
+    if int((values != 0).sum()) * FINGERPRINT_HOP / FINGERPRINT_SR < FINGERPRINT_MIN_SECONDS:
+        return None
+    return values
+
+def compare_fingerprints(query, reference, offset):
+    """
+    Compara query con reference desplazada offset tramas (la trama i de query se alinea con la i + offset).
+    Devuelve (similitud, cobertura): la fracción de bits iguales en las tramas activas comunes, y la
+    fracción de las tramas activas de query que caen dentro de reference.
+    """
+    start, end = max(0, -offset), min(len(query), len(reference) - offset)
+    active = int((query != 0).sum())
+    if end <= start or not active:
+        return 0.0, 0.0
+    q, r = query[start:end], reference[start + offset:end + offset]
+    both = (q != 0) & (r != 0)
+    frames = int(both.sum())
+    if not frames:
+        return 0.0, 0.0
+    errors = _popcount(torch.bitwise_xor(q[both], r[both]))
+    return 1.0 - errors / (32 * frames), frames / active
+
+class FingerprintIndex:
+    """
+    Índice persistente (SQLite) de huellas de audio para --dedup.
+
+    - fingerprints: huella de cada archivo, recalculada solo si cambian su tamaño o mtime.
+    - landmarks: índice invertido valor de 32 bits -> (archivo, trama) para encontrar candidatos y su
+      desplazamiento por votación, sin comparar con todo el archivo histórico.
+    - outputs: salidas de los archivos procesados, por opciones de procesado (settings).
+    - duplicates: archivos cuyas salidas se generan desde las de otro en lugar de separarse.
+    """
+
+    def __init__(self, db_path, settings, threshold=0.8, min_coverage=DEDUP_MIN_COVERAGE):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.settings = settings
+        self.threshold = threshold
+        self.min_coverage = min_coverage
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                fingerprint BLOB);
+            CREATE TABLE IF NOT EXISTS landmarks (
+                hash INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                frame INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS landmarks_hash ON landmarks (hash);
+            CREATE TABLE IF NOT EXISTS outputs (
+                path TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                PRIMARY KEY (path, settings));
+            CREATE TABLE IF NOT EXISTS duplicates (
+                path TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                canonical TEXT NOT NULL,
+                similarity REAL NOT NULL,
+                coverage REAL NOT NULL,
+                offset_seconds REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (path, settings));
+            CREATE TEMP TABLE query (hash INTEGER NOT NULL, frame INTEGER NOT NULL);""")
+
+    # --- Huellas ---
+    def _fingerprint(self, file_path):
+        """Devuelve (id, huella o None, segundos), calculándola solo si el archivo cambió."""
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT id, size, mtime_ns, seconds, fingerprint FROM fingerprints WHERE path = ?",
+                                     (path,)).fetchone()
+        if row is not None and row[1:3] == (stat.st_size, stat.st_mtime_ns):
+            fingerprint = torch.frombuffer(bytearray(row[4]), dtype=torch.int32) if row[4] else None
+            return row[0], fingerprint, row[3]
+
+        mono = decode_for_fingerprint(path)
+        seconds = mono.shape[-1] / FINGERPRINT_SR
+        fingerprint = compute_fingerprint(mono)
+        blob = fingerprint.numpy().tobytes() if fingerprint is not None else None
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if row is not None:
+                    # El archivo cambió: sus salidas anteriores ya no le corresponden
+                    self._conn.execute("DELETE FROM landmarks WHERE file_id = ?", (row[0],))
+                    self._conn.execute("DELETE FROM outputs WHERE path = ?", (path,))
+                self._conn.execute("""
+                    INSERT INTO fingerprints (path, size, mtime_ns, seconds, fingerprint) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+                        seconds = excluded.seconds, fingerprint = excluded.fingerprint""",
+                    (path, stat.st_size, stat.st_mtime_ns, seconds, blob))
+                file_id = self._conn.execute("SELECT id FROM fingerprints WHERE path = ?", (path,)).fetchone()[0]
+                if fingerprint is not None:
+                    frames = torch.arange(0, len(fingerprint), FINGERPRINT_LANDMARK_STRIDE)
+                    self._conn.executemany("INSERT INTO landmarks (hash, file_id, frame) VALUES (?, ?, ?)",
+                                           ((int(fingerprint[i]), file_id, int(i)) for i in frames if fingerprint[i] != 0))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return file_id, fingerprint, seconds
+
+    def fingerprint_files(self, files, jobs=None):
+        """
+        Calcula (o recupera) las huellas en paralelo: el decodificador externo y el STFT liberan el GIL.
+        Devuelve {ruta: (id, huella o None, segundos)}; los archivos que no se pudieron decodificar no aparecen.
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=jobs or min(8, os.cpu_count() or 1)) as pool:
+            futures = {pool.submit(self._fingerprint, f): f for f in files}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    logger.warning(f"No se pudo calcular la huella de {futures[future]}: {e}. Se procesará sin --dedup.")
+        return results
+
+    # --- Búsqueda ---
+    def find_match(self, file_id, fingerprint, accept, candidates=5):
+        """
+        Busca un archivo aceptado por accept(ruta) del que fingerprint sea un duplicado. Los desplazamientos
+        se votan con las coincidencias exactas del índice invertido y los mejores se verifican comparando
+        las huellas completas. Devuelve un dict con el original, la similitud, la cobertura y el desplazamiento, o None.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM query")
+            self._conn.executemany("INSERT INTO query (hash, frame) VALUES (?, ?)",
+                                   ((int(v), i) for i, v in enumerate(fingerprint.tolist()) if v != 0))
+            votes = self._conn.execute("""
+                SELECT f.path, f.fingerprint, l.frame - q.frame AS offset, COUNT(*) AS votes
+                FROM query q JOIN landmarks l ON l.hash = q.hash JOIN fingerprints f ON f.id = l.file_id
+                WHERE l.file_id != ?
+                GROUP BY l.file_id, offset ORDER BY votes DESC LIMIT 50""", (file_id,)).fetchall()
+        best = None
+        checked = 0
+        for path, blob, offset, _ in votes:
+            if not accept(path):
+                continue
+            reference = torch.frombuffer(bytearray(blob), dtype=torch.int32)
+            # El recorte de una copia no cae justo en una trama: se prueban también los desplazamientos vecinos
+            for shift in (offset - 1, offset, offset + 1):
+                similarity, coverage = compare_fingerprints(fingerprint, reference, shift)
+                if similarity >= self.threshold and coverage >= self.min_coverage and \
+                        (best is None or similarity > best["similarity"]):
+                    best = {"canonical": path, "similarity": round(similarity, 4), "coverage": round(coverage, 4),
+                            "offset_seconds": round(shift * FINGERPRINT_HOP / FINGERPRINT_SR, 3)}
+            checked += 1
+            if checked >= candidates:
+                break
+        return best
+
+    # --- Salidas ---
+    def canonical_outputs(self, file_path):
+        """Salidas {stem: ruta} de un archivo procesado con las opciones actuales, si siguen existiendo."""
+        with self._lock:
+            row = self._conn.execute("SELECT outputs FROM outputs WHERE path = ? AND settings = ?",
+                                     (os.path.abspath(file_path), self.settings)).fetchone()
+        if row is None:
+            return None
+        outputs = json.loads(row[0])
+        return outputs if outputs and all(os.path.exists(p) for p in outputs.values()) else None
+
+    def record_outputs(self, file_path, outputs):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO outputs (path, settings, outputs) VALUES (?, ?, ?)",
+                               (os.path.abspath(file_path), self.settings,
+                                json.dumps({name: os.path.abspath(p) for name, p in outputs.items()})))
+            # Un archivo procesado por sí mismo deja de ser duplicado de otro
+            self._conn.execute("DELETE FROM duplicates WHERE path = ? AND settings = ?", (os.path.abspath(file_path), self.settings))
+
+    def record_duplicate(self, file_path, match):
+        with self._lock:
+            self._conn.execute("""INSERT OR REPLACE INTO duplicates
+                (path, settings, canonical, similarity, coverage, offset_seconds, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (os.path.abspath(file_path), self.settings, match["canonical"], match["similarity"], match["coverage"],
+                 match["offset_seconds"], time.time()))
+
+    def write_report(self, report_path):
+        """
+        Escribe un JSON con los grupos de duplicados resueltos con las opciones actuales (de todas las
+        ejecuciones) y devuelve la lista de grupos.
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT d.canonical, d.path, d.similarity, d.coverage, d.offset_seconds, f.seconds
+                FROM duplicates d LEFT JOIN fingerprints f ON f.path = d.path
+                WHERE d.settings = ? ORDER BY d.canonical, d.path""", (self.settings,)).fetchall()
+        groups = {}
+        for canonical, path, similarity, coverage, offset_seconds, seconds in rows:
+            groups.setdefault(canonical, []).append({"path": path, "similarity": similarity, "coverage": coverage,
+                                                     "offset_seconds": offset_seconds, "seconds": seconds})
+        report = [{"canonical": canonical, "duplicates": duplicates} for canonical, duplicates in groups.items()]
+        Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{report_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": json.loads(self.settings), "threshold": self.threshold, "groups": report},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, report_path)
+        return report
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _source_quality(file_path, seconds):
+    """Clave para elegir el original entre copias de duración parecida: sin pérdidas, frecuencia de muestreo, tasa de bits."""
+    lossless = Path(file_path).suffix.lower() in DEDUP_LOSSLESS_EXTS
+    try:
+        sr = torchaudio.info(str(file_path)).sample_rate
+    except Exception:
+        sr = 0
+    try:
+        bitrate = os.path.getsize(file_path) * 8 / seconds if seconds else 0.0
+    except OSError:
+        bitrate = 0.0
+    return (lossless, sr, bitrate)
+
+def dedup_order(files, fingerprints):
+    """
+    Orden en que se buscan los originales: de más largo a más corto, para que contengan a los recortes.
+    Las duraciones a menos de DEDUP_DURATION_TOLERANCE entre sí se consideran la misma grabación (las
+    recodificaciones con pérdidas añaden muestras de arranque del codificador) y se ordenan por calidad.
+    """
+    def seconds(f):
+        return fingerprints[f][2] if f in fingerprints else 0.0
+
+    ordered, group = [], []
+    for file_path in sorted(files, key=lambda f: -seconds(f)):
+        if group and seconds(group[0]) - seconds(file_path) > DEDUP_DURATION_TOLERANCE:
+            ordered += sorted(group, key=lambda f: _source_quality(f, seconds(f)), reverse=True)
+            group = []
+        group.append(file_path)
+    return ordered + sorted(group, key=lambda f: _source_quality(f, seconds(f)), reverse=True)
+
+def align_duplicate(reference, reference_sr, query, query_sr, target_sr, offset_seconds):
+    """
+    Desplazamiento en muestras (a target_sr) tal que query[t] ≈ reference[t + desplazamiento]. Parte del
+    desplazamiento de la huella, cuya resolución es un salto de FINGERPRINT_HOP a 8 kHz, y lo afina por
+    correlación cruzada sobre DEDUP_ALIGN_SECONDS del centro del duplicado.
+    """
+    reference = resample(reference.mean(0), reference_sr, target_sr)
+    query = resample(query.mean(0), query_sr, target_sr)
+    coarse = round(offset_seconds * target_sr)
+    search = math.ceil(2 * FINGERPRINT_HOP * target_sr / FINGERPRINT_SR)
+    length = min(query.shape[-1], int(DEDUP_ALIGN_SECONDS * target_sr))
+    start = (query.shape[-1] - length) // 2
+    segment = query[start:start + length]
+    if length == 0 or segment.abs().max() == 0:
+        return coarse
+    pad = search + abs(coarse) + query.shape[-1]
+    window_start = pad + start + coarse - search
+    window = torch.nn.functional.pad(reference, (pad, pad))[window_start:window_start + length + 2 * search]
+    n_fft = 1 << (window.shape[-1] + length - 1).bit_length()
+    corr = torch.fft.irfft(torch.fft.rfft(window, n_fft) * torch.fft.rfft(segment, n_fft).conj(), n_fft)
+    return coarse - search + int(corr[:2 * search + 1].argmax())
+
+def write_duplicate_outputs(outputs, file_path, match, base_output_dir, save_stems, output_sr, model_sr, reference):
+    """
+    Escribe las salidas de un duplicado a partir de las del original: se remuestrean a la frecuencia que
+    tendría el duplicado procesado por sí mismo, se alinean con su desplazamiento y se ajustan a su longitud.
+    reference es (waveform, sr) del original decodificado, para afinar la alineación.
+    """
+    waveform, sr = decode_audio(file_path)
+    if output_sr == "source":
+        target_sr, target_frames = sr, waveform.shape[-1]
+    else:
+        target_sr, target_frames = model_sr, math.ceil(waveform.shape[-1] * model_sr / sr)
+    lag = align_duplicate(reference[0], reference[1], waveform, sr, target_sr, match["offset_seconds"])
+    for stem_name, source_path in outputs.items():
+        output_path = stem_output_path(file_path, stem_name, base_output_dir, save_stems)
+        if output_path is None:
+            continue
+        stem, stem_sr = torchaudio.load(str(source_path))
+        stem = resample(stem, stem_sr, target_sr)
+        stem = stem[..., lag:] if lag >= 0 else torch.nn.functional.pad(stem, (-lag, 0))
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if output_path.exists():
+            output_path.unlink() # Puede ser un enlace duro a las salidas del original de una versión anterior
+        torchaudio.save(str(output_path), fit_length(stem, target_frames), target_sr, encoding="PCM_S", bits_per_sample=16)
+        logger.info(f"[🔗] Salida del duplicado generada desde el original: {output_path} <- {source_path}")
+
+def process_batch_dedup(model, files, process_kwargs, index, on_result=None, **batch_options):
+    """
+    process_batch con detección de duplicados: calcula las huellas, separa solo un archivo de cada grupo
+    de duplicados (el más largo o, entre copias de la misma duración, el de más calidad; ver dedup_order)
+    y genera las salidas de los demás a partir de las suyas (write_duplicate_outputs).
+    Los duplicados de un archivo ya procesado en otra ejecución no se separan. Si el original falla,
+    sus duplicados se procesan normalmente.
+    """
+    kw = process_kwargs
+    fingerprints = index.fingerprint_files(files)
+    planned = set()
+
+    def accept(path):
+        return path in planned or index.canonical_outputs(path) is not None
+
+    canonicals, duplicates = [], {}
+    for file_path in dedup_order(files, fingerprints):
+        file_id, fingerprint, _ = fingerprints.get(file_path, (None, None, None))
+        match = index.find_match(file_id, fingerprint, accept) if fingerprint is not None else None
+        if match is None:
+            canonicals.append(file_path)
+            planned.add(os.path.abspath(file_path))
+        else:
+            duplicates[file_path] = match
+    order = {file_path: i for i, file_path in enumerate(files)}
+    canonicals.sort(key=order.get) # Se conserva el orden de entrada para el procesamiento
+    if duplicates:
+        logger.info(f"[🧬] {len(duplicates)} de {len(files)} archivos son duplicados de otro y no se separarán.")
+
+    def record(file_path, ok):
+        if ok:
+            plan = plan_outputs(getattr(model, "sources", DEFAULT_SOURCES), Path(file_path), kw["base_output_dir"], kw["save_stems"], kw["two_stems"])
+            outputs = {name: path for name, _, path in plan if path.exists()}
+            if outputs:
+                index.record_outputs(file_path, outputs)
+        if on_result is not None:
+            on_result(file_path, ok)
+
+    processed_ok = process_batch(model, canonicals, kw, on_result=record, **batch_options) if canonicals else 0
+    fallback, reference = [], (None, None)
+    model_sr = int(getattr(model, "samplerate", 44100))
+    # Agrupados por original: se decodifica una sola vez para alinear todos sus duplicados
+    for file_path, match in sorted(duplicates.items(), key=lambda item: item[1]["canonical"]):
+        outputs = index.canonical_outputs(match["canonical"])
+        if outputs is None:
+            logger.warning(f"El original de {file_path} ({match['canonical']}) no tiene salidas; se procesa normalmente.")
+            fallback.append(file_path)
+            continue
+        try:
+            if reference[0] != match["canonical"]:
+                reference = (match["canonical"], decode_audio(match["canonical"]))
+            write_duplicate_outputs(outputs, Path(file_path), match, kw["base_output_dir"], kw["save_stems"],
+                                    kw["output_sr"], model_sr, reference[1])
+        except Exception as e:
+            logger.warning(f"No se pudieron generar las salidas de {file_path} desde su original: {e}. Se procesa normalmente.")
+            fallback.append(file_path)
+            continue
+        index.record_duplicate(file_path, match)
+        logger.info(f"[🧬] {file_path} es un duplicado de {match['canonical']} (similitud {match['similarity']:.2f}, "
+                     f"desplazamiento {match['offset_seconds']:.2f}s).")
+        processed_ok += 1
+        if on_result is not None:
+            on_result(file_path, True)
+    if fallback:
+        processed_ok += process_batch(model, fallback, kw, on_result=record, **batch_options)
+    return processed_ok
+
+# --- Reparto entre nodos (--shard, --claim) ---
+# Varias máquinas que montan la misma carpeta compartida (NFS) pueden repartirse un archivo histórico:
+# --shard i/n asigna a cada nodo una parte fija de la lista, y --claim reparte los archivos sobre la marcha
+# mediante archivos de bloqueo creados con O_EXCL (atómico también en NFSv3+), de modo que los nodos más
+# rápidos procesan más. Los bloqueos se renuevan mientras el nodo trabaja; si un nodo cae, su bloqueo
+# caduca tras --claim-ttl segundos y otro nodo recupera el archivo.
+def parse_shard(text):
+    """Convierte 'i/n' (1 <= i <= n) en (i, n). Lanza ValueError si no es válido."""
+    index, _, count = text.partition("/")
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f"el índice debe estar entre 1 y {count}")
+    return index, count
+
+def _relative_key(file_path, root):
+    # La ruta relativa a --path: los nodos pueden montar la carpeta compartida en rutas distintas
+    try:
+        return Path(file_path).resolve().relative_to(Path(root).resolve()).as_posix()
+    except ValueError:
+        return Path(file_path).name
+
+def select_shard(files, root, index, count):
+    """
+    Devuelve los archivos del fragmento index de count. El reparto depende solo de la ruta relativa de
+    cada archivo (no de su posición en la lista), así que los archivos nuevos no mueven a los demás de nodo.
+    """
+    return [f for f in files
+            if int(hashlib.sha1(_relative_key(f, root).encode()).hexdigest(), 16) % count == index - 1]
+
+class ClaimBoard:
+    """
+    Tablero de reclamaciones en una carpeta compartida (--claim). Por cada archivo (ruta relativa, tamaño,
+    mtime y opciones) puede haber:
+
+    - <clave>.lock: reclamado por un nodo; su mtime se renueva cada ttl/4 segundos mientras se procesa.
+    - <clave>.done: procesado con éxito; ningún nodo lo vuelve a reclamar.
+    - <clave>.failed: número de intentos fallidos; a partir de max_attempts no se reintenta.
+    """
+
+    def __init__(self, claim_dir, settings, ttl=600.0, max_attempts=3):
+        self.claim_dir = Path(claim_dir)
+        self.claim_dir.mkdir(parents=True, exist_ok=True)
+        self.settings = settings
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.owner = f"{platform.node()}:{os.getpid()}"
+        self.stats = {"claimed": 0, "recovered": 0}
+        self._held = {} # clave -> token del bloqueo propio
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew, name="claim-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def key(self, file_path, root, size, mtime_ns):
+        return hashlib.sha256(f"{_relative_key(file_path, root)}:{size}:{mtime_ns}:{self.settings}".encode()).hexdigest()[:32]
+
+    def _path(self, key, suffix):
+        return self.claim_dir / f"{key}{suffix}"
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, data):
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def finished(self, key):
+        if self._path(key, ".done").exists():
+            return True
+        failed = self._read_json(self._path(key, ".failed"))
+        return failed is not None and failed.get("attempts", 0) >= self.max_attempts
+
+    # --- Reclamaciones ---
+    def try_claim(self, key, file_path):
+        """Intenta reclamar un archivo. Devuelve 'claimed', 'busy' (lo tiene otro nodo) o 'done'."""
+        if self.finished(key):
+            return "done"
+        lock_path = self._path(key, ".lock")
+        token = uuid.uuid4().hex
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_stale(lock_path):
+                    return "busy"
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"owner": self.owner, "token": token, "path": str(file_path), "claimed_at": time.time()}, f)
+            if self.finished(key):
+                # Otro nodo lo terminó entre la comprobación y la reclamación
+                os.unlink(lock_path)
+                return "done"
+            with self._lock:
+                self._held[key] = token
+            self.stats["claimed"] += 1
+            return "claimed"
+        return "busy"
+
+    def _break_stale(self, lock_path):
+        """
+        Elimina el bloqueo si caducó (su nodo dejó de renovarlo). Devuelve True si se puede volver a intentar
+        la reclamación. El bloqueo se aparta con un rename atómico y se comprueba que es el mismo que se vio
+        caducado: si otro nodo lo había recuperado entretanto, se devuelve a su sitio.
+        """
+        try:
+            age = time.time() - lock_path.stat().st_mtime
+        except FileNotFoundError:
+            return True # Liberado mientras tanto
+        if age <= self.ttl:
+            return False
+        stale = self._read_json(lock_path) or {}
+        aside = lock_path.with_name(f"{lock_path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(lock_path, aside)
+        except FileNotFoundError:
+            return True
+        if (self._read_json(aside) or {}).get("token") != stale.get("token"):
+            with contextlib.suppress(FileExistsError):
+                os.link(aside, lock_path)
+            os.unlink(aside)
+            return False
+        os.unlink(aside)
+        self.stats["recovered"] += 1
+        logger.warning(f"[🗂️] Reclamación caducada de {stale.get('owner', '?')} sobre {stale.get('path', lock_path.name)} "
+                        f"(sin renovar desde hace {age:.0f}s): se recupera.")
+        return True
+
+    def release(self, key, file_path, ok):
+        """Marca el archivo como terminado (o suma un intento fallido) y libera el bloqueo propio."""
+        if ok:
+            self._write_json(self._path(key, ".done"), {"path": str(file_path), "owner": self.owner, "finished_at": time.time()})
+        else:
+            failed = self._read_json(self._path(key, ".failed")) or {}
+            self._write_json(self._path(key, ".failed"), {"path": str(file_path), "owner": self.owner,
+                                                          "attempts": failed.get("attempts", 0) + 1})
+        self._unlock(key)
+
+    def _unlock(self, key):
+        with self._lock:
+            token = self._held.pop(key, None)
+        lock_path = self._path(key, ".lock")
+        # Solo se borra el bloqueo si sigue siendo el propio (otro nodo pudo recuperarlo por caducado)
+        if token is not None and (self._read_json(lock_path) or {}).get("token") == token:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(lock_path)
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 4):
+            with self._lock:
+                held = list(self._held)
+            for key in held:
+                with contextlib.suppress(OSError):
+                    os.utime(self._path(key, ".lock"))
+
+    def close(self):
+        """Detiene la renovación y libera sin marcar los bloqueos pendientes (p. ej. tras Ctrl+C)."""
+        self._stop.set()
+        for key in list(self._held):
+            self._unlock(key)
+
+def process_claimed(files, keys, board, run_batch, chunk_size=1, poll_interval=10.0):
+    """
+    Procesa los archivos que este nodo consigue reclamar, de chunk_size en chunk_size, con run_batch(lote, on_result).
+    Los archivos reclamados por otros nodos se revisan en pasadas posteriores hasta que estén terminados
+    o su reclamación caduque. Devuelve (procesados con éxito, procesados por este nodo).
+    """
+    processed_ok = attempted = 0
+
+    def on_result(file_path, ok):
+        board.release(keys[file_path], file_path, ok)
+
+    remaining = list(files)
+    while remaining:
+        busy, chunk = [], []
+        for file_path in remaining:
+            state = board.try_claim(keys[file_path], file_path)
+            if state == "claimed":
+                chunk.append(file_path)
+            elif state == "busy":
+                busy.append(file_path)
+            if len(chunk) >= chunk_size:
+                processed_ok += run_batch(chunk, on_result)
+                attempted += len(chunk)
+                chunk = []
+        if chunk:
+            processed_ok += run_batch(chunk, on_result)
+            attempted += len(chunk)
+        remaining = busy
+        if remaining:
+            logger.info(f"[🗂️] {len(remaining)} archivo(s) en proceso en otros nodos; se revisan de nuevo en {poll_interval:.0f}s.")
+            time.sleep(poll_interval)
+    return processed_ok, attempted
+
+# --- Modo servidor (--serve) ---
+# Mantiene el modelo cargado y recibe trabajos por HTTP en localhost o por un socket Unix.
+# Cada trabajo es un archivo de entrada más sus opciones, y se procesa con process_file y la
+# misma estructura de salida que la línea de comandos.
+#
+#   POST   /jobs       {"path": ..., "denoise": bool, "normalize": bool, "save_stems": bool,
+#                       "two_stems": "vocals" | null, "priority": int}  -> 202 con el trabajo
+#   GET    /jobs       Lista de trabajos recientes
+#   GET    /jobs/<id>  Estado y tiempos de un trabajo
+#   DELETE /jobs/<id>  Cancela un trabajo que aún está en cola
+#   GET    /health     Estado del servidor
+
+class JobQueueFull(Exception):
+    pass
+
+class JobServer:
+    """
+    Cola de trabajos con prioridad (menor valor = antes) y un número fijo de hilos que la atienden.
+    Todos los hilos comparten el mismo modelo. El historial de trabajos terminados está acotado.
+    """
+
+    def __init__(self, model, process_kwargs, concurrency=1, queue_size=64, max_history=1000):
+        self.model = model
+        self.process_kwargs = process_kwargs
+        self.sources = list(getattr(model, "sources", DEFAULT_SOURCES))
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self.counts = {"ok": 0, "failed": 0}
+        self._queue = queue.PriorityQueue(maxsize=queue_size)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._started = time.time()
+
+    def start(self):
+        if self.concurrency > 1:
+            # Repartir los hilos intra-op entre los trabajos simultáneos, igual que con --workers
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.concurrency))
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"vcp-job-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Deja de aceptar trabajos, cancela los que están en cola y espera a los que están en curso."""
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put((float("-inf"), next(self._sequence), None))
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, request):
+        """
+        Valida y encola un trabajo. Lanza ValueError si la petición no es válida y JobQueueFull si la cola está llena.
+        """
+        if self._stopping.is_set():
+            raise JobQueueFull("El servidor se está deteniendo.")
+        file_path = Path(str(request.get("path") or ""))
+        if not file_path.is_file():
+            raise ValueError(f"La ruta no existe o no es un archivo: {file_path}")
+        if file_path.suffix.lower() not in AUDIO_EXTS:
+            raise ValueError(f"Formato no compatible: {file_path.suffix}. Extensiones soportadas: {', '.join(AUDIO_EXTS)}")
+        two_stems = request.get("two_stems")
+        if two_stems not in (None, "vocals"):
+            raise ValueError("two_stems solo admite 'vocals'.")
+        try:
+            priority = int(request.get("priority", 10))
+        except (TypeError, ValueError):
+            raise ValueError("priority debe ser un número entero.")
+
+        options = {
+            "apply_denoise": bool(request.get("denoise", self.process_kwargs["apply_denoise"])),
+            "apply_normalize": bool(request.get("normalize", self.process_kwargs["apply_normalize"])),
+            "save_stems": bool(request.get("save_stems", self.process_kwargs["save_stems"])) and not two_stems,
+            "two_stems": two_stems,
+        }
+        job = {"id": uuid.uuid4().hex[:12], "path": str(file_path), "priority": priority, "status": "queued",
+               "options": {"denoise": options["apply_denoise"], "normalize": options["apply_normalize"],
+                           "save_stems": options["save_stems"], "two_stems": two_stems},
+               "submitted_at": time.time(), "started_at": None, "finished_at": None,
+               "queue_seconds": None, "run_seconds": None, "outputs": None}
+        with self._lock:
+            try:
+                self._queue.put_nowait((priority, next(self._sequence), job["id"]))
+            except queue.Full:
+                raise JobQueueFull(f"La cola está llena ({self.queue_size} trabajos).")
+            job["_kwargs"] = options
+            self.jobs[job["id"]] = job
+            self._trim_history()
+        logger.info(f"[📥] Trabajo {job['id']} en cola (prioridad {priority}): {file_path}")
+        return self.describe(job["id"])
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                return False
+            job["status"] = "cancelled" # Se descarta cuando un hilo lo saque de la cola
+            job["finished_at"] = time.time()
+            return True
+
+    def describe(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def list_jobs(self):
+        with self._lock:
+            return [{k: v for k, v in job.items() if not k.startswith("_")} for job in self.jobs.values()]
+
+    def health(self):
+        with self._lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {"status": "stopping" if self._stopping.is_set() else "ok", "uptime_seconds": round(time.time() - self._started, 1),
+                "queued": statuses.count("queued"), "running": statuses.count("running"),
+                "concurrency": self.concurrency, "queue_size": self.queue_size, **self.counts}
+
+    def _trim_history(self):
+        # Solo se olvidan trabajos ya terminados, empezando por los más antiguos
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] not in ("queued", "running")]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self.jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                if self._stopping.is_set():
+                    job["status"] = "cancelled"
+                    job["finished_at"] = time.time()
+                    continue
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                job["queue_seconds"] = round(job["started_at"] - job["submitted_at"], 3)
+            logger.info(f"[▶️] Trabajo {job_id} iniciado: {job['path']}")
+
+            ok = process_file(self.model, Path(job["path"]), **{**self.process_kwargs, **job["_kwargs"]})
+
+            with self._lock:
+                job["finished_at"] = time.time()
+                job["run_seconds"] = round(job["finished_at"] - job["started_at"], 3)
+                job["status"] = "done" if ok else "failed"
+                self.counts["ok" if ok else "failed"] += 1
+                if ok:
+                    job["outputs"] = {name: str(path.resolve()) for name, _, path in plan_outputs(
+                        self.sources, Path(job["path"]), self.process_kwargs["base_output_dir"],
+                        job["_kwargs"]["save_stems"], job["_kwargs"]["two_stems"])}
+            metrics = self.process_kwargs.get("metrics")
+            if metrics is not None:
+                metrics.write_prometheus() # El textfile collector ve cada trabajo terminado
+            logger.info(f"[{'✅' if ok else '❌'}] Trabajo {job_id} {job['status']} en {job['run_seconds']:.2f}s "
+                         f"(en cola {job['queue_seconds']:.2f}s).")
+
+def serve(job_server, host="127.0.0.1", port=8765, socket_path=None):
+    """
+    Atiende peticiones HTTP hasta recibir Ctrl+C o SIGTERM. Con socket_path escucha en un socket Unix
+    en lugar de TCP. Al salir detiene job_server esperando a los trabajos en curso.
+    """
+    import http.server
+    import socketserver
+
+    class JobRequestHandler(http.server.BaseHTTPRequestHandler):
+        server_version = "VocalClarityPro"
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _job_id(self):
+            parts = self.path.rstrip("/").split("/")
+            return parts[2] if len(parts) == 3 and parts[1] == "jobs" else None
+
+        def do_GET(self):
+            if self.path == "/health":
+                return self._send_json(200, job_server.health())
+            if self.path.rstrip("/") == "/jobs":
+                return self._send_json(200, {"jobs": job_server.list_jobs()})
+            job = job_server.describe(self._job_id()) if self._job_id() else None
+            if job is None:
+                return self._send_json(404, {"error": "Trabajo no encontrado."})
+            self._send_json(200, job)
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                return self._send_json(404, {"error": "Ruta no encontrada."})
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("Se esperaba un objeto JSON.")
+                self._send_json(202, job_server.submit(request))
+            except JobQueueFull as e:
+                self._send_json(503, {"error": str(e)})
+            except ValueError as e: # Incluye JSON mal formado
+                self._send_json(400, {"error": str(e)})
+
+        def do_DELETE(self):
+            job_id = self._job_id()
+            if job_id and job_server.cancel(job_id):
+                return self._send_json(200, job_server.describe(job_id))
+            self._send_json(409 if job_server.describe(job_id or "") else 404,
+                            {"error": "Solo se pueden cancelar trabajos en cola."})
+
+        def log_message(self, format, *args):
+            # En un socket Unix no hay dirección de cliente; las peticiones van al log en nivel DEBUG
+            logger.debug(f"HTTP {format % args}")
+
+    if socket_path:
+        class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path) # Socket huérfano de una ejecución anterior
+        httpd = UnixHTTPServer(socket_path, JobRequestHandler)
+        os.chmod(socket_path, 0o660)
+        address = f"unix:{socket_path}"
+    else:
+        httpd = http.server.ThreadingHTTPServer((host, port), JobRequestHandler)
+        httpd.daemon_threads = True
+        address = f"http://{host}:{httpd.server_address[1]}"
+
+    def request_stop(signum, frame):
+        # shutdown() espera al bucle de serve_forever, así que se llama desde otro hilo
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    job_server.start()
+    logger.info(f"[🛰️] Servidor listo en {address} ({job_server.concurrency} trabajo(s) simultáneo(s), "
+                 f"cola de {job_server.queue_size}). Ctrl+C para detenerlo.")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Deteniendo el servidor: se terminan los trabajos en curso y se cancelan los pendientes...")
+        httpd.server_close()
+        job_server.stop()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+# --- Carga del modelo ---
+def load_separation_model(name="htdemucs", snapshot_path=None):
+    """
+    Carga el modelo de Demucs. get_model lo reconstruye desde el checkpoint en cada ejecución; con
+    snapshot_path se guarda el objeto ya construido (torch.save) y las siguientes ejecuciones lo
+    cargan directamente. La instantánea se rehace si cambia el modelo o la versión de torch/demucs.
+    """
+    import demucs
+    tag = {"name": name, "demucs": demucs.__version__, "torch": torch.__version__}
+    if snapshot_path and Path(snapshot_path).exists():
+        try:
+            snapshot = torch.load(snapshot_path, map_location="cpu", weights_only=False)
+            if snapshot.get("tag") == tag:
+                logger.info(f"Modelo cargado desde la instantánea: {snapshot_path}")
+                return snapshot["model"]
+            logger.info(f"La instantánea {snapshot_path} es de otro modelo o versión; se vuelve a crear.")
+        except Exception as e:
+            logger.warning(f"No se pudo leer la instantánea del modelo {snapshot_path}: {e}. Se vuelve a crear.")
+
+    from demucs.pretrained import get_model
+    model = get_model(name=name)
+    if snapshot_path:
+        try:
+            Path(snapshot_path).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{snapshot_path}.tmp"
+            torch.save({"tag": tag, "model": model}, tmp_path)
+            os.replace(tmp_path, snapshot_path) # Atómico: otra ejecución nunca lee una instantánea a medias
+            logger.info(f"Instantánea del modelo guardada en: {snapshot_path}")
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la instantánea del modelo en {snapshot_path}: {e}")
+    return model
+
+# --- Aceleración de la inferencia en CPU (--accel) ---
+ACCEL_MODES = ["none", "inference", "int8", "bf16", "compile"]
+
+def _bf16_supported():
+    # oneDNN solo acelera bf16 en CPUs con AVX512-BF16 o AMX; en el resto autocast iría más lento
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+def accel_context(model):
+    """
+    Contexto con el que se ejecuta el modelo según su modo --accel (guardado en model.accel_mode).
+    """
+    mode = getattr(model, "accel_mode", "none")
+    if mode == "none":
+        return contextlib.nullcontext()
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if mode == "bf16":
+        stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+    return stack
+
+def run_model(model, mix, device):
+    """
+    apply_model con el contexto de aceleración del modelo y sus parámetros de --profile/--auto-tune
+    (guardados en model.separation_options). Devuelve (batch, stems, canales, muestras) en float32.
+    """
+    from demucs.apply import apply_model
+    with accel_context(model):
+        stems = apply_model(model, mix, device=device, **getattr(model, "separation_options", {}))
+    # Con --accel inference el resultado es un tensor de inference_mode: quien lo use no debe modificarlo in-place
+    return stems.float()
+
+def prepare_model(model, accel="inference", device="cpu"):
+    """
+    Devuelve el modelo listo para el modo --accel indicado (puede ser una copia):
+
+    - none: como lo devuelve get_model (fp32; apply_model ya desactiva el gradiente en el forward).
+    - inference: torch.inference_mode alrededor de toda la separación. Mismo resultado que none.
+    - int8: cuantización dinámica int8 de las capas Linear y LSTM (incluidas las del transformer).
+    - bf16: autocast a bfloat16, solo si la CPU lo soporta (AVX512-BF16/AMX).
+    - compile: torch.compile de cada submodelo. La primera llamada compila y puede tardar minutos.
+
+    int8, bf16 y compile también usan inference_mode. Si un modo no está disponible, o su salida en
+    un clip de prueba no es finita, se usa 'inference' y se avisa.
+    """
+    if accel == "bf16" and not _bf16_supported():
+        logger.warning("Esta CPU no soporta bf16 de forma nativa; se usa --accel inference.")
+        accel = "inference"
+    if accel == "compile" and not hasattr(torch, "compile"):
+        logger.warning("torch.compile no está disponible en esta versión de torch; se usa --accel inference.")
+        accel = "inference"
+
+    original = model
+    if accel == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+    elif accel == "compile":
+        model = copy.deepcopy(model)
+        if hasattr(model, "models"): # BagOfModels: apply_model llama a cada submodelo por separado
+            model.models = torch.nn.ModuleList([torch.compile(sub_model) for sub_model in model.models])
+        else:
+            model = torch.compile(model)
+    model.accel_mode = accel
+
+    if accel in ("bf16", "compile"):
+        # Clip de prueba de un segundo: en compile, además, dispara la compilación antes del primer archivo
+        logger.info(f"Comprobando el modo --accel {accel} con un clip de prueba...")
+        probe = torch.randn(1, 2, int(model.samplerate), generator=torch.Generator().manual_seed(0)) * 0.1
+        try:
+            finite = bool(torch.isfinite(run_model(model, probe.to(device), device)).all())
+        except Exception as e:
+            logger.warning(f"El modo --accel {accel} falló en el clip de prueba: {e}")
+            finite = False
+        if not finite:
+            logger.warning(f"El modo --accel {accel} no produce una salida válida en este equipo; se usa --accel inference.")
+            original.accel_mode = "inference"
+            return original
+    return model
+
+def _sdr(reference, estimate):
+    # Signal-to-distortion ratio en dB, promedio por stem, tomando reference como verdad
+    reference, estimate = reference.double(), estimate.double()
+    signal = reference.pow(2).sum(dim=(-2, -1))
+    distortion = (reference - estimate).pow(2).sum(dim=(-2, -1))
+    ratios = 10 * torch.log10(signal.clamp(min=1e-12) / distortion) # inf si son idénticos
+    return float(ratios.mean())
+
+def compare_accel_modes(model, mix, device, modes=ACCEL_MODES):
+    """
+    Separa el clip mix (1, 2, muestras) con cada modo y lo compara con 'none' (fp32): tiempo,
+    aceleración, SDR medio por stem y diferencia máxima de la forma de onda. Devuelve una lista de dicts.
+    """
+    results = []
+    reference = baseline_seconds = None
+    for mode in ["none"] + [m for m in modes if m != "none"]:
+        prepared = prepare_model(model, mode, device)
+        # apply_model desplaza la entrada al azar (shifts=1): la misma semilla da el mismo desplazamiento en cada modo
+        random.seed(0)
+        run_model(prepared, mix[..., :int(prepared.samplerate)], device) # Calentamiento
+        random.seed(0)
+        started = time.perf_counter()
+        stems = run_model(prepared, mix, device)
+        seconds = time.perf_counter() - started
+        if reference is None:
+            reference, baseline_seconds = stems, seconds
+        results.append({
+            "mode": mode,
+            "effective_mode": prepared.accel_mode,
+            "seconds": round(seconds, 3),
+            "speedup": round(baseline_seconds / seconds, 2),
+            "sdr_db": round(_sdr(reference, stems), 1) if mode != "none" else None,
+            "max_abs_diff": float((reference - stems).abs().max()),
+        })
+        model.accel_mode = "none" # prepare_model marca el modelo original en los modos que no lo copian
+    return results
+
+def log_accel_report(results, clip_seconds):
+    logger.info(f"[⚡] Comparativa de --accel sobre {clip_seconds:.1f}s de audio (referencia: none, fp32):")
+    logger.info(f"{'modo':<18} {'segundos':>9} {'acelera':>8} {'SDR dB':>8} {'dif. máx.':>10}")
+    for r in results:
+        mode = r["mode"] if r["effective_mode"] == r["mode"] else f"{r['mode']}→{r['effective_mode']}"
+        sdr = "ref" if r["sdr_db"] is None else f"{r['sdr_db']:.1f}"
+        logger.info(f"{mode:<18} {r['seconds']:>9.2f} {r['speedup']:>7.2f}x {sdr:>8} {r['max_abs_diff']:>10.2e}")
+
+# --- Perfiles de separación y autoajuste (--profile, --auto-tune) ---
+# Parámetros de apply_model. balanced son los valores por defecto de Demucs; segment None usa el del modelo.
+SEPARATION_PROFILES = {
+    "fast": {"shifts": 0, "overlap": 0.1, "split": True, "segment": None},
+    "balanced": {"shifts": 1, "overlap": 0.25, "split": True, "segment": None},
+    "max": {"shifts": 4, "overlap": 0.5, "split": True, "segment": None},
+}
+# Escalera del autoajuste, de menor a mayor coste (y calidad)
+AUTOTUNE_LADDER = [
+    SEPARATION_PROFILES["fast"],
+    SEPARATION_PROFILES["balanced"],
+    {"shifts": 2, "overlap": 0.25, "split": True, "segment": None},
+    {"shifts": 2, "overlap": 0.5, "split": True, "segment": None},
+    SEPARATION_PROFILES["max"],
+]
+AUTOTUNE_MIN_MEMORY_SAVING = 0.05 # Un segmento más corto se descarta si no baja el pico al menos esta fracción
+
+def separation_signature(model, name="htdemucs"):
+    """
+    Identifica el modelo y los ajustes que cambian el resultado de la separación (para la caché y el manifiesto).
+    Con --accel none/inference y el perfil balanced es solo el nombre del modelo, como antes de existir estas opciones.
+    """
+    signature = name
+    accel = getattr(model, "accel_mode", "none")
+    if accel not in ("none", "inference"): # inference da exactamente el mismo resultado que fp32
+        signature += f":accel={accel}"
+    options = getattr(model, "separation_options", SEPARATION_PROFILES["balanced"])
+    if options != SEPARATION_PROFILES["balanced"]:
+        signature += ":" + ":".join(f"{key}={value}" for key, value in sorted(options.items()))
+    silence = getattr(model, "silence_options", None)
+    if silence:
+        signature += ":silence=" + ",".join(f"{key}={value}" for key, value in sorted(silence.items()))
+    return signature
+
+def _current_rss_bytes():
+    # Memoria residente actual (no el pico); solo en sistemas con /proc
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@contextlib.contextmanager
+def _sample_peak_rss(interval=0.01):
+    """
+    Pico de memoria residente mientras dura el bloque, muestreado en un hilo. Sin /proc se usa el
+    pico de todo el proceso (ru_maxrss), que nunca baja y por tanto sobreestima.
+    """
+    result = {"peak": _current_rss_bytes()}
+    if result["peak"] is None:
+        yield result
+        result["peak"] = _peak_rss_bytes()
+        return
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            result["peak"] = max(result["peak"], _current_rss_bytes() or 0)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield result
+    finally:
+        done.set()
+        sampler.join()
+        result["peak"] = max(result["peak"], _current_rss_bytes() or 0)
+
+def _pads_to_training_segment(model):
+    # HTDemucs (use_train_segment) rellena en inferencia cada trozo hasta la duración con la que se entrenó
+    models = getattr(model, "models", None) or [model]
+    return all(getattr(m, "use_train_segment", False) for m in models)
+
+def _autotune_key(model, target_rtf, memory_budget_gb):
+    # Lo que hace que una calibración deje de valer: otro equipo, otros hilos, otra versión de torch o del modelo
+    return "|".join([platform.node(), platform.machine(), f"cpus={os.cpu_count()}", f"threads={torch.get_num_threads()}",
+                     f"torch={torch.__version__}", separation_signature(model).split(":")[0],
+                     f"accel={getattr(model, 'accel_mode', 'none')}", f"rtf={target_rtf}", f"memory_gb={memory_budget_gb}"])
+
+def auto_tune(model, device, target_rtf=1.0, memory_budget_gb=None, clip_seconds=20.0):
+    """
+    Mide en este equipo un clip sintético de clip_seconds y elige los parámetros de apply_model de mayor
+    calidad cuyo RTF (segundos de proceso por segundo de audio) no pase de target_rtf y cuyo pico de
+    memoria no pase de memory_budget_gb. Devuelve un dict con las opciones elegidas y lo medido.
+    """
+    samplerate = int(model.samplerate)
+    # El coste de Demucs no depende del contenido: basta con ruido reproducible
+    clip = torch.randn(1, 2, int(clip_seconds * samplerate), generator=torch.Generator().manual_seed(0)) * 0.1
+    budget_bytes = memory_budget_gb * 1024**3 if memory_budget_gb else None
+    max_segment = float(getattr(model, "max_allowed_segment", float("inf")))
+    if not math.isfinite(max_segment): # Bolsa sin HTDemucs: no hay límite, se parte del segmento del modelo
+        max_segment = float(getattr(model, "segment", None) or 0)
+
+    def measure(options):
+        model.separation_options = options
+        with _sample_peak_rss() as rss:
+            started = time.perf_counter()
+            run_model(model, clip, device)
+            seconds = time.perf_counter() - started
+        return seconds / clip_seconds, rss["peak"]
+
+    model.separation_options = SEPARATION_PROFILES["fast"]
+    run_model(model, clip[..., :samplerate], device) # Calentamiento
+
+    # 1. Memoria: el segmento más largo que cabe en el presupuesto. Los desplazamientos y el solapamiento
+    #    se procesan uno tras otro, así que apenas cambian el pico; el tamaño del segmento puede hacerlo.
+    segment = None
+    if budget_bytes is not None and _current_rss_bytes() is None:
+        # Sin /proc solo queda ru_maxrss, que nunca baja: todas las pruebas medirían el pico de la primera
+        logger.warning("No se puede medir la memoria de cada prueba en este sistema; se ignora --memory-budget-gb.")
+    elif budget_bytes is not None:
+        if _pads_to_training_segment(model):
+            # htdemucs rellena cada trozo hasta su segmento de entrenamiento: uno más corto no baja el pico
+            candidates = [None]
+        else:
+            candidates = [None] + ([round(max_segment * f, 2) for f in (0.75, 0.5, 0.25)] if max_segment else [])
+        previous_peak = None
+        for candidate in candidates:
+            rtf, peak = measure({**SEPARATION_PROFILES["fast"], "segment": candidate})
+            logger.info(f"[🎛️] Autoajuste: segment={candidate} → pico de memoria {peak / 1024**2:.0f} MB")
+            if previous_peak is not None and peak > previous_peak * (1 - AUTOTUNE_MIN_MEMORY_SAVING):
+                logger.info("[🎛️] Autoajuste: reducir el segmento no baja el pico de memoria de este modelo.")
+                break
+            segment, previous_peak = candidate, peak
+            if peak <= budget_bytes:
+                break
+        if previous_peak > budget_bytes:
+            logger.warning(f"Ningún tamaño de segmento que reduzca la memoria cabe en {memory_budget_gb} GB; "
+                           f"se usa segment={segment}.")
+
+    # 2. Velocidad: se sube por la escalera mientras se cumpla el RTF objetivo
+    chosen = None
+    for step in AUTOTUNE_LADDER:
+        options = {**step, "segment": segment}
+        rtf, peak = measure(options)
+        logger.info(f"[🎛️] Autoajuste: shifts={options['shifts']} overlap={options['overlap']} segment={segment} → RTF {rtf:.3f}")
+        if rtf > target_rtf:
+            break
+        chosen = {"options": options, "rtf": round(rtf, 4), "peak_rss_mb": round(peak / 1024**2, 1) if peak else None}
+    if chosen is None:
+        logger.warning(f"Ni el perfil más rápido alcanza un RTF de {target_rtf} (medido: {rtf:.3f}); se usa el más rápido.")
+        chosen = {"options": {**AUTOTUNE_LADDER[0], "segment": segment}, "rtf": round(rtf, 4),
+                  "peak_rss_mb": round(peak / 1024**2, 1) if peak else None}
+    model.separation_options = chosen["options"]
+    return chosen
+
+def resolve_separation_options(model, device, profile=None, auto=False, tune_file=None, retune=False,
+                               target_rtf=1.0, memory_budget_gb=None, clip_seconds=20.0):
+    """
+    Fija model.separation_options a partir de --profile o de --auto-tune. El resultado del autoajuste se
+    guarda en tune_file y se reutiliza en las siguientes ejecuciones con el mismo equipo y objetivos.
+    """
+    if not auto:
+        model.separation_options = SEPARATION_PROFILES[profile or "balanced"]
+        return model.separation_options
+    key = _autotune_key(model, target_rtf, memory_budget_gb)
+    stored = {}
+    if tune_file and os.path.exists(tune_file):
+        try:
+            with open(tune_file, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer {tune_file} ({e}); se vuelve a calibrar.")
+            stored = {}
+    if key in stored and not retune:
+        model.separation_options = stored[key]["options"]
+        logger.info(f"[🎛️] Autoajuste guardado en {tune_file} (calibrado el {stored[key]['calibrated_at']}); se omite la calibración.")
+        return model.separation_options
+
+    logger.info(f"[🎛️] Calibrando con {clip_seconds:.0f}s de audio: RTF objetivo {target_rtf}"
+                 + (f", memoria máxima {memory_budget_gb} GB." if memory_budget_gb else "."))
+    chosen = auto_tune(model, device, target_rtf, memory_budget_gb, clip_seconds)
+    chosen["calibrated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    if tune_file:
+        stored[key] = chosen
+        os.makedirs(os.path.dirname(os.path.abspath(tune_file)), exist_ok=True)
+        tmp_path = f"{tune_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, tune_file)
+    return model.separation_options
+
+# --- Omisión de tramos inactivos (--skip-silence) ---
+SILENCE_FRAME_SECONDS = 0.02 # Resolución de la detección
+SILENCE_MIN_SECONDS = 1.0 # Los huecos inactivos más cortos se separan igualmente
+SILENCE_FADE_SECONDS = 0.01 # Fundido entre lo separado y el relleno
+
+def find_active_regions(mix, sr, threshold_db=-50.0, padding_seconds=0.3, margin_db=12.0):
+    """
+    Detección de actividad por energía sobre la mezcla mono de mix (canales, muestras).
+    Un marco está activo si supera threshold_db (dBFS) y además el suelo de ruido del archivo
+    (percentil 10) en margin_db, sin pasar nunca de 35 dB por debajo del marco más fuerte: así el
+    ruido de línea de una llamada cuenta como inactivo, pero en música los pasajes suaves no.
+    Devuelve una lista ordenada de tramos activos [(inicio, fin)] en muestras, ya ampliados con
+    padding_seconds y con los huecos de menos de SILENCE_MIN_SECONDS unidos.
+    """
+    total = mix.shape[-1]
+    frame = max(1, int(sr * SILENCE_FRAME_SECONDS))
+    frames = -(-total // frame)
+    mono = torch.nn.functional.pad(mix.float().mean(dim=0), (0, frames * frame - total))
+    energy_db = 10 * torch.log10(mono.view(frames, frame).pow(2).mean(dim=1) + 1e-12)
+
+    floor_db = float(torch.quantile(energy_db, 0.1)) if frames > 1 else float(energy_db[0])
+    threshold = min(max(threshold_db, floor_db + margin_db), float(energy_db.max()) - 35.0)
+    active = (energy_db > threshold).float()
+
+    padding = int(round(padding_seconds / SILENCE_FRAME_SECONDS))
+    if padding > 0:
+        active = torch.nn.functional.max_pool1d(active.view(1, 1, -1), 2 * padding + 1, stride=1, padding=padding).view(-1)
+
+    # Tramos activos como (inicio, fin) en marcos; se unen los separados por huecos cortos
+    edges = torch.diff(torch.nn.functional.pad(active, (1, 1))).nonzero().view(-1).tolist()
+    min_gap = int(SILENCE_MIN_SECONDS / SILENCE_FRAME_SECONDS)
+    regions = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    return [(start * frame, min(end * frame, total)) for start, end in regions]
+
+def _skipped_samples(regions, limit):
+    # Muestras de [0, limit) que quedan fuera de los tramos activos
+    if regions is None:
+        return 0
+    return limit - sum(max(0, min(end, limit) - start) for start, end in regions if start < limit)
+
+def separate_active(model, mix, device):
+    """
+    Como run_model, pero con --skip-silence (model.silence_options) solo pasa por Demucs los tramos
+    activos de mix (1, canales, muestras) y los vuelve a colocar en su sitio. Los tramos inactivos
+    quedan en silencio o, con fill="attenuated", con el original atenuado repartido entre los stems
+    (los stems siguen sumando la mezcla, atenuada). Devuelve (stems, tramos); tramos es None si se
+    separó el audio completo.
+    """
+    options = getattr(model, "silence_options", None)
+    if not options:
+        return run_model(model, mix, device), None
+    total = mix.shape[-1]
+    regions = find_active_regions(mix[0], int(model.samplerate), options["threshold_db"], options["padding_seconds"])
+    if total - sum(end - start for start, end in regions) < 0.1 * total:
+        # Casi todo activo: trocear no compensa
+        return run_model(model, mix, device), None
+
+    sources = len(getattr(model, "sources", DEFAULT_SOURCES))
+    if options["fill"] == "attenuated":
+        gain = 10 ** (-options["attenuation_db"] / 20) / sources
+        stems = (mix.float() * gain).unsqueeze(1).repeat(1, sources, 1, 1)
+    else:
+        stems = torch.zeros(mix.shape[0], sources, *mix.shape[1:], device=mix.device)
+    fade = int(SILENCE_FADE_SECONDS * model.samplerate)
+    for start, end in regions:
+        separated = run_model(model, mix[..., start:end], device).to(stems.device)
+        weight = torch.ones(end - start, device=stems.device)
+        edge = min(fade, (end - start) // 2)
+        if start > 0 and edge:
+            weight[:edge] = torch.linspace(0, 1, edge, device=stems.device)
+        if end < total and edge:
+            weight[-edge:] = torch.linspace(1, 0, edge, device=stems.device)
+        stems[..., start:end] = stems[..., start:end] * (1 - weight) + separated * weight
+    return stems, regions
+
+# --- Procesamiento en paralelo (--workers) ---
+# Estado de cada proceso worker. El modelo se carga una sola vez en el proceso principal
+# y llega a los workers por copy-on-write (fork) o por memoria compartida (spawn).
+_worker_state = {}
+
+def _init_worker(model, torch_threads):
+    _worker_state["model"] = model
+    # Repartir los hilos intra-op entre los workers para no sobresuscribir los núcleos
+    torch.set_num_threads(torch_threads)
+
+def _process_file_worker(file_path, process_kwargs):
+    ok = process_file(_worker_state["model"], file_path, **process_kwargs)
+    cache = process_kwargs.get("cache")
+    metrics = process_kwargs.get("metrics")
+    return ok, cache.stats if cache is not None else None, metrics.drain() if metrics is not None else None
+
+def process_files_parallel(model, files, workers, on_result=None, **process_kwargs):
+    """
+    Procesa una lista de archivos con un pool de procesos que comparten el mismo modelo.
+    process_kwargs se pasan tal cual a process_file. on_result(file_path, ok) se llama en el proceso
+    principal al terminar cada archivo. Devuelve el número de archivos procesados con éxito.
+    """
+    from tqdm import tqdm
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    # Los parámetros pasan a memoria compartida: con fork ninguna escritura los duplica,
+    # y con spawn se envían a los workers como handles en lugar de copias.
+    model.share_memory()
+    start_method = "fork" if "fork" in torch.multiprocessing.get_all_start_methods() else "spawn"
+    logger.info(f"Iniciando {workers} workers ({start_method}) con {torch_threads} hilo(s) de torch cada uno.")
+
+    processed_ok = 0
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=torch.multiprocessing.get_context(start_method),
+                             initializer=_init_worker,
+                             initargs=(model, torch_threads)) as executor:
+        futures = {
+            executor.submit(_process_file_worker, f, process_kwargs): f
+            for f in files
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="🎵 Procesando audio", unit=" archivo"):
+            f = futures[future]
+            ok = False
+            try:
+                ok, cache_stats, records = future.result()
+                if ok:
+                    processed_ok += 1
+                if cache_stats:
+                    process_kwargs["cache"].merge_stats(cache_stats)
+                if records:
+                    process_kwargs["metrics"].merge(records)
+            except BrokenProcessPool as e:
+                # Un worker murió (p. ej. por falta de memoria); el resto de archivos pendientes fallará igual
+                logger.critical(f"[❌] El worker que procesaba {f} terminó de forma inesperada: {e}")
+            except Exception as e:
+                logger.critical(f"[❌] Error CRÍTICO inesperado en el worker al procesar {f}: {e}", exc_info=True)
+            if on_result is not None:
+                on_result(f, ok)
+    return processed_ok
+
+def process_batch(model, files, process_kwargs, workers=1, pipeline=False, prefetch=2, writer_threads=2, on_result=None,
+                  batch_clips=1, batch_max_seconds=60.0):
+    """
+    Procesa una lista de archivos en el modo elegido: secuencial, --workers, --pipeline o --batch-clips.
+    on_result(file_path, ok) se llama en el proceso principal al terminar cada archivo.
+    Devuelve el número de archivos procesados con éxito.
+    """
+    workers = min(workers, len(files))
+    if pipeline:
+        kw = process_kwargs
+        return process_files_pipelined(model, files, kw["base_output_dir"], kw["apply_denoise"], kw["apply_normalize"], kw["save_stems"],
+                                       kw["device"], cache=kw["cache"], two_stems=kw["two_stems"], denoise_engine=kw["denoise_engine"],
+                                       prefetch=prefetch, writer_threads=writer_threads, metrics=kw["metrics"], on_result=on_result,
+                                       output_sr=kw["output_sr"], native_postprocess=kw["native_postprocess"])
+    if batch_clips > 1:
+        kw = process_kwargs
+        return process_files_batched(model, files, kw["base_output_dir"], kw["apply_denoise"], kw["apply_normalize"], kw["save_stems"],
+                                     kw["device"], cache=kw["cache"], two_stems=kw["two_stems"], denoise_engine=kw["denoise_engine"],
+                                     metrics=kw["metrics"], on_result=on_result, output_sr=kw["output_sr"],
+                                     native_postprocess=kw["native_postprocess"], batch_clips=batch_clips,
+                                     batch_max_seconds=batch_max_seconds)
+    if workers > 1:
+        return process_files_parallel(model, files, workers, on_result=on_result, **process_kwargs)
+
+    from tqdm import tqdm
+    processed_ok = 0
+    for f in tqdm(files, desc="🎵 Procesando audio", unit=" archivo"):
+        ok = process_file(model, f, **process_kwargs)
+        if ok:
+            processed_ok += 1
+        if on_result is not None:
+            on_result(f, ok)
+    return processed_ok
+
+# --- API en memoria (VocalClarityEngine) ---
+class VocalClarityEngine:
+    """
+    API para usar VocalClarityPro desde otros programas sin pasar por archivos.
+
+    Carga y prepara el modelo una sola vez (--accel, --profile, --skip-silence) y procesa audio ya
+    decodificado: tensores de torch o arrays de NumPy de forma (canales, muestras) o (muestras,).
+    Devuelve las pistas procesadas como tensores; con output_dir las guarda además como WAV, con los
+    mismos nombres que la CLI. Importar el módulo no configura el logging ni crea carpetas: los mensajes
+    van al logger "VocalClarityPro".
+
+        engine = VocalClarityEngine(denoise=True, normalize=True)
+        tracks = engine.process(audio, 8000) # {"vocals": tensor (2, muestras) a 8 kHz, "drums": ..., ...}
+
+    La CLI usa esta misma clase: process_files procesa archivos con cualquiera de sus modos (--workers,
+    --pipeline, --batch-clips, --stream).
+    """
+
+    def __init__(self, model=None, model_name="htdemucs", snapshot_path=None, device="cpu", accel="inference",
+                 profile="balanced", silence_options=None, denoise=False, normalize=False, denoise_engine="torch",
+                 two_stems=None, native_postprocess=False):
+        if model is None:
+            model = load_separation_model(model_name, snapshot_path)
+        model.to(device)
+        self.model = prepare_model(model, accel, device)
+        resolve_separation_options(self.model, device, profile)
+        if silence_options:
+            # Mismas claves que --silence-threshold-db, --silence-padding, --silence-fill y --silence-attenuation-db
+            self.model.silence_options = {"threshold_db": -50.0, "padding_seconds": 0.3, "fill": "silence",
+                                          "attenuation_db": 20.0, **silence_options}
+        self.device = device
+        self.denoise = denoise
+        self.normalize = normalize
+        self.denoise_engine = denoise_engine
+        self.two_stems = two_stems
+        self.native_postprocess = native_postprocess
+
+    @property
+    def sources(self):
+        return list(getattr(self.model, "sources", DEFAULT_SOURCES))
+
+    @property
+    def samplerate(self):
+        """Frecuencia a la que trabaja el modelo."""
+        return int(getattr(self.model, "samplerate", 44100))
+
+    @staticmethod
+    def _as_waveform(audio):
+        # torch.as_tensor comparte la memoria de los arrays de NumPy; solo los enteros PCM se convierten
+        waveform = torch.as_tensor(audio)
+        if not waveform.is_floating_point():
+            if waveform.dtype == torch.bool or torch.iinfo(waveform.dtype).min == 0:
+                raise ValueError(f"Tipo de muestras no admitido: {waveform.dtype}. Usa float o enteros PCM con signo.")
+            waveform = waveform.float() / -torch.iinfo(waveform.dtype).min
+        elif waveform.dtype != torch.float32:
+            waveform = waveform.float()
+        return waveform
+
+    def process(self, audio, sr, output_sr="source", tracks=None, output_dir=None, name="audio"):
+        """
+        Separa y post-procesa audio en memoria. Devuelve {pista: tensor (canales, muestras)} a la frecuencia
+        de entrada (output_sr="source") o a la del modelo ("model").
+
+        - tracks: nombres de las pistas a devolver (p. ej. ["vocals"]); por defecto todas. Las demás no se post-procesan.
+        - output_dir: si se indica, las pistas se guardan también como <name>_vocalclarity.wav (y el resto de
+          stems en <output_dir>/<name>/), igual que la CLI con --save-stems.
+
+        Sin reducción de ruido, normalización ni remuestreo, las pistas son vistas de la salida de Demucs.
+        Lanza ValueError si el audio está vacío o no tiene una forma válida y RuntimeError si falla la separación.
+        """
+        if output_sr not in ("source", "model"):
+            raise ValueError(f"output_sr debe ser 'source' o 'model', no {output_sr!r}.")
+        waveform = self._as_waveform(audio)
+        if waveform.numel() == 0:
+            raise ValueError(f"El audio de {name} está vacío.")
+        mix = prepare_waveform(waveform, name)
+        if mix is None:
+            raise ValueError("Se esperaba audio de forma (canales, muestras) o (muestras,).")
+        source_frames = mix.shape[-1]
+        model_sr = self.samplerate
+        stems = separate(self.model, resample(mix, sr, model_sr), self.device, name)
+        if stems is None:
+            raise RuntimeError(f"La separación con Demucs falló para {name}; el log tiene los detalles.")
+
+        plan = plan_tracks(self.sources, self.two_stems)
+        if tracks is not None:
+            unknown = set(tracks) - {track_name for track_name, _ in plan}
+            if unknown:
+                raise ValueError(f"Pistas desconocidas: {', '.join(sorted(unknown))}.")
+            plan = [entry for entry in plan if entry[0] in tracks]
+        target_sr = sr if output_sr == "source" else model_sr
+        # Misma elección de frecuencias que write_stage para los archivos
+        processed = postprocess_tracks(stems, model_sr, plan, self.denoise, self.normalize, self.denoise_engine,
+                                       output_sr=target_sr,
+                                       postprocess_sr=min(model_sr, sr) if self.native_postprocess else model_sr,
+                                       output_frames=source_frames if output_sr == "source" else None)
+        if output_dir is not None:
+            original_file_path, base_output_dir = Path(name), Path(output_dir)
+            plan = [(track_name, None, stem_output_path(original_file_path, track_name, base_output_dir, True))
+                    for track_name in processed]
+            # Solo las carpetas que se usan: con two_stems o tracks=["vocals"] no hay subcarpeta <name>/
+            for _, _, output_path in plan:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+            save_tracks(processed, target_sr, plan)
+        return processed
+
+    def file_options(self, output_dir, save_stems=False, stream=False, chunk_seconds=60.0, overlap_seconds=5.0, cache=None,
+                     metrics=None, output_sr="source"):
+        """Opciones de process_file (process_kwargs) con los ajustes de post-procesado del motor."""
+        return dict(base_output_dir=Path(output_dir), apply_denoise=self.denoise, apply_normalize=self.normalize,
+                    save_stems=save_stems, device=self.device, stream=stream, chunk_seconds=chunk_seconds,
+                    overlap_seconds=overlap_seconds, cache=cache, two_stems=self.two_stems,
+                    denoise_engine=self.denoise_engine, metrics=metrics, output_sr=output_sr,
+                    native_postprocess=self.native_postprocess)
+
+    def process_files(self, files, process_kwargs, dedup_index=None, **batch_options):
+        """
+        Procesa archivos a disco con process_batch (o process_batch_dedup con dedup_index). batch_options
+        son los de process_batch (workers, pipeline, batch_clips, on_result...). Devuelve los procesados con éxito.
+        """
+        if dedup_index is not None:
+            return process_batch_dedup(self.model, files, process_kwargs, dedup_index, **batch_options)
+        return process_batch(self.model, files, process_kwargs, **batch_options)
+
+# Bloque principal de ejecución
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herramienta de procesamiento de audio con separación de voces y reducción de ruido.")
+    parser.add_argument("--path", help="Ruta del archivo o carpeta de entrada. Se procesarán todos los archivos de audio detectados.")
+    parser.add_argument("--denoise", action="store_true", help="Aplicar reducción de ruido a las voces separadas.")
+    parser.add_argument("--normalize", action="store_true", help="Normalizar el volumen de las voces separadas a un pico de -1 dBFS.")
+    parser.add_argument("--denoise-engine", choices=["torch", "noisereduce"], default="torch", help="Motor de reducción de ruido: 'torch' procesa todos los stems en una llamada vectorizada; 'noisereduce' es la implementación anterior, pista a pista (por defecto torch).")
+    parser.add_argument("--output-sr", choices=["source", "model"], default="source", help="Frecuencia de muestreo de los WAV guardados: la del archivo original (por defecto) o la del modelo (44.1 kHz). Demucs siempre trabaja a la frecuencia del modelo.")
+    parser.add_argument("--native-postprocess", action="store_true", help="Aplica la reducción de ruido y la normalización a la frecuencia original cuando es menor que la del modelo (p. ej. llamadas a 8 kHz), lo que ahorra CPU.")
+    parser.add_argument("--save-stems", action="store_true", help="Guardar todos los stems (voces, batería, bajo, otros) separados por Demucs en una subcarpeta.")
+    parser.add_argument("--workers", type=int, default=1, help="Número de procesos para procesar carpetas en paralelo. El modelo se carga una sola vez y se comparte entre ellos.")
+    parser.add_argument("--pipeline", action="store_true", help="Solapar etapas entre archivos: decodificar el siguiente y escribir el anterior mientras Demucs procesa el actual.")
+    parser.add_argument("--prefetch", type=int, default=2, help="En modo --pipeline, máximo de archivos decodificados esperando a Demucs (por defecto 2).")
+    parser.add_argument("--writer-threads", type=int, default=2, help="En modo --pipeline, hilos que post-procesan y guardan los resultados (por defecto 2).")
+    parser.add_argument("--batch-clips", type=int, default=1, help="Separa hasta N clips cortos consecutivos en una sola llamada a Demucs, apilados en la dimensión de batch; el resultado es el mismo que separándolos uno a uno (por defecto 1, sin lotes).")
+    parser.add_argument("--batch-max-seconds", type=float, default=60.0, help="Con --batch-clips, duración máxima de un lote (número de clips por la duración del más largo) (por defecto 60).")
+    parser.add_argument("--stream", action="store_true", help="Procesar por ventanas solapadas para que la memoria usada no dependa de la duración del archivo (grabaciones muy largas).")
+    parser.add_argument("--chunk-seconds", type=float, default=60.0, help="Duración de cada ventana en modo --stream (por defecto 60 s).")
+    parser.add_argument("--overlap-seconds", type=float, default=5.0, help="Solapamiento entre ventanas en modo --stream, usado para el fundido cruzado (por defecto 5 s).")
+    parser.add_argument("--two-stems", choices=["vocals"], help="Guardar solo dos pistas: las voces y el acompañamiento (suma del resto de stems). Ignora --save-stems.")
+    parser.add_argument("--cache-dir", help="Carpeta de caché de resultados. Si se indica, los archivos ya procesados (mismo contenido y opciones) no se vuelven a separar.")
+    parser.add_argument("--cache-max-gb", type=float, default=10.0, help="Tamaño máximo de la caché en GB; se eliminan primero las entradas menos usadas (por defecto 10).")
+    parser.add_argument("--serve", action="store_true", help="Modo servidor: mantiene el modelo cargado y recibe trabajos por HTTP en localhost (o por --socket). No usa --path.")
+    parser.add_argument("--host", default="127.0.0.1", help="En modo --serve, dirección en la que escuchar (por defecto 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="En modo --serve, puerto HTTP (por defecto 8765).")
+    parser.add_argument("--socket", help="En modo --serve, escuchar en este socket Unix en lugar de TCP.")
+    parser.add_argument("--concurrency", type=int, default=1, help="En modo --serve, trabajos procesados a la vez (por defecto 1).")
+    parser.add_argument("--queue-size", type=int, default=64, help="En modo --serve, máximo de trabajos en cola; por encima se rechazan con HTTP 503 (por defecto 64).")
+    parser.add_argument("--incremental", action="store_true", help="Procesar solo archivos nuevos o modificados, según un manifiesto persistente. Permite reanudar una ejecución interrumpida.")
+    parser.add_argument("--manifest", help="Archivo SQLite del manifiesto (por defecto processed_audio_clarity/manifest.sqlite). Implica --incremental.")
+    parser.add_argument("--watch", action="store_true", help="Tras procesar, seguir vigilando --path y procesar los archivos que lleguen o cambien. Implica --incremental.")
+    parser.add_argument("--watch-interval", type=float, default=10.0, help="En modo --watch, segundos entre cada recorrido de la carpeta (por defecto 10).")
+    parser.add_argument("--watch-settle", type=float, default=5.0, help="En modo --watch, segundos que un archivo debe llevar sin modificarse antes de procesarlo (por defecto 5).")
+    parser.add_argument("--shard", help="Procesa solo el fragmento i/n de la lista de archivos (p. ej. 2/3), para repartir un archivo entre varias máquinas; el reparto depende solo de la ruta relativa a --path y es el mismo en todos los nodos.")
+    parser.add_argument("--claim", action="store_true", help="Reparto dinámico entre nodos que comparten la carpeta de salida (p. ej. por NFS): cada nodo reclama los archivos con archivos de bloqueo atómicos en --claim-dir, así que los más rápidos procesan más. Los archivos terminados no se vuelven a procesar en ejecuciones posteriores.")
+    parser.add_argument("--claim-dir", help="Carpeta compartida de reclamaciones de --claim (por defecto processed_audio_clarity/claims).")
+    parser.add_argument("--claim-ttl", type=float, default=600.0, help="Segundos sin renovar tras los que caduca la reclamación de un nodo caído y otro nodo recupera el archivo (por defecto 600).")
+    parser.add_argument("--dedup", action="store_true", help="Detecta grabaciones casi duplicadas (recodificadas a MP3/M4A/AMR o recortadas) mediante huellas de audio guardadas en un índice persistente: solo se separa una de cada grupo y las demás reciben sus salidas ajustadas a su duración.")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="Similitud mínima (fracción de bits iguales de la huella, entre 0 y 1) para considerar duplicados dos archivos; dos grabaciones distintas dan alrededor de 0.5 (por defecto 0.8).")
+    parser.add_argument("--dedup-index", help="Archivo SQLite del índice de huellas (por defecto processed_audio_clarity/fingerprints.sqlite).")
+    parser.add_argument("--dedup-report", help="Archivo JSON con los grupos de duplicados (por defecto processed_audio_clarity/duplicates.json).")
+    parser.add_argument("--accel", choices=ACCEL_MODES, default="inference", help="Aceleración de la inferencia en CPU: none (fp32 tal cual), inference (inference_mode, mismo resultado; por defecto), int8 (cuantización dinámica), bf16 (autocast, si la CPU lo soporta) o compile (torch.compile; la primera llamada tarda).")
+    parser.add_argument("--accel-report", action="store_true", help="Compara todos los modos de --accel sobre el primer archivo de --path (velocidad y SDR frente a fp32) y termina.")
+    parser.add_argument("--accel-report-seconds", type=float, default=30.0, help="Segundos del archivo de referencia usados en --accel-report (por defecto 30).")
+    parser.add_argument("--profile", choices=sorted(SEPARATION_PROFILES), default="balanced", help="Velocidad frente a calidad de la separación: fast (sin desplazamientos, poco solapamiento), balanced (valores de Demucs; por defecto) o max (4 desplazamientos, 50%% de solapamiento; unas 6 veces más lento).")
+    parser.add_argument("--auto-tune", action="store_true", help="Calibra en este equipo y elige los parámetros de mayor calidad que cumplen --target-rtf y --memory-budget-gb. El resultado se guarda en --tune-file y las siguientes ejecuciones no vuelven a calibrar. Ignora --profile.")
+    parser.add_argument("--target-rtf", type=float, default=1.0, help="RTF máximo del autoajuste: segundos de separación por segundo de audio (por defecto 1.0, tiempo real).")
+    parser.add_argument("--memory-budget-gb", type=float, help="Pico de memoria máximo del proceso durante el autoajuste, en GB (por defecto sin límite).")
+    parser.add_argument("--calibration-seconds", type=float, default=20.0, help="Duración del clip de calibración de --auto-tune (por defecto 20).")
+    parser.add_argument("--tune-file", help="Archivo JSON donde se guarda el autoajuste (por defecto processed_audio_clarity/autotune.json).")
+    parser.add_argument("--retune", action="store_true", help="Vuelve a calibrar aunque haya un autoajuste guardado para este equipo.")
+    parser.add_argument("--skip-silence", action="store_true", help="Solo pasa por Demucs los tramos con actividad (detección por energía); los tramos inactivos de más de 1s se rellenan según --silence-fill.")
+    parser.add_argument("--silence-threshold-db", type=float, default=-50.0, help="Energía mínima (dBFS) para considerar activo un tramo con --skip-silence; se sube sola por encima del ruido de fondo del archivo (por defecto -50).")
+    parser.add_argument("--silence-padding", type=float, default=0.3, help="Segundos de margen alrededor de cada tramo activo (por defecto 0.3).")
+    parser.add_argument("--silence-fill", choices=["silence", "attenuated"], default="silence", help="Relleno de los tramos inactivos: silencio (por defecto) o el original atenuado --silence-attenuation-db.")
+    parser.add_argument("--silence-attenuation-db", type=float, default=20.0, help="Atenuación del original con --silence-fill attenuated, en dB (por defecto 20).")
+    parser.add_argument("--model-snapshot", help="Archivo con una instantánea del modelo ya construido. Si no existe (o es de otra versión de torch/demucs) se crea; en las siguientes ejecuciones el modelo se carga de ahí, más rápido que reconstruirlo desde el checkpoint.")
+    parser.add_argument("--metrics-dir", help="Carpeta donde guardar métricas por etapa: stages.jsonl (un registro por archivo) y vocalclarity.prom (formato Prometheus). Al final se muestra una tabla resumen. Desactivado por defecto.")
+    args = parser.parse_args()
+    if not args.serve and not args.path:
+        parser.error("se requiere --path (salvo en modo --serve)")
+
+    setup_logging()
+
+    # --- Verificaciones de Compatibilidad ---
+    python_major, python_minor = sys.version_info.major, sys.version_info.minor
+    if not (python_major == 3 and python_minor in [10, 11]):
+        warnings.warn(f"Estás usando Python {python_major}.{python_minor}. "
+                      f"Se recomienda Python 3.10 o 3.11 para una mejor compatibilidad con Demucs y PyTorch.")
+        logger.warning(f"Estás usando Python {python_major}.{python_minor}. "
+                        f"Se recomienda Python 3.10 o 3.11 para una mejor compatibilidad con Demucs y PyTorch.")
+
+    # --- Configuración del dispositivo (Siempre CPU para tu caso) ---
+    device = "cpu"
+    logger.info("Demucs se ejecutará en CPU (configuración para equipos de bajos recursos). Esto puede ser más lento.")
+
+    if args.workers < 1:
+        logger.error(f"❌ --workers debe ser al menos 1 (se recibió {args.workers}).")
+        sys.exit(1)
+    if args.pipeline and (args.workers > 1 or args.stream):
+        logger.error("❌ --pipeline no se puede combinar con --workers ni con --stream.")
+        sys.exit(1)
+    if args.batch_clips < 1 or args.batch_max_seconds <= 0:
+        logger.error("❌ --batch-clips debe ser al menos 1 y --batch-max-seconds positivo.")
+        sys.exit(1)
+    if args.batch_clips > 1 and (args.workers > 1 or args.pipeline or args.stream or args.serve):
+        logger.error("❌ --batch-clips no se puede combinar con --workers, --pipeline, --stream ni --serve.")
+        sys.exit(1)
+    if args.serve and (args.workers > 1 or args.pipeline):
+        logger.error("❌ --serve no se puede combinar con --workers ni con --pipeline; usa --concurrency.")
+        sys.exit(1)
+    if args.accel_report and (args.serve or args.incremental):
+        logger.error("❌ --accel-report no se puede combinar con --serve, --incremental ni --watch.")
+        sys.exit(1)
+    if args.auto_tune and (args.target_rtf <= 0 or args.calibration_seconds <= 0):
+        logger.error("❌ --target-rtf y --calibration-seconds deben ser positivos.")
+        sys.exit(1)
+    if args.manifest or args.watch:
+        args.incremental = True
+    if args.serve and args.incremental:
+        logger.error("❌ --serve no se puede combinar con --incremental ni con --watch.")
+        sys.exit(1)
+    if args.dedup and (args.serve or args.accel_report):
+        logger.error("❌ --dedup no se puede combinar con --serve ni con --accel-report.")
+        sys.exit(1)
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            logger.error(f"❌ --shard debe tener la forma i/n, por ejemplo 2/3 ({e}).")
+            sys.exit(1)
+    if (shard or args.claim) and args.serve:
+        logger.error("❌ --shard y --claim no se pueden combinar con --serve.")
+        sys.exit(1)
+    if args.claim and args.incremental:
+        # El manifiesto SQLite no es fiable entre máquinas; las marcas de --claim ya evitan repetir archivos
+        logger.error("❌ --claim no se puede combinar con --incremental ni con --watch: sus marcas de archivos terminados ya cumplen esa función.")
+        sys.exit(1)
+    if args.claim and args.claim_ttl <= 0:
+        logger.error("❌ --claim-ttl debe ser positivo.")
+        sys.exit(1)
+    if args.dedup and not 0 < args.dedup_threshold <= 1:
+        logger.error("❌ --dedup-threshold debe estar entre 0 y 1.")
+        sys.exit(1)
+    if args.watch and (args.watch_interval <= 0 or args.watch_settle < 0):
+        logger.error("❌ --watch-interval debe ser positivo y --watch-settle no puede ser negativo.")
+        sys.exit(1)
+    if args.watch and not Path(args.path).is_dir():
+        logger.error(f"❌ --watch necesita que --path sea un directorio: {args.path}")
+        sys.exit(1)
+    if args.serve and (args.concurrency < 1 or args.queue_size < 1):
+        logger.error("❌ --concurrency y --queue-size deben ser al menos 1.")
+        sys.exit(1)
+    if args.prefetch < 1 or args.writer_threads < 1:
+        logger.error("❌ --prefetch y --writer-threads deben ser al menos 1.")
+        sys.exit(1)
+    if args.two_stems and args.save_stems:
+        logger.warning("--save-stems se ignora con --two-stems: solo se guardan las voces y el acompañamiento.")
+        args.save_stems = False
+    if args.stream and not (0 < 2 * args.overlap_seconds < args.chunk_seconds):
+        logger.error("❌ En modo --stream, --overlap-seconds debe ser positivo y menor que la mitad de --chunk-seconds.")
+        sys.exit(1)
+
+    base_out_dir = "processed_audio_clarity"
+    entries = [] # (ruta, tamaño, mtime_ns) de cada archivo de entrada
+    if not args.serve:
+        path = Path(args.path)
+        if not path.exists():
+            logger.error(f"❌ La ruta proporcionada no existe: {args.path}")
+            sys.exit(1)
+
+        if path.is_file():
+            if path.suffix.lower() in AUDIO_EXTS:
+                stat = path.stat()
+                entries.append((path, stat.st_size, stat.st_mtime_ns))
+                logger.info(f"Archivo único detectado: {path}")
+            else:
+                logger.error(f"❌ El archivo proporcionado '{path}' no es un formato de audio compatible. Extensiones soportadas: {', '.join(AUDIO_EXTS)}")
+                sys.exit(1)
+        elif path.is_dir():
+            logger.info(f"Directorio detectado: {path}. Escaneando archivos de audio...")
+            scan_started = time.perf_counter()
+            entries = scan_audio_files(path, exclude=[base_out_dir])
+            if not entries and not args.watch:
+                logger.warning(f"No se encontraron archivos de audio compatibles en el directorio: {path} o sus subdirectorios.")
+                sys.exit(0)
+            logger.info(f"Se encontraron {len(entries)} archivos de audio en el directorio ({time.perf_counter() - scan_started:.2f}s).")
+        else:
+            logger.error(f"❌ La ruta proporcionada no es un archivo ni un directorio válido: {args.path}")
+            sys.exit(1)
+
+    # --- Reparto entre nodos: las rutas se comparan relativas a --path ---
+    input_root = None if args.serve else (path if path.is_dir() else path.parent)
+
+    def in_shard(entries):
+        if shard is None:
+            return entries
+        selected = set(select_shard([e[0] for e in entries], input_root, *shard))
+        return [e for e in entries if e[0] in selected]
+
+    if shard is not None:
+        scanned = len(entries)
+        entries = in_shard(entries)
+        logger.info(f"[🗂️] Fragmento {shard[0]}/{shard[1]}: {len(entries)} de {scanned} archivos.")
+
+    # --- Modo incremental: solo archivos nuevos, modificados o con fallos pendientes de reintento ---
+    manifest = None
+    settings = {"denoise": args.denoise, "normalize": args.normalize, "save_stems": args.save_stems,
+                "two_stems": args.two_stems, "denoise_engine": args.denoise_engine if args.denoise else None}
+    # Solo si cambian el resultado de la separación, para no invalidar los manifiestos existentes
+    if args.accel not in ("none", "inference"):
+        settings["accel"] = args.accel
+    if args.auto_tune:
+        settings["profile"] = f"auto:rtf={args.target_rtf}:memory_gb={args.memory_budget_gb}"
+    elif args.profile != "balanced":
+        settings["profile"] = args.profile
+    if args.output_sr != "source" or args.native_postprocess:
+        settings["sample_rate"] = [args.output_sr, args.native_postprocess]
+    if args.skip_silence:
+        settings["skip_silence"] = [args.silence_threshold_db, args.silence_padding, args.silence_fill,
+                                    args.silence_attenuation_db if args.silence_fill == "attenuated" else None]
+    settings = json.dumps(settings, sort_keys=True)
+    if args.incremental:
+        manifest = Manifest(args.manifest or os.path.join(base_out_dir, "manifest.sqlite"))
+        if args.watch:
+            # Un archivo que aún se está copiando se deja para una vuelta posterior
+            now = time.time_ns()
+            entries = [e for e in entries if now - e[2] >= args.watch_settle * 1e9]
+        entries, unchanged = manifest.select_pending(entries, settings)
+        logger.info(f"[📒] Manifiesto {manifest.db_path}: {len(entries)} archivo(s) nuevos o modificados, {unchanged} sin cambios.")
+        if not entries and not args.watch:
+            logger.info("No hay archivos nuevos o modificados que procesar.")
+            sys.exit(0)
+    files = [e[0] for e in entries]
+    signatures = {e[0]: e[1:] for e in entries}
+    if not args.serve:
+        logger.info(f"[🔍] Archivos detectados para procesar: {len(files)}")
+
+    def record_result(file_path, ok):
+        if manifest is not None:
+            manifest.record(file_path, *signatures[file_path], settings, ok)
+
+    try:
+        logger.info(f"Cargando el modelo Demucs 'htdemucs' en el dispositivo: {device}...")
+        model_load_started = time.perf_counter()
+        model = load_separation_model("htdemucs", args.model_snapshot)
+        model.to(device)
+        model_load_seconds = time.perf_counter() - model_load_started
+        logger.info(f"Modelo Demucs cargado con éxito en {model_load_seconds:.2f}s.")
+    except Exception as e:
+        logger.critical(f"Fallo CRÍTICO al cargar el modelo Demucs: {e}", exc_info=True)
+        logger.critical("Esto puede ser debido a una instalación corrupta, problemas de red durante la descarga del modelo, o incompatibilidad de versiones (especialmente Python 3.12+).")
+        logger.critical("Intenta 'rm -rf ~/.cache/demucs' y/o verifica la versión de Python/PyTorch en tu entorno virtual.")
+        sys.exit(1)
+
+    if args.accel_report:
+        loaded = load_audio(files[0])
+        reference = prepare_waveform(loaded[0], files[0]) if loaded is not None else None
+        if reference is None:
+            logger.error(f"❌ No se pudo cargar el archivo de referencia {files[0]}.")
+            sys.exit(1)
+        reference = reference[..., :int(args.accel_report_seconds * loaded[1])]
+        logger.info(f"Archivo de referencia para --accel-report: {files[0]}")
+        log_accel_report(compare_accel_modes(model, reference, device), reference.shape[-1] / loaded[1])
+        sys.exit(0)
+    silence_options = None
+    if args.skip_silence:
+        silence_options = {"threshold_db": args.silence_threshold_db, "padding_seconds": args.silence_padding,
+                           "fill": args.silence_fill, "attenuation_db": args.silence_attenuation_db}
+    engine = VocalClarityEngine(model, device=device, accel=args.accel, profile=args.profile, silence_options=silence_options,
+                                denoise=args.denoise, normalize=args.normalize, denoise_engine=args.denoise_engine,
+                                two_stems=args.two_stems, native_postprocess=args.native_postprocess)
+    model = engine.model
+    logger.info(f"Modo de aceleración: {model.accel_mode}.")
+    if args.auto_tune:
+        resolve_separation_options(model, device, auto=True, tune_file=args.tune_file or os.path.join(base_out_dir, "autotune.json"),
+                                   retune=args.retune, target_rtf=args.target_rtf, memory_budget_gb=args.memory_budget_gb,
+                                   clip_seconds=args.calibration_seconds)
+    logger.info("Parámetros de separación: " + ", ".join(f"{key}={value}" for key, value in model.separation_options.items()) + ".")
+
+    os.makedirs(base_out_dir, exist_ok=True)
+    logger.info(f"Directorio de salida base establecido en: {base_out_dir}")
+
+    # Desactivar el logging a la consola mientras tqdm está activo (en modo servidor se mantiene)
+    if not args.serve:
+        for handler in logging.root.handlers:
+            if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+                handler.setLevel(logging.CRITICAL)
+
+    cache = None
+    if args.cache_dir:
+        if args.stream:
+            logger.warning("La caché de resultados no se usa en modo --stream.")
+        else:
+            cache = ResultCache(args.cache_dir, int(args.cache_max_gb * 1024**3), model_name=separation_signature(model))
+            logger.info(f"Caché de resultados en: {args.cache_dir} (máximo {args.cache_max_gb} GB)")
+
+    startup_seconds = time.perf_counter() - _PROCESS_STARTED
+    logger.info(f"[⏱️] Arranque completado en {startup_seconds:.2f}s (carga del modelo: {model_load_seconds:.2f}s).")
+    metrics = RunMetrics(args.metrics_dir) if args.metrics_dir else None
+    if metrics is not None:
+        metrics.note_startup(startup_seconds, model_load_seconds)
+
+    process_kwargs = engine.file_options(base_out_dir, save_stems=args.save_stems, stream=args.stream,
+                                         chunk_seconds=args.chunk_seconds, overlap_seconds=args.overlap_seconds,
+                                         cache=cache, metrics=metrics, output_sr=args.output_sr)
+
+    dedup_index = None
+    if args.dedup:
+        dedup_index = FingerprintIndex(args.dedup_index or os.path.join(base_out_dir, "fingerprints.sqlite"), settings,
+                                       args.dedup_threshold)
+        logger.info(f"[🧬] Índice de huellas en: {dedup_index.db_path} (similitud mínima {args.dedup_threshold}).")
+
+    def run_batch(batch, on_result=record_result):
+        return engine.process_files(batch, process_kwargs, dedup_index, **dict(batch_options, on_result=on_result))
+
+    total_files = len(files)
+    if args.serve:
+        job_server = JobServer(model, process_kwargs, concurrency=args.concurrency, queue_size=args.queue_size)
+        serve(job_server, args.host, args.port, args.socket)
+        processed_ok = job_server.counts["ok"]
+        total_files = processed_ok + job_server.counts["failed"]
+    else:
+        batch_options = dict(workers=args.workers, pipeline=args.pipeline, prefetch=args.prefetch,
+                             writer_threads=args.writer_threads, on_result=record_result,
+                             batch_clips=args.batch_clips, batch_max_seconds=args.batch_max_seconds)
+        if args.claim and files:
+            board = ClaimBoard(args.claim_dir or os.path.join(base_out_dir, "claims"), settings, args.claim_ttl)
+            keys = {f: board.key(f, input_root, *signatures[f]) for f in files}
+            # Cada nodo reclama lo justo para mantener ocupados sus workers, su pipeline o su lote
+            chunk_size = max(args.workers, args.batch_clips, args.prefetch + 1 if args.pipeline else 1)
+            logger.info(f"[🗂️] Nodo {board.owner}: reclamando archivos en {board.claim_dir} (caducidad {args.claim_ttl:.0f}s).")
+            try:
+                processed_ok, total_files = process_claimed(files, keys, board, run_batch, chunk_size,
+                                                            poll_interval=min(args.claim_ttl / 4, 10.0))
+            finally:
+                board.close()
+            logger.info(f"[🗂️] Nodo {board.owner}: {total_files} de {len(files)} archivos procesados en este nodo, "
+                         f"{board.stats['recovered']} reclamación(es) caducada(s) recuperada(s).")
+        else:
+            processed_ok = run_batch(files) if files else 0
+
+    if args.watch:
+        # Sondeo periódico: cada vuelta recorre el árbol una vez y procesa lo que ha llegado o cambiado
+        print(f"\n👀 Vigilando {path} cada {args.watch_interval}s. Ctrl+C para detener.")
+        try:
+            while True:
+                time.sleep(args.watch_interval)
+                now = time.time_ns()
+                settled = [e for e in in_shard(scan_audio_files(path, exclude=[base_out_dir])) if now - e[2] >= args.watch_settle * 1e9]
+                entries, _ = manifest.select_pending(settled, settings)
+                if not entries:
+                    continue
+                logger.info(f"[👀] {len(entries)} archivo(s) nuevos o modificados en {path}.")
+                signatures.update({e[0]: e[1:] for e in entries})
+                batch = [e[0] for e in entries]
+                processed_ok += run_batch(batch)
+                total_files += len(batch)
+                if cache is not None:
+                    cache.enforce_size_limit()
+                if metrics is not None:
+                    metrics.write_prometheus()
+        except KeyboardInterrupt:
+            logger.info("Vigilancia detenida por el usuario.")
+
+    if manifest is not None:
+        manifest.close()
 
-    for f in tqdm(files, desc="🎵 Procesando audio", unit=" archivo"):
-        process_file(model, f, Path(base_out_dir), args.denoise, args.normalize, args.save_stems, device)
-    
     # Volver a habilitar el logging a la consola al finalizar
     for handler in logging.root.handlers:
-        if isinstance(handler, logging.StreamHandler):
+        if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
             handler.setLevel(logging.INFO)
 
-    logging.info("🏁 Procesamiento finalizado.")
+    if cache is not None:
+        cache.enforce_size_limit()
+        cache.log_stats()
+    if dedup_index is not None:
+        report_path = args.dedup_report or os.path.join(base_out_dir, "duplicates.json")
+        groups = dedup_index.write_report(report_path)
+        for group in groups:
+            logger.info(f"[🧬] Grupo de {group['canonical']}: " + ", ".join(
+                f"{d['path']} ({d['similarity']:.2f})" for d in group["duplicates"]))
+        linked = sum(len(group["duplicates"]) for group in groups)
+        logger.info(f"[🧬] {len(groups)} grupo(s) de duplicados con {linked} archivo(s) generados desde su original en total ({report_path}).")
+        dedup_index.close()
+    if metrics is not None:
+        metrics.write_prometheus()
+        metrics.log_summary()
+    if processed_ok < total_files:
+        logger.warning(f"{total_files - processed_ok} de {total_files} archivos no se pudieron procesar. Revisa el log para más detalles.")
+    logger.info("🏁 Procesamiento finalizado.")
     print("\n🏁 Procesamiento finalizado. Revisa el archivo 'logs/audio_processing.log' para más detalles.")
\ No newline at end of file
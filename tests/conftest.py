@@ -0,0 +1,65 @@
+"""
+Utilidades comunes de las pruebas: el módulo principal, el modelo sustituto determinista de
+Utilidades/benchmark.py (sin red ni pesos) y audio sintético.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+import torchaudio
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(REPO_DIR / "Utilidades"))
+
+import VocalClarityPro as vcp  # noqa: E402
+from benchmark import StandInSeparator, synthesize  # noqa: E402
+
+
+@pytest.fixture
+def make_engine():
+    """Fábrica de VocalClarityEngine con el modelo sustituto y el perfil fast (shifts=0, determinista)."""
+    def make(**options):
+        options.setdefault("accel", "none")
+        options.setdefault("profile", "fast")
+        return vcp.VocalClarityEngine(StandInSeparator().eval(), **options)
+    return make
+
+
+@pytest.fixture
+def write_audio():
+    """Escribe audio sintético en WAV (o FLAC según la extensión). Devuelve la ruta."""
+    def write(path, seconds=10.0, sr=44100, channels=2, seed=0):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torchaudio.save(str(path), synthesize(seconds, sr, channels, seed), sr, encoding="PCM_S", bits_per_sample=16)
+        return path
+    return write
+
+
+# La CLI completa con el modelo sustituto en lugar de descargar htdemucs
+CLI = """
+import runpy, sys
+sys.path[:0] = [{repo!r}, {utils!r}]
+import demucs.pretrained
+from benchmark import StandInSeparator
+demucs.pretrained.get_model = lambda name=None, **kwargs: StandInSeparator()
+sys.argv = ["VocalClarityPro.py"] + {args!r}
+runpy.run_path({script!r}, run_name="__main__")
+"""
+
+
+@pytest.fixture
+def run_cli():
+    """Ejecuta VocalClarityPro.py con los argumentos dados en cwd. Devuelve el CompletedProcess (salida en stderr)."""
+    def run(args, cwd):
+        script = CLI.format(repo=str(REPO_DIR), utils=str(REPO_DIR / "Utilidades"), args=[str(a) for a in args],
+                            script=str(REPO_DIR / "VocalClarityPro.py"))
+        return subprocess.run([sys.executable, "-c", script], cwd=cwd, capture_output=True, text=True, timeout=600)
+    return run
+
+
+def load(path):
+    waveform, _ = torchaudio.load(str(path))
+    return waveform
@@ -0,0 +1,38 @@
+import logging
+
+import torch
+
+from conftest import StandInSeparator, load, synthesize, vcp
+
+
+def test_inference_mode_matches_none():
+    mix = synthesize(9.0, 44100, 2, seed=4).unsqueeze(0) # Más de un segmento: varios trozos de apply_model
+    stems, signatures = {}, set()
+    for accel in ("none", "inference"):
+        model = vcp.prepare_model(StandInSeparator().eval(), accel)
+        model.separation_options = vcp.SEPARATION_PROFILES["fast"]
+        stems[accel] = vcp.run_model(model, mix, "cpu")
+        assert model.accel_mode == accel
+        signatures.add(vcp.separation_signature(model))
+    assert stems["inference"].is_inference()
+    assert torch.equal(stems["none"], stems["inference"])
+    assert len(signatures) == 1 # La caché de stems vale para los dos modos
+
+
+def test_inference_mode_streaming(tmp_path, make_engine, write_audio):
+    # El fundido de --stream no modifica in-place la salida del modelo (tensores de inference_mode)
+    source = write_audio(tmp_path / "grabacion.wav", seconds=14.0, seed=6)
+    for accel in ("none", "inference"):
+        engine = make_engine(accel=accel, denoise=True)
+        engine.process_files([source], engine.file_options(tmp_path / accel, stream=True, chunk_seconds=6.0,
+                                                           overlap_seconds=1.0))
+    assert torch.equal(load(tmp_path / "inference" / "grabacion_vocalclarity.wav"),
+                       load(tmp_path / "none" / "grabacion_vocalclarity.wav"))
+
+
+def test_unsupported_bf16_falls_back_to_inference(monkeypatch, caplog):
+    monkeypatch.setattr(vcp, "_bf16_supported", lambda: False)
+    with caplog.at_level(logging.WARNING, logger="VocalClarityPro"):
+        model = vcp.prepare_model(StandInSeparator().eval(), "bf16")
+    assert model.accel_mode == "inference"
+    assert "no soporta bf16" in caplog.text
@@ -0,0 +1,33 @@
+import contextlib
+
+from demucs.apply import BagOfModels
+from demucs.htdemucs import HTDemucs
+
+from conftest import StandInSeparator, vcp
+
+
+def test_memory_budget_is_skipped_without_per_trial_measurement(monkeypatch, caplog):
+    # Windows (sin resource) y macOS (solo ru_maxrss, que nunca baja)
+    monkeypatch.setattr(vcp, "_current_rss_bytes", lambda: None)
+    monkeypatch.setattr(vcp, "_peak_rss_bytes", lambda: None)
+    chosen = vcp.auto_tune(StandInSeparator().eval(), "cpu", target_rtf=100.0, memory_budget_gb=0.001, clip_seconds=2.0)
+    assert chosen["options"]["segment"] is None
+    assert chosen["peak_rss_mb"] is None
+    assert "se ignora --memory-budget-gb" in caplog.text
+
+
+def test_shorter_segments_that_do_not_save_memory_are_discarded(monkeypatch):
+    # Mismo pico con cualquier segmento, como htdemucs: se queda el segmento del modelo, no el más pequeño
+    @contextlib.contextmanager
+    def constant_peak():
+        yield {"peak": 2 * 1024**3}
+
+    monkeypatch.setattr(vcp, "_sample_peak_rss", constant_peak)
+    chosen = vcp.auto_tune(StandInSeparator().eval(), "cpu", target_rtf=100.0, memory_budget_gb=1.0, clip_seconds=2.0)
+    assert chosen["options"]["segment"] is None
+
+
+def test_htdemucs_pads_to_training_segment():
+    htdemucs = HTDemucs(sources=["drums", "bass", "other", "vocals"], channels=8, t_layers=1, bottom_channels=0)
+    assert vcp._pads_to_training_segment(BagOfModels([htdemucs]))
+    assert not vcp._pads_to_training_segment(StandInSeparator())
@@ -0,0 +1,46 @@
+import torch
+import torchaudio
+from demucs.apply import BagOfModels
+from demucs.htdemucs import HTDemucs
+
+from conftest import load, synthesize, vcp
+
+
+def tiny_htdemucs():
+    # htdemucs de verdad (pesos aleatorios, pocas capas): normaliza y atiende sobre todo el segmento, así
+    # que la salida de un clip cambia si comparte segmento con otro o si se desplaza dentro de la ventana
+    torch.manual_seed(0)
+    model = HTDemucs(sources=["drums", "bass", "other", "vocals"], channels=8, t_layers=1, bottom_channels=0, segment=4)
+    return BagOfModels([model]).eval()
+
+
+def test_batch_clips_match_per_file_output(tmp_path, monkeypatch):
+    # Clips cortos con distinta frecuencia y número de canales, como en una carpeta de mensajes de voz;
+    # el último no cabe en un solo trozo de apply_model y se separa solo
+    files = []
+    for i, (seconds, sr, channels) in enumerate([(1.0, 44100, 2), (2.5, 44100, 1), (1.2, 16000, 2), (2.9, 48000, 2),
+                                                 (6.0, 44100, 2)]):
+        path = tmp_path / "in" / f"clip{i}.wav"
+        path.parent.mkdir(exist_ok=True)
+        torchaudio.save(str(path), synthesize(seconds, sr, channels, seed=i), sr, encoding="PCM_S", bits_per_sample=16)
+        files.append(path)
+    # oneDNN compila sus kernels para cada forma nueva (decenas de segundos en CPU); sin él la prueba es rápida
+    monkeypatch.setattr(torch.backends.mkldnn, "enabled", False)
+    engine = vcp.VocalClarityEngine(tiny_htdemucs(), accel="none", profile="fast", denoise=True, normalize=True)
+    run_model = vcp.run_model
+    calls = []
+
+    def counting_run_model(model, mix, device):
+        calls.append(mix.shape[0])
+        return run_model(model, mix, device)
+
+    monkeypatch.setattr(vcp, "run_model", counting_run_model)
+    assert engine.process_files(files, engine.file_options(tmp_path / "batch"), batch_clips=8) == 5
+    assert calls == [4, 1] # Los cuatro clips cortos en una sola separación, apilados en el batch
+    engine.process_files(files, engine.file_options(tmp_path / "single"))
+
+    for path in files:
+        batched = load(tmp_path / "batch" / f"{path.stem}_vocalclarity.wav")
+        single = load(tmp_path / "single" / f"{path.stem}_vocalclarity.wav")
+        assert batched.shape == single.shape
+        assert (batched - single).abs().max() < 1e-4 # Como mucho el último bit de PCM16
@@ -0,0 +1,48 @@
+import importlib.util
+import json
+
+import pytest
+
+from conftest import REPO_DIR
+
+
+@pytest.fixture
+def borrado(tmp_path, monkeypatch):
+    # Al importarse crea logs_file_cleanup/ en el directorio actual
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("borrado", REPO_DIR / "Utilidades" / "EraseFiles" / "borrado.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_failed_batch_is_counted_and_outputs_are_kept(tmp_path, borrado, monkeypatch):
+    for name in ("Rubi_1.wav", "otro_1.wav", "sub/otro_2.wav", "sub/Rubi_2.wav"):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+    manifest_path = tmp_path / "manifiesto.json"
+
+    def failing_delete(paths):
+        raise RuntimeError("disco desconectado")
+
+    monkeypatch.setattr(borrado, "delete_batch", failing_delete)
+    summary = borrado.find_and_clean_files(tmp_path, False, {"Rubi": {"case_sensitive": True}}, workers=2,
+                                           manifest_path=str(manifest_path), progress_interval=0.01)
+    # Ni el log ni el manifiesto cuentan como archivos a borrar
+    assert (summary["matched"], summary["kept"], summary["deleted"], summary["errors"]) == (2, 2, 0, 1)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    assert manifest["files"] == [] and manifest["summary"]["completed"]
+    assert "disco desconectado" in manifest["errors"][0]
+
+
+def test_manifest_is_closed_when_interrupted(tmp_path, borrado, monkeypatch):
+    (tmp_path / "otro.wav").write_bytes(b"")
+    manifest_path = tmp_path / "logs_file_cleanup" / "manifiesto.json"
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(borrado, "wait", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        borrado.find_and_clean_files(tmp_path, True, {"Rubi": {}}, manifest_path=str(manifest_path))
+    assert json.loads(manifest_path.read_text(encoding="utf-8"))["summary"]["completed"] is False
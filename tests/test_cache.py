@@ -0,0 +1,25 @@
+from conftest import load, vcp
+
+
+def test_cache_reuses_outputs_and_stems(tmp_path, make_engine, write_audio):
+    source = write_audio(tmp_path / "grabacion.wav", seconds=4.0)
+    cache = vcp.ResultCache(tmp_path / "cache", 1 << 30, model_name="pruebas")
+    plain = make_engine()
+    normalized = make_engine(normalize=True)
+
+    assert plain.process_files([source], plain.file_options(tmp_path / "out", cache=cache)) == 1
+    assert cache.stats == {"hits_outputs": 0, "hits_stems": 0, "misses": 1, "evicted": 0}
+
+    # Mismas opciones: se copian las salidas finales
+    (tmp_path / "out" / "grabacion_vocalclarity.wav").unlink()
+    assert plain.process_files([source], plain.file_options(tmp_path / "out", cache=cache)) == 1
+    assert cache.stats["hits_outputs"] == 1 and cache.stats["misses"] == 1
+    assert (tmp_path / "out" / "grabacion_vocalclarity.wav").exists()
+
+    # Solo cambia --normalize: se reutilizan los stems y el resultado es el de procesar sin caché
+    assert normalized.process_files([source], normalized.file_options(tmp_path / "cached", cache=cache)) == 1
+    assert cache.stats == {"hits_outputs": 1, "hits_stems": 1, "misses": 1, "evicted": 0}
+    normalized.process_files([source], normalized.file_options(tmp_path / "direct"))
+    cached = load(tmp_path / "cached" / "grabacion_vocalclarity.wav")
+    direct = load(tmp_path / "direct" / "grabacion_vocalclarity.wav")
+    assert (cached - direct).abs().max() < 1e-3
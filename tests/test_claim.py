@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from conftest import REPO_DIR, vcp
+
+# Un nodo: espera a la señal de salida, reclama con process_claimed y anota lo que procesa
+NODE = """
+import json, sys, time
+from pathlib import Path
+sys.path.insert(0, {repo!r})
+import VocalClarityPro as vcp
+
+root, claims, start, log = Path({root!r}), {claims!r}, Path({start!r}), {log!r}
+files = sorted(root.glob("*.wav"))
+board = vcp.ClaimBoard(claims, "pruebas", ttl=30.0)
+keys = {{f: board.key(f, root, f.stat().st_size, f.stat().st_mtime_ns) for f in files}}
+processed = []
+
+def run_batch(batch, on_result):
+    for file_path in batch:
+        time.sleep(0.1) # Lo que tardaría Demucs
+        processed.append(file_path.name)
+        on_result(file_path, True)
+    return len(batch)
+
+while not start.exists():
+    time.sleep(0.01)
+try:
+    vcp.process_claimed(files, keys, board, run_batch, poll_interval=0.1)
+finally:
+    board.close()
+Path(log).write_text(json.dumps(processed))
+"""
+
+
+def test_three_nodes_split_files_without_duplicates(tmp_path):
+    root = tmp_path / "compartida"
+    root.mkdir()
+    for i in range(12):
+        (root / f"grabacion{i:02d}.wav").write_bytes(b"RIFF" + bytes(i))
+    start = tmp_path / "salida"
+    logs = [tmp_path / f"nodo{i}.json" for i in range(3)]
+    nodes = [subprocess.Popen([sys.executable, "-c", NODE.format(repo=str(REPO_DIR), root=str(root),
+                                                                 claims=str(tmp_path / "claims"), start=str(start),
+                                                                 log=str(log))])
+             for log in logs]
+    time.sleep(0.5)
+    start.touch()
+    assert [node.wait(timeout=120) for node in nodes] == [0, 0, 0]
+
+    processed = [json.loads(log.read_text()) for log in logs]
+    names = [name for node in processed for name in node]
+    assert sorted(names) == sorted(f"grabacion{i:02d}.wav" for i in range(12))
+    assert all(node for node in processed), f"algún nodo no procesó nada: {[len(node) for node in processed]}"
+
+
+def test_stale_claim_is_recovered(tmp_path):
+    claims = tmp_path / "claims"
+    crashed = vcp.ClaimBoard(claims, "pruebas", ttl=600.0)
+    crashed._stop.set() # El nodo cae: deja de renovar su bloqueo
+    other = vcp.ClaimBoard(claims, "pruebas", ttl=600.0)
+    try:
+        key = other.key(tmp_path / "a.wav", tmp_path, 10, 1)
+        assert crashed.try_claim(key, "a.wav") == "claimed"
+        assert other.try_claim(key, "a.wav") == "busy"
+
+        lock_path = claims / f"{key}.lock"
+        expired = time.time() - 601
+        os.utime(lock_path, (expired, expired))
+        assert other.try_claim(key, "a.wav") == "claimed"
+        assert other.stats["recovered"] == 1
+        assert json.loads(lock_path.read_text())["token"] == other._held[key]
+        assert not list(claims.glob("*.stale"))
+
+        # El nodo caído ya no puede borrar el bloqueo recuperado
+        crashed._unlock(key)
+        assert lock_path.exists()
+        other.release(key, "a.wav", True)
+        assert not lock_path.exists()
+        assert crashed.try_claim(key, "a.wav") == "done"
+    finally:
+        crashed.close()
+        other.close()
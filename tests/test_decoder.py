@@ -0,0 +1,71 @@
+import io
+import shutil
+import stat
+import subprocess
+
+import numpy as np
+import pytest
+import torch
+import torchaudio
+
+from conftest import synthesize, vcp
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="hace falta ffmpeg para codificar y decodificar")
+
+
+def ffmpeg(*args):
+    return subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", *map(str, args)], check=True, capture_output=True).stdout
+
+
+def direct_decode(path, channels):
+    # Decodificación de referencia: muestras float32 en crudo, sin cabecera
+    raw = ffmpeg("-i", path, "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-")
+    return torch.from_numpy(np.frombuffer(raw, dtype=np.float32).reshape(-1, channels).T.copy())
+
+
+@pytest.fixture
+def read_only_inputs(tmp_path):
+    """Un .m4a y un .mp3 codificados con ffmpeg en una carpeta de solo lectura."""
+    folder = tmp_path / "entrada"
+    folder.mkdir()
+    source = tmp_path / "original.wav"
+    torchaudio.save(str(source), synthesize(4.0, 44100, 2, seed=7), 44100, encoding="PCM_S", bits_per_sample=16)
+    ffmpeg("-i", source, "-c:a", "aac", "-b:a", "128k", folder / "nota.m4a")
+    ffmpeg("-i", source, "-b:a", "128k", folder / "nota.mp3")
+    folder.chmod(stat.S_IRUSR | stat.S_IXUSR)
+    yield folder
+    folder.chmod(stat.S_IRWXU)
+
+
+@pytest.mark.parametrize("channels", [1, 2, 6]) # Con más de 2 canales ffmpeg escribe WAVE_FORMAT_EXTENSIBLE
+def test_wav_header_from_pipe(tmp_path, channels):
+    source = tmp_path / "original.wav"
+    torchaudio.save(str(source), synthesize(0.5, 22050, channels), 22050)
+    stream = io.BytesIO(ffmpeg("-i", source, "-f", "wav", "-acodec", "pcm_f32le", "-"))
+    assert vcp._read_wav_header(stream) == (channels, 22050)
+    samples = torch.from_numpy(np.frombuffer(stream.read(), dtype=np.float32).reshape(-1, channels).T.copy())
+    assert torch.equal(samples, direct_decode(source, channels))
+
+
+def test_pipe_decoder_reads_compressed_files_in_place(read_only_inputs, monkeypatch):
+    monkeypatch.setattr(vcp, "_decoder_by_extension", {})
+    before = sorted(p.name for p in read_only_inputs.iterdir())
+
+    # torchaudio no abre .m4a: se recurre a la tubería y la extensión queda anotada
+    waveform, sr = vcp.decode_audio(read_only_inputs / "nota.m4a")
+    assert vcp._decoder_by_extension == {".m4a": "pipe"}
+    assert sr == 44100
+    assert torch.equal(waveform, direct_decode(read_only_inputs / "nota.m4a", 2))
+
+    loads = []
+    monkeypatch.setattr(torchaudio, "load", lambda *args, **kwargs: loads.append(args))
+    again, _ = vcp.decode_audio(read_only_inputs / "nota.m4a")
+    assert not loads # La siguiente .m4a va directa a la tubería
+    assert torch.equal(again, waveform)
+
+    waveform, sr = vcp._decode_with_pipe(read_only_inputs / "nota.mp3", "ffmpeg")
+    assert sr == 44100
+    assert torch.equal(waveform, direct_decode(read_only_inputs / "nota.mp3", 2))
+
+    # Nada de temporales junto a la entrada (como root el permiso no lo impediría: se comprueba el contenido)
+    assert sorted(p.name for p in read_only_inputs.iterdir()) == before
@@ -0,0 +1,36 @@
+import math
+
+import pytest
+import torch
+
+from conftest import vcp
+
+# Diferencia RMS relativa admitida frente a noisereduce (float64 frente a float32)
+TOLERANCE = 1e-5
+
+
+def tone_with_noise(seconds, sr, channels):
+    t = torch.arange(int(seconds * sr)) / sr
+    tone = 0.3 * torch.sin(2 * math.pi * 440 * t) * (torch.sin(2 * math.pi * 0.5 * t) > 0)
+    return (tone + 0.05 * torch.randn(channels, t.shape[0], generator=torch.Generator().manual_seed(0))).float()
+
+
+@pytest.mark.parametrize("sr, seconds, channels", [(44100, 5.0, 2), (8000, 5.0, 1), (44100, 16.0, 2)],
+                         ids=["44k-estereo", "8k-mono", "44k-varios-tramos"])
+def test_torch_engine_matches_noisereduce(sr, seconds, channels):
+    nr = pytest.importorskip("noisereduce")
+    audio = tone_with_noise(seconds, sr, channels)
+    expected = torch.from_numpy(nr.reduce_noise(y=audio.numpy(), sr=sr)).float()
+    denoised = vcp.denoise_batch(audio.unsqueeze(0), sr, "torch")[0]
+    assert denoised.shape == expected.shape
+    assert (denoised - expected).pow(2).mean().sqrt() < TOLERANCE * expected.pow(2).mean().sqrt()
+
+
+@pytest.mark.parametrize("block", [4096, 100003])
+def test_streaming_denoiser_matches_whole_signal(block):
+    sr = 8000
+    audio = tone_with_noise(200.0, sr, 2).unsqueeze(0) # 1.6 millones de muestras: tres tramos
+    denoiser = vcp.StreamingDenoiser(sr)
+    parts = [denoiser.feed(audio[..., start:start + block]) for start in range(0, audio.shape[-1], block)]
+    streamed = torch.cat(parts + [denoiser.flush()], dim=-1)
+    assert (streamed - vcp.denoise_batch(audio, sr)).abs().max() < 1e-5
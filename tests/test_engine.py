@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import synthesize
+
+
+@pytest.mark.parametrize("audio", [torch.zeros(2, 0), np.zeros(0, dtype=np.float32), np.zeros((2, 0), dtype=np.int16)],
+                         ids=["torch", "numpy-mono", "int16"])
+def test_empty_audio_is_rejected(make_engine, audio):
+    with pytest.raises(ValueError, match="vacío"):
+        make_engine().process(audio, 16000)
+
+
+def test_two_stems_does_not_create_a_stems_folder(tmp_path, make_engine):
+    audio = synthesize(2.0, 16000, 1)
+    tracks = make_engine(two_stems="vocals").process(audio, 16000, output_dir=tmp_path, name="nota")
+    assert set(tracks) == {"vocals", "accompaniment"}
+    assert tracks["vocals"].shape == (2, audio.shape[-1])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["nota_accompaniment.wav", "nota_vocalclarity.wav"]
+
+
+def test_all_stems_go_to_their_folder(tmp_path, make_engine):
+    make_engine().process(synthesize(2.0, 16000, 2), 16000, output_dir=tmp_path, name="nota")
+    assert (tmp_path / "nota_vocalclarity.wav").exists()
+    assert sorted(p.name for p in (tmp_path / "nota").iterdir()) == ["nota_bass.wav", "nota_drums.wav", "nota_other.wav"]
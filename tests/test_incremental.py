@@ -0,0 +1,48 @@
+import re
+
+from conftest import load
+
+
+def pending(result):
+    # "[📒] Manifiesto ...: N archivo(s) nuevos o modificados, M sin cambios."
+    match = re.search(r"(\d+) archivo\(s\) nuevos o modificados, (\d+) sin cambios", result.stderr + result.stdout)
+    assert match, result.stderr
+    return int(match.group(1)), int(match.group(2))
+
+
+def test_incremental_skips_unchanged_and_reprocesses_changes(tmp_path, run_cli, write_audio):
+    first = write_audio(tmp_path / "in" / "primera.wav", seconds=3.0)
+    second = write_audio(tmp_path / "in" / "segunda.wav", seconds=3.0, seed=1)
+    outputs = {path: tmp_path / "processed_audio_clarity" / f"{path.stem}_vocalclarity.wav" for path in (first, second)}
+    args = ["--path", tmp_path / "in", "--incremental", "--profile", "fast"]
+
+    result = run_cli(args, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert pending(result) == (2, 0)
+    written = {path: output.stat().st_mtime_ns for path, output in outputs.items()}
+
+    result = run_cli(args, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert pending(result) == (0, 2)
+    assert {path: output.stat().st_mtime_ns for path, output in outputs.items()} == written
+
+    # Solo el archivo modificado vuelve a procesarse
+    write_audio(second, seconds=4.0, seed=2)
+    result = run_cli(args, tmp_path)
+    assert pending(result) == (1, 1)
+    assert outputs[first].stat().st_mtime_ns == written[first]
+    assert load(outputs[second]).shape[-1] == 4 * 44100
+
+    # Otras opciones de procesado invalidan todo el manifiesto
+    result = run_cli(args + ["--normalize"], tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert pending(result) == (2, 0)
+    assert outputs[first].stat().st_mtime_ns != written[first]
+
+
+def test_watch_rejects_a_single_file(tmp_path, run_cli, write_audio):
+    source = write_audio(tmp_path / "in" / "primera.wav", seconds=1.0)
+    result = run_cli(["--path", source, "--watch"], tmp_path)
+    assert result.returncode == 1
+    assert "--watch necesita que --path sea un directorio" in result.stdout
+    assert not (tmp_path / "processed_audio_clarity").exists()
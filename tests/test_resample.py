@@ -0,0 +1,51 @@
+import pytest
+import torch
+import torchaudio
+
+from conftest import synthesize, vcp
+
+
+@pytest.mark.parametrize("orig_freq, new_freq", [(8000, 44100), (48000, 44100)])
+def test_streaming_resampler_matches_whole_signal(orig_freq, new_freq):
+    audio = synthesize(3.0, orig_freq, 2, seed=5)
+    expected = vcp.resample(audio, orig_freq, new_freq)
+    # Bloques de tamaño arbitrario: de una muestra, menores que el contexto y mayores que varios periodos
+    generator = torch.Generator().manual_seed(0)
+    sizes = [1, 7, 255, 256, 257] + torch.randint(1, 20000, (50,), generator=generator).tolist()
+    resampler = vcp.StreamingResampler(orig_freq, new_freq)
+    pieces, start = [], 0
+    for size in sizes * 4:
+        if start >= audio.shape[-1]:
+            break
+        pieces.append(resampler.feed(audio[..., start:start + size]))
+        start += size
+    assert start >= audio.shape[-1]
+    pieces.append(resampler.flush())
+    streamed = torch.cat(pieces, dim=-1)
+    assert streamed.shape == expected.shape
+    assert (streamed - expected).abs().max() < 1e-5
+
+
+def test_resampler_kernel_is_reused():
+    vcp.get_resampler.cache_clear()
+    audio = synthesize(1.0, 16000, 2)
+    first = vcp.resample(audio, 16000, 44100)
+    second = vcp.resample(audio[:1], 16000, 44100)
+    info = vcp.get_resampler.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+    assert torch.equal(first[:1], second)
+    assert vcp.resample(audio, 44100, 44100) is audio # Misma frecuencia: ni kernel ni copia
+    assert vcp.get_resampler.cache_info().misses == 1
+
+
+@pytest.mark.parametrize("output_sr", ["source", "model"])
+def test_output_sample_rate(tmp_path, make_engine, write_audio, output_sr):
+    source = write_audio(tmp_path / "nota.wav", seconds=2.5, sr=16000, channels=1)
+    engine = make_engine()
+    engine.process_files([source], engine.file_options(tmp_path / "out", output_sr=output_sr))
+    info = torchaudio.info(str(tmp_path / "out" / "nota_vocalclarity.wav"))
+    if output_sr == "source":
+        assert (info.sample_rate, info.num_frames) == (16000, 40000)
+    else:
+        # Sin volver a la frecuencia de entrada: los stems se guardan tal como salen del modelo
+        assert (info.sample_rate, info.num_frames) == (44100, vcp.resample(torch.zeros(1, 40000), 16000, 44100).shape[-1])
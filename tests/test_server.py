@@ -0,0 +1,85 @@
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import REPO_DIR
+from vcp_client import Client
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="hace falta un socket Unix")
+
+# serve() instala sus manejadores de señales, así que corre en el hilo principal de otro proceso
+SERVER = """
+import sys, time
+from pathlib import Path
+sys.path[:0] = [{repo!r}, {utils!r}]
+import VocalClarityPro as vcp
+from benchmark import StandInSeparator
+
+class GatedStandIn(StandInSeparator):
+    # No separa hasta que exista el archivo de paso: así los trabajos siguientes siguen en cola
+    def forward(self, mix):
+        while not Path({gate!r}).exists():
+            time.sleep(0.01)
+        return super().forward(mix)
+
+engine = vcp.VocalClarityEngine(GatedStandIn().eval(), accel="none", profile="fast")
+vcp.serve(vcp.JobServer(engine.model, engine.file_options({out!r})), socket_path={socket!r})
+"""
+
+
+def wait_for(condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "tiempo de espera agotado"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def server(tmp_path):
+    paths = {"socket": tmp_path / "vcp.sock", "gate": tmp_path / "paso", "out": tmp_path / "out"}
+    script = SERVER.format(repo=str(REPO_DIR), utils=str(REPO_DIR / "Utilidades"),
+                           **{key: str(path) for key, path in paths.items()})
+    process = subprocess.Popen([sys.executable, "-c", script])
+    try:
+        wait_for(lambda: paths["socket"].exists() or process.poll() is not None)
+        assert process.poll() is None, "el servidor terminó al arrancar"
+        yield process, Client(socket_path=str(paths["socket"])), paths
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_submit_cancel_and_graceful_shutdown(server, tmp_path, write_audio):
+    process, client, paths = server
+    first = write_audio(tmp_path / "in" / "primera.wav", seconds=3.0)
+    second = write_audio(tmp_path / "in" / "segunda.wav", seconds=3.0, seed=1)
+
+    status, payload = client.submit(tmp_path / "in" / "no_existe.wav")
+    assert status == 400 and "no existe" in payload["error"]
+
+    status, job = client.submit(first)
+    assert status == 202
+    wait_for(lambda: client.status(job["id"])[1]["status"] == "running")
+
+    # Con un solo hilo ocupado, el segundo trabajo sigue en cola y se puede cancelar
+    status, queued = client.submit(second, denoise=True)
+    assert status == 202 and queued["status"] == "queued"
+    status, cancelled = client.request("DELETE", f"/jobs/{queued['id']}")
+    assert status == 200 and cancelled["status"] == "cancelled"
+    assert client.request("DELETE", f"/jobs/{job['id']}")[0] == 409
+
+    paths["gate"].touch()
+    done, = client.wait([job["id"]], interval=0.1)
+    assert done["status"] == "done"
+    assert (paths["out"] / "primera_vocalclarity.wav").exists()
+    assert not (paths["out"] / "segunda_vocalclarity.wav").exists()
+    health = client.request("GET", "/health")[1]
+    assert (health["ok"], health["failed"], health["queued"]) == (1, 0, 0)
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=60) == 0
+    assert not paths["socket"].exists()
@@ -0,0 +1,48 @@
+import torch
+import torchaudio
+
+from conftest import StandInSeparator, load, synthesize, vcp
+
+SR = 44100
+
+
+def speech_with_pause(noise_db=-75.0):
+    # 3 s de voz, 4 s de ruido de línea muy bajo y otros 3 s de voz
+    speech = synthesize(3.0, SR, 2, seed=0)
+    pause = torch.randn(2, 4 * SR, generator=torch.Generator().manual_seed(1)) * 10 ** (noise_db / 20)
+    return torch.cat([speech, pause, synthesize(3.0, SR, 2, seed=1)], dim=-1)
+
+
+def test_find_active_regions_leaves_out_the_pause():
+    regions = vcp.find_active_regions(speech_with_pause(), SR, padding_seconds=0.3)
+    assert len(regions) == 2
+    (_, first_end), (second_start, _) = regions
+    assert 3.0 * SR <= first_end <= 3.4 * SR
+    assert 6.6 * SR <= second_start <= 7.0 * SR
+
+
+def test_silent_regions_skip_the_model(tmp_path, monkeypatch, make_engine):
+    mix = speech_with_pause()
+    path = tmp_path / "llamada.wav"
+    torchaudio.save(str(path), mix, SR, encoding="PCM_S", bits_per_sample=16)
+    engine = make_engine(silence_options={"padding_seconds": 0.3})
+    run_model = vcp.run_model
+    separated = []
+
+    def counting_run_model(model, chunk, device):
+        separated.append(chunk.shape[-1])
+        return run_model(model, chunk, device)
+
+    monkeypatch.setattr(vcp, "run_model", counting_run_model)
+    assert engine.process_files([path], engine.file_options(tmp_path / "out")) == 1
+    # Solo los dos tramos de voz (con su margen) pasan por el modelo
+    assert len(separated) == 2
+    assert sum(separated) <= 6.8 * SR
+
+    vocals = load(tmp_path / "out" / "llamada_vocalclarity.wav")
+    assert vocals.shape[-1] == mix.shape[-1]
+    assert vocals[:, int(3.5 * SR):int(6.5 * SR)].abs().max() == 0
+    # Dentro de la voz, el resultado es el de separar el archivo completo
+    full = StandInSeparator()(mix.unsqueeze(0))[0, 3]
+    speech = slice(int(0.5 * SR), int(2.5 * SR))
+    assert (vocals[:, speech] - full[:, speech]).abs().max() < 1e-3
@@ -0,0 +1,47 @@
+import shutil
+import subprocess
+
+import pytest
+import torch
+import torchaudio
+
+from conftest import load, vcp
+
+# Unas pocas unidades del último bit de PCM16: el resto de diferencias vendría del modo streaming
+TOLERANCE = 5e-4
+
+
+@pytest.mark.parametrize("sr", [44100, 8000])
+@pytest.mark.parametrize("options", [{"denoise": True}, {"normalize": True}, {"denoise": True, "normalize": True}],
+                         ids=["denoise", "normalize", "denoise-normalize"])
+def test_stream_matches_whole_file(tmp_path, make_engine, write_audio, sr, options):
+    # 25 s a 44.1 kHz superan un tramo de la puerta espectral (600000 muestras) y varias ventanas de 6 s
+    source = write_audio(tmp_path / "grabacion.wav", seconds=25.0, sr=sr, seed=3)
+    engine = make_engine(**options)
+    engine.process_files([source], engine.file_options(tmp_path / "normal"))
+    engine.process_files([source], engine.file_options(tmp_path / "stream", stream=True, chunk_seconds=6.0,
+                                                       overlap_seconds=1.0))
+    expected = load(tmp_path / "normal" / "grabacion_vocalclarity.wav")
+    streamed = load(tmp_path / "stream" / "grabacion_vocalclarity.wav")
+    assert streamed.shape == expected.shape
+    assert (streamed - expected).abs().max() < TOLERANCE
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="hace falta ffmpeg para crear el MP3")
+def test_compressed_blocks_decode_in_one_pass(tmp_path, monkeypatch, write_audio):
+    source = write_audio(tmp_path / "grabacion.wav", seconds=5.0)
+    target = tmp_path / "grabacion.mp3"
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", str(source), str(target)], check=True)
+    loads = []
+    load_audio = torchaudio.load
+    monkeypatch.setattr(torchaudio, "load", lambda *args, **kwargs: loads.append(kwargs) or load_audio(*args, **kwargs))
+
+    blocks = list(vcp.iter_audio_blocks(target, 4096))
+    assert not loads # Un MP3 no se relee desde el principio en cada bloque: pasa entero por la tubería
+    assert all(block.shape[-1] == 4096 for block, _ in blocks[:-1])
+    expected, sr = vcp._decode_with_pipe(target, "ffmpeg")
+    assert {block_sr for _, block_sr in blocks} == {sr}
+    assert torch.equal(torch.cat([block for block, _ in blocks], dim=-1), expected)
+
+    list(vcp.iter_audio_blocks(source, 4096))
+    assert [kwargs["frame_offset"] for kwargs in loads[:3]] == [0, 4096, 8192] # El WAV sí se lee saltando
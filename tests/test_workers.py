@@ -0,0 +1,59 @@
+import os
+
+import demucs.pretrained
+import torch
+
+from conftest import StandInSeparator, load, vcp
+
+
+class RecordingStandIn(StandInSeparator):
+    # Anota en un archivo qué proceso separa y con qué memoria de pesos
+    def __init__(self, log_path):
+        super().__init__()
+        self.log_path = str(log_path)
+
+    def forward(self, mix):
+        with open(self.log_path, "a") as log:
+            log.write(f"{os.getpid()} {self.weight.data_ptr()} {int(self.weight.is_shared())}\n")
+        return super().forward(mix)
+
+
+def write_inputs(folder, write_audio):
+    files = [write_audio(folder / f"clip{i}.wav", seconds=2.0 + i, seed=i) for i in range(3)]
+    broken = folder / "roto.wav"
+    broken.write_bytes(b"RIFF esto no es audio")
+    return files + [broken]
+
+
+def test_workers_share_the_parent_model(tmp_path, monkeypatch, write_audio):
+    files = write_inputs(tmp_path / "in", write_audio)
+
+    def reload(*args, **kwargs):
+        raise AssertionError("un worker volvió a cargar el modelo")
+
+    monkeypatch.setattr(demucs.pretrained, "get_model", reload)
+    model = RecordingStandIn(tmp_path / "forward.log").eval()
+    engine = vcp.VocalClarityEngine(model, accel="none", profile="fast")
+    assert engine.process_files(files, engine.file_options(tmp_path / "out"), workers=2) == 3
+
+    calls = [line.split() for line in (tmp_path / "forward.log").read_text().splitlines()]
+    assert len(calls) == 3
+    for pid, data_ptr, shared in calls:
+        assert int(pid) != os.getpid()
+        # Los pesos de los workers son los del proceso principal, en memoria compartida
+        assert int(data_ptr) == model.weight.data_ptr() and shared == "1"
+    assert model.weight.is_shared()
+
+
+def test_workers_match_sequential_run(tmp_path, run_cli, write_audio):
+    write_inputs(tmp_path / "in", write_audio)
+    for name, extra in (("secuencial", []), ("workers", ["--workers", "2"])):
+        (tmp_path / name).mkdir()
+        result = run_cli(["--path", tmp_path / "in", "--profile", "fast", *extra], tmp_path / name)
+        assert result.returncode == 0, result.stdout
+        assert "1 de 4 archivos no se pudieron procesar" in result.stdout
+
+    for i in range(3):
+        output = f"processed_audio_clarity/clip{i}_vocalclarity.wav"
+        assert torch.equal(load(tmp_path / "workers" / output), load(tmp_path / "secuencial" / output))
+    assert not (tmp_path / "workers" / "processed_audio_clarity" / "roto_vocalclarity.wav").exists()